@@ -0,0 +1,643 @@
+import struct
+from contextlib import contextmanager
+from typing import List, Generator
+
+from data_structures.btree.btree import BTreeNodeKey
+from data_structures.btree.btree_node_manager import BTreeNodeManager
+from data_structures.btree.pointer_list_manager import PointerListManager, DEFAULT_BLOCK_SIZE
+from data_structures.hash_table import HashTable
+from data_structures.lru_cache import LRUCache
+from utils.checksum import ROLLING_HASH
+from utils.errors import ParseError, TableError
+
+NODE_METADATA_FORMAT = "=?iiqq"  # -> is leaf, keys count, children count, previous leaf, next leaf
+NODE_METADATA_SIZE = struct.calcsize(NODE_METADATA_FORMAT)
+MIN_INTERNAL_KEYS = 3
+
+
+def _bisect_keys(keys: List[BTreeNodeKey], key, after_equal: bool) -> int:
+    """
+        Index of the first key which is above `key` (after_equal) or not below it (binary search).
+    """
+    low = 0
+    high = len(keys)
+    while low < high:
+        middle = (low + high) // 2
+        middle_key = keys[middle].key
+        if middle_key < key or (after_equal and middle_key == key):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+class BPlusTreeNode:
+    def __init__(self, offset: int | None = None, is_leaf: bool = True, keys=None, children=None,
+                 prev_leaf: int = -1, next_leaf: int = -1):
+        """
+        Args:
+            keys - the (key, pointers) entries of a leaf or the separators of an internal node.
+            prev_leaf, next_leaf - offsets of the neighbouring leaves (-1 at the ends and for internal nodes).
+        """
+        self.offset = offset
+        self.is_leaf = is_leaf
+        self.keys: List[BTreeNodeKey] = keys if keys is not None else []
+        self.children: List[int] = children if children is not None else []
+        self.prev_leaf = prev_leaf
+        self.next_leaf = next_leaf
+
+    def serialize_node(self, key_type, key_max_size, max_keys: int, page_size: int) -> bytes:
+        """
+            Leaves store full keys, internal nodes only the separators and (max_keys + 1) children.
+            Both are padded to page_size, so every node takes the same space in the file.
+        """
+        key_length = BTreeNodeKey.key_size(key_type, key_max_size, with_pointers=self.is_leaf)
+        metadata = struct.pack(NODE_METADATA_FORMAT, self.is_leaf, len(self.keys), len(self.children),
+                               self.prev_leaf, self.next_leaf)
+
+        keys_data = b"".join(key.serialize_key(with_pointers=self.is_leaf) for key in self.keys)
+        keys_data += b"\x00" * ((max_keys - len(self.keys)) * key_length)
+
+        children_data = b""
+        if not self.is_leaf:
+            children_data = struct.pack(f"{len(self.children)}q", *self.children)
+            children_data += struct.pack("q", -1) * (max_keys + 1 - len(self.children))
+
+        node_data = metadata + keys_data + children_data
+        node_data += b"\x00" * (page_size - len(node_data))
+
+        return struct.pack("i", len(node_data)) + node_data
+
+    @staticmethod
+    def deserialize_node(node_data: bytes, node_offset: int, key_type, key_max_size,
+                         max_leaf_keys: int, max_internal_keys: int):
+        is_leaf, keys_num, children_num, prev_leaf, next_leaf = struct.unpack_from(NODE_METADATA_FORMAT, node_data, 0)
+        offset = NODE_METADATA_SIZE
+
+        key_length = BTreeNodeKey.key_size(key_type, key_max_size, with_pointers=is_leaf)
+        keys = []
+        for _ in range(keys_num):
+            keys.append(BTreeNodeKey.deserialize_key(node_data[offset:offset + key_length], with_pointers=is_leaf))
+            offset += key_length
+
+        children = []
+        if not is_leaf:
+            offset += (max_internal_keys - keys_num) * key_length
+            children = list(struct.unpack_from(f"{children_num}q", node_data, offset))
+        elif keys_num > max_leaf_keys:
+            raise TableError(f"Corrupted file: BPlusTree leaf with offset {node_offset} has too many keys")
+
+        return BPlusTreeNode(offset=node_offset, is_leaf=is_leaf, keys=keys, children=children,
+                             prev_leaf=prev_leaf, next_leaf=next_leaf)
+
+    def copy(self):
+        """
+            A copy which can be modified without affecting this node (used by the node cache).
+        """
+        keys = [BTreeNodeKey(key.key, key.pointers[:], key.key_max_size) for key in self.keys]
+        return BPlusTreeNode(offset=self.offset, is_leaf=self.is_leaf, keys=keys, children=self.children[:],
+                             prev_leaf=self.prev_leaf, next_leaf=self.next_leaf)
+
+    def __repr__(self):
+        return (f"Offset: {self.offset} | Keys: {self.keys} | Children: {self.children}"
+                f" | Leaves: {self.prev_leaf} <-> {self.next_leaf}")
+
+
+class BPlusTree:
+    """
+    A B+tree stored with the same file framing as the BTree (BTreeNodeManager and PointerListManager):
+        - all (key, pointers) entries live in the leaves, which are chained with previous/next offsets,
+          so ordered and range scans walk the leaves without going back up the tree;
+        - internal nodes hold only separators - a key equal to a separator is in its right subtree.
+          Without the pointers a separator is smaller than an entry, so internal nodes have a higher fan-out;
+        - t (stored in the file header) sets the leaf size: at most (2 * t - 1) entries per leaf.
+          Internal nodes get as many separators as fit in the size of a leaf;
+        - deletes are lazy - a leaf is never merged with its neighbours, it is unlinked once it is empty.
+    """
+
+    def __init__(self, node_file_path, pointer_file_path, node_cache_size: int = 256, checksum: str = ROLLING_HASH):
+        self.manager = BTreeNodeManager(node_file_path, checksum)
+        self.pointer_manager = PointerListManager(pointer_file_path, checksum)
+        self.node_cache = LRUCache(node_cache_size)
+        self.max_leaf_keys, self.max_internal_keys, self.page_size = self._page_layout(self.manager.t,
+                                                                                       self.manager.key_type,
+                                                                                       self.manager.key_max_size)
+
+    @property
+    def t(self):
+        return self.manager.t
+
+    @staticmethod
+    def _page_layout(t: int, key_type, key_max_size) -> tuple:
+        """
+            Returns the max keys of a leaf, the max separators of an internal node and the size of a node.
+        """
+        max_leaf_keys = 2 * t - 1
+        leaf_size = NODE_METADATA_SIZE + max_leaf_keys * BTreeNodeKey.key_size(key_type, key_max_size)
+
+        separator_size = BTreeNodeKey.key_size(key_type, key_max_size, with_pointers=False)
+        max_internal_keys = max((leaf_size - NODE_METADATA_SIZE - 8) // (separator_size + 8), MIN_INTERNAL_KEYS)
+        internal_size = NODE_METADATA_SIZE + max_internal_keys * separator_size + (max_internal_keys + 1) * 8
+
+        return max_leaf_keys, max_internal_keys, max(leaf_size, internal_size)
+
+    @staticmethod
+    def order_for_node_size(node_size: int, key_type, key_max_size=0) -> int:
+        """
+            The largest t for which a leaf still fits in node_size bytes.
+            A stored leaf takes: hash (4) + size (4) + metadata (25) + (2t - 1) keys.
+        """
+        key_size = BTreeNodeKey.key_size(key_type, key_max_size)
+        max_leaf_keys = (node_size - 4 - 4 - NODE_METADATA_SIZE) // key_size
+
+        return max((max_leaf_keys + 1) // 2, 2)
+
+    @staticmethod
+    def node_size_for_order(t: int, key_type, key_max_size=0) -> int:
+        """
+            The bytes a stored node (hash + size + page) takes with leaves of (2 * t - 1) entries.
+        """
+        _, _, page_size = BPlusTree._page_layout(t, key_type, key_max_size)
+        return 4 + 4 + page_size
+
+    @staticmethod
+    def create_tree(t, key_type, key_max_size, node_file_path, pointer_file_path, checksum: str = ROLLING_HASH,
+                    pointer_block_size: int = DEFAULT_BLOCK_SIZE):
+        max_leaf_keys, _, page_size = BPlusTree._page_layout(t, key_type, key_max_size)
+        root_bytes = BPlusTreeNode().serialize_node(key_type, key_max_size, max_leaf_keys, page_size)
+        manager = BTreeNodeManager.create_node_manager(node_file_path, t, key_type, key_max_size, checksum)
+        PointerListManager.create_pointer_list_manager(pointer_file_path, checksum, pointer_block_size)
+        manager.save_node(None, root_bytes)
+
+        return BPlusTree(node_file_path, pointer_file_path, checksum=checksum)
+
+    def _serialize_node(self, node: BPlusTreeNode) -> bytes:
+        max_keys = self.max_leaf_keys if node.is_leaf else self.max_internal_keys
+        return node.serialize_node(self.manager.key_type, self.manager.key_max_size, max_keys, self.page_size)
+
+    def _load_node(self, offset: int) -> BPlusTreeNode:
+        cached_node = self.node_cache.get(offset)
+
+        if cached_node is None:
+            node_bytes = self.manager.load_node(offset)
+            cached_node = BPlusTreeNode.deserialize_node(node_bytes,
+                                                         offset,
+                                                         self.manager.key_type,
+                                                         self.manager.key_max_size,
+                                                         self.max_leaf_keys,
+                                                         self.max_internal_keys)
+            self.node_cache.put(offset, cached_node)
+
+        # Callers modify the loaded nodes, so the cached one is never handed out
+        return cached_node.copy()
+
+    def _save_node(self, node: BPlusTreeNode) -> int:
+        new_offset = self.manager.save_node(node.offset, self._serialize_node(node))
+        node.offset = new_offset
+
+        self.node_cache.put(new_offset, node.copy())
+        return node.offset
+
+    def _release_node(self, offset: int):
+        """
+            Hand the slot of a node which is no longer part of the tree back to the node manager.
+        """
+        self.node_cache.delete(offset)
+        self.manager.release_node(offset)
+
+    @property
+    def cache_hit_rate(self) -> float:
+        return self.node_cache.hit_rate
+
+    @property
+    def root(self) -> BPlusTreeNode:
+        return self._load_node(self.manager.root_offset)
+
+    @contextmanager
+    def deferred_headers(self):
+        """
+            Write the headers of the node and pointer list files once,
+            after a whole logical operation (or a batch of them) is done.
+        """
+        with self.manager.deferred_header(), self.pointer_manager.deferred_header():
+            yield self
+
+    def bulk_load(self, entries, entries_count: int, write_buffer_size: int = 1024 * 1024):
+        """
+            Build the tree bottom-up from `entries` - (key, pointers) pairs sorted by key with unique keys.
+            The tree must be freshly created (only an empty root).
+
+            The leaves are written packed one after another and linked to their neighbours,
+            followed by each internal level. The first key of every node except the leftmost one
+            of its parent becomes a separator in the parent.
+        """
+        if entries_count == 0:
+            return
+
+        with self.deferred_headers():
+            self._bulk_load(entries, entries_count, write_buffer_size)
+
+    def _bulk_load(self, entries, entries_count: int, write_buffer_size: int):
+        key_max_size = self.manager.key_max_size
+
+        # Every level is described by: nodes count, base size per node, nodes with one extra key/child
+        nodes_count = (entries_count + self.max_leaf_keys - 1) // self.max_leaf_keys
+        levels_plan = [(nodes_count, entries_count // nodes_count, entries_count % nodes_count)]
+        while nodes_count > 1:
+            children_count = nodes_count
+            nodes_count = (children_count + self.max_internal_keys) // (self.max_internal_keys + 1)
+            levels_plan.append((nodes_count, children_count // nodes_count, children_count % nodes_count))
+
+        node_slot_size = 4 + len(self._serialize_node(BPlusTreeNode()))  # -> hash + node data
+
+        # The empty root is overwritten by the first leaf
+        levels_start = []
+        next_level_start = self.manager.root_offset
+        for nodes_count, _, _ in levels_plan:
+            levels_start.append(next_level_start)
+            next_level_start += nodes_count * node_slot_size
+
+        levels_count = len(levels_plan)
+        current_nodes = [BPlusTreeNode(is_leaf=(level == 0)) for level in range(levels_count)]
+        first_keys = [None] * levels_count  # -> the smallest key under the current node of each level
+        children_counts = [0] * levels_count
+        nodes_index = [0] * levels_count
+        next_children = [0] * levels_count
+        buffers = [[] for _ in range(levels_count)]
+        buffers_start = levels_start[:]
+        buffers_size = [0] * levels_count
+
+        def flush_level(level):
+            if buffers[level]:
+                self.manager.write_frames(buffers_start[level], b"".join(buffers[level]))
+                buffers_start[level] += buffers_size[level]
+                buffers[level] = []
+                buffers_size[level] = 0
+
+        def planned_size(level):
+            _, base_size, extra_nodes = levels_plan[level]
+            return base_size + 1 if nodes_index[level] < extra_nodes else base_size
+
+        def add_child(level, first_key):
+            node = current_nodes[level]
+            if children_counts[level] == 0:
+                first_keys[level] = first_key
+            else:
+                node.keys.append(BTreeNodeKey(first_key, [-1, -1], key_max_size))
+
+            children_counts[level] += 1
+            if children_counts[level] == planned_size(level):
+                finish_node(level)
+
+        def finish_node(level):
+            node = current_nodes[level]
+            if level == 0:
+                node_offset = levels_start[0] + nodes_index[0] * node_slot_size
+                if nodes_index[0] > 0:
+                    node.prev_leaf = node_offset - node_slot_size
+                if nodes_index[0] < levels_plan[0][0] - 1:
+                    node.next_leaf = node_offset + node_slot_size
+            else:
+                node.children = [levels_start[level - 1] + (next_children[level] + c) * node_slot_size
+                                 for c in range(children_counts[level])]
+                next_children[level] += children_counts[level]
+
+            node_frame = self.manager.frame_node(self._serialize_node(node))
+            buffers[level].append(node_frame)
+            buffers_size[level] += len(node_frame)
+            if buffers_size[level] >= write_buffer_size:
+                flush_level(level)
+
+            nodes_index[level] += 1
+            current_nodes[level] = BPlusTreeNode(is_leaf=(level == 0))
+            children_counts[level] = 0
+
+            if level + 1 < levels_count:
+                add_child(level + 1, first_keys[level])
+
+        for key, pointers in entries:
+            list_pointer = -1
+            if len(pointers) > 1:
+                list_pointer = self.pointer_manager.create_pointer_list_from(pointers[1:])
+
+            leaf = current_nodes[0]
+            if not leaf.keys:
+                first_keys[0] = key
+            leaf.keys.append(BTreeNodeKey(key, [pointers[0], list_pointer], key_max_size))
+            if len(leaf.keys) == planned_size(0):
+                finish_node(0)
+
+        for level in range(levels_count):
+            flush_level(level)
+
+        self.manager.root_offset = levels_start[-1]
+        self.manager.update_header()
+        self.node_cache.clear()
+
+    def _descend(self, key) -> tuple:
+        """
+            Returns the leaf where `key` belongs and the path to it - [node, child index] of every internal node.
+        """
+        path = []
+        node = self.root
+        while not node.is_leaf:
+            child_index = _bisect_keys(node.keys, key, after_equal=True)
+            path.append([node, child_index])
+            node = self._load_node(node.children[child_index])
+
+        return path, node
+
+    def _edge_leaf(self, last: bool) -> BPlusTreeNode:
+        node = self.root
+        while not node.is_leaf:
+            node = self._load_node(node.children[-1 if last else 0])
+        return node
+
+    def _key_pointers(self, node_key: BTreeNodeKey):
+        yield from self.pointer_manager.traverse_pointer_list(node_key.pointers[1], node_key.pointers[0])
+
+    def search(self, key) -> Generator | None:
+        _, leaf = self._descend(key)
+        key_index = _bisect_keys(leaf.keys, key, after_equal=False)
+        if key_index < len(leaf.keys) and leaf.keys[key_index].key == key:
+            return self._key_pointers(leaf.keys[key_index])
+        return None
+
+    def insert(self, key, pointer: int):
+        with self.deferred_headers():
+            self._insert(key, pointer)
+
+    def _insert(self, key, pointer: int):
+        path, leaf = self._descend(key)
+        key_index = _bisect_keys(leaf.keys, key, after_equal=False)
+
+        if key_index < len(leaf.keys) and leaf.keys[key_index].key == key:
+            existing_key = leaf.keys[key_index]
+            if existing_key.pointers[1] == -1:
+                existing_key.pointers[1] = self.pointer_manager.create_pointer_list(pointer)
+                self._save_node(leaf)
+            else:
+                self.pointer_manager.add_pointer_to_pointer_list(existing_key.pointers[1], pointer)
+            return
+
+        leaf.keys.insert(key_index, BTreeNodeKey(key, [pointer, -1], self.manager.key_max_size))
+        if len(leaf.keys) > self.max_leaf_keys:
+            self._split(path, leaf)
+        else:
+            self._save_node(leaf)
+
+    def _split(self, path: list, node: BPlusTreeNode):
+        """
+            Split the overflowing node in two and add the separator to its parent,
+            splitting the parents which overflow in turn. A split root grows the tree in height.
+        """
+        while True:
+            middle = len(node.keys) // 2
+            if node.is_leaf:
+                new_node = BPlusTreeNode(is_leaf=True, keys=node.keys[middle:],
+                                         prev_leaf=node.offset, next_leaf=node.next_leaf)
+                node.keys = node.keys[:middle]
+                separator = BTreeNodeKey(new_node.keys[0].key, [-1, -1], self.manager.key_max_size)
+                self._save_node(new_node)
+
+                if node.next_leaf != -1:
+                    next_leaf = self._load_node(node.next_leaf)
+                    next_leaf.prev_leaf = new_node.offset
+                    self._save_node(next_leaf)
+                node.next_leaf = new_node.offset
+            else:
+                separator = node.keys[middle]
+                new_node = BPlusTreeNode(is_leaf=False, keys=node.keys[middle + 1:], children=node.children[middle + 1:])
+                node.keys = node.keys[:middle]
+                node.children = node.children[:middle + 1]
+                self._save_node(new_node)
+
+            self._save_node(node)
+
+            if not path:
+                new_root = BPlusTreeNode(is_leaf=False, keys=[separator], children=[node.offset, new_node.offset])
+                self.manager.root_offset = self._save_node(new_root)
+                self.manager.update_header()
+                return
+
+            parent, child_index = path.pop()
+            parent.keys.insert(child_index, separator)
+            parent.children.insert(child_index + 1, new_node.offset)
+            if len(parent.keys) <= self.max_internal_keys:
+                self._save_node(parent)
+                return
+
+            node = parent
+
+    def _remove_key(self, path: list, leaf: BPlusTreeNode, key_index: int):
+        """
+            Remove an entry from its leaf. An empty leaf (unless it is the only one) is unlinked
+            from its neighbours and from its parent, and so are the internal nodes left without children.
+        """
+        leaf.keys.pop(key_index)
+        if leaf.keys or (leaf.prev_leaf == -1 and leaf.next_leaf == -1):
+            self._save_node(leaf)
+            return
+
+        if leaf.prev_leaf != -1:
+            prev_leaf = self._load_node(leaf.prev_leaf)
+            prev_leaf.next_leaf = leaf.next_leaf
+            self._save_node(prev_leaf)
+
+        if leaf.next_leaf != -1:
+            next_leaf = self._load_node(leaf.next_leaf)
+            next_leaf.prev_leaf = leaf.prev_leaf
+            self._save_node(next_leaf)
+        self._release_node(leaf.offset)
+
+        # There is another leaf, so some node on the path keeps at least one child
+        while path:
+            parent, child_index = path.pop()
+            parent.children.pop(child_index)
+            if parent.keys:
+                parent.keys.pop(max(child_index - 1, 0))
+
+            if parent.children:
+                self._save_node(parent)
+                break
+            self._release_node(parent.offset)
+
+        root = self.root
+        while not root.is_leaf and len(root.children) == 1:
+            self.manager.root_offset = root.children[0]
+            self.manager.update_header()
+            self._release_node(root.offset)
+            root = self.root
+
+    def delete(self, key):
+        with self.deferred_headers():
+            path, leaf = self._descend(key)
+            key_index = _bisect_keys(leaf.keys, key, after_equal=False)
+            if key_index < len(leaf.keys) and leaf.keys[key_index].key == key:
+                self._remove_key(path, leaf, key_index)
+
+    def delete_pointer(self, key, pointer: int):
+        with self.deferred_headers():
+            self._delete_pointers(key, [pointer])
+
+    def delete_pointers(self, key, pointers: list):
+        with self.deferred_headers():
+            self._delete_pointers(key, pointers)
+
+    def _delete_pointers(self, key, pointers: list):
+        """
+            Remove pointers of one key with a single search and a single pass over its pointer list.
+        """
+        path, leaf = self._descend(key)
+        key_index = _bisect_keys(leaf.keys, key, after_equal=False)
+        if key_index >= len(leaf.keys) or leaf.keys[key_index].key != key:
+            return
+
+        searched_key = leaf.keys[key_index]
+
+        pointers_to_delete = HashTable(size=max(len(pointers), 1))
+        for pointer in pointers:
+            pointers_to_delete[pointer] = True
+
+        main_pointer = searched_key.pointers[0]
+        secondary_pointer_to_file = searched_key.pointers[1]
+        if secondary_pointer_to_file != -1:
+            secondary_pointer_to_file = self.pointer_manager.delete_pointers_from_pointer_list(secondary_pointer_to_file,
+                                                                                               pointers_to_delete)
+
+        if pointers_to_delete[main_pointer] is not None:
+            if secondary_pointer_to_file == -1:
+                self._remove_key(path, leaf, key_index)
+                return
+
+            main_pointer = self.pointer_manager.get_first_available_pointer(secondary_pointer_to_file)
+            secondary_pointer_to_file = self.pointer_manager.delete_pointer_from_pointer_list(secondary_pointer_to_file,
+                                                                                              main_pointer)
+
+        searched_key.pointers[0] = main_pointer
+        searched_key.pointers[1] = secondary_pointer_to_file
+        self._save_node(leaf)
+
+    def range_search(self, lower=None, upper=None, lower_inclusive: bool = True, upper_inclusive: bool = True,
+                     reverse: bool = False):
+        """
+            Pointers of the keys between `lower` and `upper` (None leaves that side open), in key order
+            or in reverse order. The cursor descends once to the leaf where the range starts
+            and then follows the leaf links.
+        """
+        if reverse:
+            yield from self._reverse_range_search(lower, upper, lower_inclusive, upper_inclusive)
+            return
+
+        if lower is None:
+            leaf = self._edge_leaf(last=False)
+            key_index = 0
+        else:
+            _, leaf = self._descend(lower)
+            key_index = _bisect_keys(leaf.keys, lower, after_equal=not lower_inclusive)
+
+        while True:
+            while key_index < len(leaf.keys):
+                node_key = leaf.keys[key_index]
+                if upper is not None and (node_key.key > upper or (not upper_inclusive and node_key.key == upper)):
+                    return
+
+                yield from self._key_pointers(node_key)
+                key_index += 1
+
+            if leaf.next_leaf == -1:
+                return
+            leaf = self._load_node(leaf.next_leaf)
+            key_index = 0
+
+    def _reverse_range_search(self, lower, upper, lower_inclusive: bool, upper_inclusive: bool):
+        if upper is None:
+            leaf = self._edge_leaf(last=True)
+            key_index = len(leaf.keys) - 1
+        else:
+            _, leaf = self._descend(upper)
+            key_index = _bisect_keys(leaf.keys, upper, after_equal=upper_inclusive) - 1
+
+        while True:
+            while key_index >= 0:
+                node_key = leaf.keys[key_index]
+                if lower is not None and (node_key.key < lower or (not lower_inclusive and node_key.key == lower)):
+                    return
+
+                yield from self._key_pointers(node_key)
+                key_index -= 1
+
+            if leaf.prev_leaf == -1:
+                return
+            leaf = self._load_node(leaf.prev_leaf)
+            key_index = len(leaf.keys) - 1
+
+    def _leaves(self):
+        leaf = self._edge_leaf(last=False)
+        while True:
+            yield leaf
+            if leaf.next_leaf == -1:
+                return
+            leaf = self._load_node(leaf.next_leaf)
+
+    def pointer_lists(self):
+        """
+            Starts of the pointer lists of the keys with duplicates, in key order.
+        """
+        for leaf in self._leaves():
+            for node_key in leaf.keys:
+                if node_key.pointers[1] != -1:
+                    yield node_key.pointers[1]
+
+    def remap_pointer_lists(self, moved_lists: HashTable):
+        """
+            Point the keys to the new starts of their pointer lists (by their old starts).
+        """
+        with self.deferred_headers():
+            for leaf in self._leaves():
+                changed = False
+                for node_key in leaf.keys:
+                    if node_key.pointers[1] != -1:
+                        node_key.pointers[1] = moved_lists[node_key.pointers[1]]
+                        changed = True
+                if changed:
+                    self._save_node(leaf)
+
+    def entries(self):
+        """
+            (key, pointers) pairs of all keys in key order - what bulk_load() takes to build a tree.
+        """
+        for leaf in self._leaves():
+            for node_key in leaf.keys:
+                yield node_key.key, list(self._key_pointers(node_key))
+
+    def keys_count(self) -> int:
+        count = 0
+        for leaf in self._leaves():
+            count += len(leaf.keys)
+
+        return count
+
+    def order_btree(self, order='ASC'):
+        if order == 'ASC':
+            yield from self.range_search()
+        elif order == 'DESC':
+            yield from self.range_search(reverse=True)
+        else:
+            raise ParseError(f"Order '{order}' is not supported")
+
+    def print_tree(self, node_offset: int | None = None, level=0):
+        if node_offset is None:
+            node_offset = self.manager.root_offset
+
+        node = self._load_node(node_offset)
+
+        indent = "  " * level
+        if node.is_leaf:
+            print(f"{indent}Leaf | Keys: {node.keys} (offset={node_offset}, "
+                  f"prev={node.prev_leaf}, next={node.next_leaf})")
+            return
+
+        print(f"{indent}Level {level} | Separators: {[key.key for key in node.keys]} (offset={node_offset})")
+        for child_off in node.children:
+            self.print_tree(child_off, level + 1)
@@ -1,10 +1,13 @@
 import struct
+from contextlib import contextmanager
 from typing import List, Generator
 
 from data_structures.btree.btree_node_manager import BTreeNodeManager
-from data_structures.btree.pointer_list_manager import PointerListManager
+from data_structures.btree.pointer_list_manager import PointerListManager, DEFAULT_BLOCK_SIZE
 from data_structures.hash_table import HashTable
+from data_structures.lru_cache import LRUCache
 from utils.binary_insertion_sort import binary_insertion_sort
+from utils.checksum import ROLLING_HASH
 from utils.date import Date
 from utils.errors import ParseError, TableError
 from utils.string_utils import custom_strip
@@ -32,7 +35,7 @@ class BTreeNodeKey:
         return k_type
 
     @staticmethod
-    def key_size(key_type, key_max_size=0):
+    def key_size(key_type, key_max_size=0, with_pointers: bool = True):
         if not key_type:
             raise ValueError(f"Unsupported key type: {key_type}")
 
@@ -44,11 +47,15 @@ class BTreeNodeKey:
         elif key_type == "S":
             k_size += struct.calcsize("i") + key_max_size
 
-        k_size += struct.calcsize("qq")
+        if with_pointers:
+            k_size += struct.calcsize("qq")
 
         return k_size
 
-    def serialize_key(self) -> bytes:
+    def serialize_key(self, with_pointers: bool = True) -> bytes:
+        """
+            with_pointers=False stores only the key (the separators of the BPlusTree internal nodes).
+        """
         key_type = self._key_type
         if not key_type:
             raise ValueError(f"Unsupported key type: {key_type}")
@@ -68,6 +75,9 @@ class BTreeNodeKey:
             length = struct.pack("i", self.key_max_size)
             key_data = b"S" + length + encoded_key
 
+        if not with_pointers:
+            return key_data
+
         pointers_data = b""
 
         real_pointer = self.pointers[0]
@@ -79,7 +89,7 @@ class BTreeNodeKey:
         return key_data + pointers_data
 
     @staticmethod
-    def deserialize_key(key_data):
+    def deserialize_key(key_data, with_pointers: bool = True):
         offset = 0
 
         key_type = key_data[offset:offset + 1]
@@ -108,6 +118,9 @@ class BTreeNodeKey:
         else:
             raise TableError("Unsupported key type")
 
+        if not with_pointers:
+            return BTreeNodeKey(key, [-1, -1], key_max_size)
+
         real_pointer = struct.unpack_from("q", key_data[offset: offset + 8])[0]
         offset += 8
         list_pointer = struct.unpack_from("q", key_data[offset: offset + 8])[0]
@@ -188,20 +201,11 @@ class BTreeNode:
         key_base_length = BTreeNodeKey.key_size(key_type, key_max_size)
         metadata = struct.pack("=?ii", self.is_leaf, len(self.keys), len(self.children))
 
-        keys_data = b""
-        for i in range(self.max_keys):
-            if i < len(self.keys):
-                keys_data += self.keys[i].serialize_key()
-            else:
-                keys_data += b'\x00' * key_base_length
+        keys_data = b"".join(key.serialize_key() for key in self.keys)
+        keys_data += b'\x00' * ((self.max_keys - len(self.keys)) * key_base_length)
 
-        children_data = b""
-        for c in range(self.max_children):
-            if c < len(self.children):
-                child_off = self.children[c]
-                children_data += struct.pack("q", child_off)
-            else:
-                children_data += struct.pack("q", -1)
+        children_data = struct.pack(f"{len(self.children)}q", *self.children)
+        children_data += struct.pack("q", -1) * (self.max_children - len(self.children))
 
         node_data = metadata + keys_data + children_data
         node_size = len(node_data)
@@ -241,6 +245,13 @@ class BTreeNode:
 
         return BTreeNode(is_leaf=is_leaf, keys=keys, children=children, t=t, offset=node_offset)
 
+    def copy(self):
+        """
+            A copy which can be modified without affecting this node (used by the BTree node cache).
+        """
+        keys = [BTreeNodeKey(key.key, key.pointers[:], key.key_max_size) for key in self.keys]
+        return BTreeNode(t=self.t, offset=self.offset, is_leaf=self.is_leaf, keys=keys, children=self.children[:])
+
     def __repr__(self):
         return f"Offset: {self.offset} | Keys: {self.keys} | Children: {self.children}"
 
@@ -254,41 +265,184 @@ class BTree:
             - min keys per node (except root): t - 1
             - max children per node: 2 * t
         - root (BTreeNode) - the root node of the BTree
+        - node_cache (LRUCache) - deserialized nodes by offset, kept up to date by _save_node,
+            so the root and the upper levels effectively stay in memory
     """
 
-    def __init__(self, node_file_path, pointer_file_path):
-        self.manager = BTreeNodeManager(node_file_path)
-        self.pointer_manager = PointerListManager(pointer_file_path)
+    def __init__(self, node_file_path, pointer_file_path, node_cache_size: int = 256, checksum: str = ROLLING_HASH):
+        self.manager = BTreeNodeManager(node_file_path, checksum)
+        self.pointer_manager = PointerListManager(pointer_file_path, checksum)
+        self.node_cache = LRUCache(node_cache_size)
 
     @property
     def t(self):
         return self.manager.t
 
     @staticmethod
-    def create_tree(t, key_type, key_max_size, node_file_path, pointer_file_path):
+    def order_for_node_size(node_size: int, key_type, key_max_size=0) -> int:
+        """
+            The largest minimum degree t for which a node still fits in node_size bytes.
+            A stored node takes: hash (4) + size (4) + metadata (9) + (2t - 1) keys + 2t children (8 each).
+        """
+        key_size = BTreeNodeKey.key_size(key_type, key_max_size)
+        node_overhead = 4 + 4 + struct.calcsize("=?ii")
+
+        t = (node_size - node_overhead + key_size) // (2 * (key_size + 8))
+        return max(t, 2)
+
+    @staticmethod
+    def node_size_for_order(t: int, key_type, key_max_size=0) -> int:
+        """
+            The bytes a stored node takes with minimum degree t (the inverse of order_for_node_size).
+        """
+        key_size = BTreeNodeKey.key_size(key_type, key_max_size)
+        return 4 + 4 + struct.calcsize("=?ii") + (2 * t - 1) * key_size + 2 * t * 8
+
+    @staticmethod
+    def create_tree(t, key_type, key_max_size, node_file_path, pointer_file_path, checksum: str = ROLLING_HASH,
+                    pointer_block_size: int = DEFAULT_BLOCK_SIZE):
         root = BTreeNode(t=t)
         root_bytes = root.serialize_node(key_type, key_max_size)
-        manager = BTreeNodeManager.create_node_manager(node_file_path, t, key_type, key_max_size)
-        pointer_manager = PointerListManager.create_pointer_list_manager(pointer_file_path)
+        manager = BTreeNodeManager.create_node_manager(node_file_path, t, key_type, key_max_size, checksum)
+        pointer_manager = PointerListManager.create_pointer_list_manager(pointer_file_path, checksum, pointer_block_size)
         root_offset = manager.save_node(None, root_bytes)
 
-        return BTree(node_file_path, pointer_file_path)
+        return BTree(node_file_path, pointer_file_path, checksum=checksum)
+
+    def bulk_load(self, entries, entries_count: int, write_buffer_size: int = 1024 * 1024):
+        """
+            Build the tree bottom-up from `entries` - (key, pointers) pairs sorted by key with unique keys.
+            The tree must be freshly created (only an empty root).
+
+            The shape of every level is planned from `entries_count` upfront, so each node gets
+            between (t - 1) and (2 * t - 1) keys and no node is ever split or rewritten:
+            - the leaves are written packed one after another, followed by each internal level;
+            - every key between two neighbouring nodes of a level becomes a separator in the level above;
+            - duplicate pointers of a key are written straight into a pointer list.
+        """
+        if entries_count == 0:
+            return
+
+        with self.deferred_headers():
+            self._bulk_load(entries, entries_count, write_buffer_size)
+
+    def _bulk_load(self, entries, entries_count: int, write_buffer_size: int):
+        t = self.manager.t
+        key_type = self.manager.key_type
+        key_max_size = self.manager.key_max_size
+
+        # Every level is described by: nodes count, base keys per node, nodes with one extra key
+        levels_plan = []
+        level_keys_count = entries_count
+        while True:
+            nodes_count = (level_keys_count + 2 * t) // (2 * t)  # -> ceil((keys + 1) / (2 * t))
+            stored_keys_count = level_keys_count - (nodes_count - 1)
+            levels_plan.append((nodes_count, stored_keys_count // nodes_count, stored_keys_count % nodes_count))
+
+            if nodes_count == 1:
+                break
+            level_keys_count = nodes_count - 1
+
+        node_slot_size = 4 + len(BTreeNode(t=t).serialize_node(key_type, key_max_size))  # -> hash + node data
+
+        # The empty root is overwritten by the first leaf
+        levels_start = []
+        next_level_start = self.manager.root_offset
+        for nodes_count, _, _ in levels_plan:
+            levels_start.append(next_level_start)
+            next_level_start += nodes_count * node_slot_size
+
+        levels_count = len(levels_plan)
+        current_nodes = [BTreeNode(t=t, is_leaf=(level == 0)) for level in range(levels_count)]
+        nodes_index = [0] * levels_count
+        next_children = [0] * levels_count
+        buffers = [[] for _ in range(levels_count)]
+        buffers_start = levels_start[:]
+        buffers_size = [0] * levels_count
+
+        def flush_level(level):
+            if buffers[level]:
+                self.manager.write_frames(buffers_start[level], b"".join(buffers[level]))
+                buffers_start[level] += buffers_size[level]
+                buffers[level] = []
+                buffers_size[level] = 0
+
+        def finish_node(level):
+            node = current_nodes[level]
+            if level > 0:
+                first_child = next_children[level]
+                node.children = [levels_start[level - 1] + (first_child + c) * node_slot_size
+                                 for c in range(len(node.keys) + 1)]
+                next_children[level] += len(node.keys) + 1
+
+            node_frame = self.manager.frame_node(node.serialize_node(key_type, key_max_size))
+            buffers[level].append(node_frame)
+            buffers_size[level] += len(node_frame)
+            if buffers_size[level] >= write_buffer_size:
+                flush_level(level)
+
+            nodes_index[level] += 1
+            current_nodes[level] = BTreeNode(t=t, is_leaf=(level == 0))
+
+        def planned_keys(level):
+            _, base_keys, extra_nodes = levels_plan[level]
+            return base_keys + 1 if nodes_index[level] < extra_nodes else base_keys
+
+        for key, pointers in entries:
+            list_pointer = -1
+            if len(pointers) > 1:
+                list_pointer = self.pointer_manager.create_pointer_list_from(pointers[1:])
+            node_key = BTreeNodeKey(key, [pointers[0], list_pointer], key_max_size)
+
+            level = 0
+            while len(current_nodes[level].keys) >= planned_keys(level):
+                # The node is complete, so the key separates it from its right neighbour
+                finish_node(level)
+                level += 1
+            current_nodes[level].keys.append(node_key)
+
+        for level in range(levels_count):
+            finish_node(level)
+            flush_level(level)
+
+        self.manager.root_offset = levels_start[-1]
+        self.manager.update_header()
+        self.node_cache.clear()
 
     def _load_node(self, offset: int) -> BTreeNode:
-        node_bytes = self.manager.load_node(offset)
-        node_data = BTreeNode.deserialize_node(node_bytes,
-                                               offset,
-                                               self.manager.t,
-                                               self.manager.key_type,
-                                               self.manager.key_max_size)
-        return node_data
+        cached_node = self.node_cache.get(offset)
+
+        if cached_node is None:
+            node_bytes = self.manager.load_node(offset)
+            cached_node = BTreeNode.deserialize_node(node_bytes,
+                                                     offset,
+                                                     self.manager.t,
+                                                     self.manager.key_type,
+                                                     self.manager.key_max_size)
+            self.node_cache.put(offset, cached_node)
+
+        # Callers modify the loaded nodes, so the cached one is never handed out
+        return cached_node.copy()
 
     def _save_node(self, node: BTreeNode) -> int:
         node_data = node.serialize_node(self.manager.key_type, self.manager.key_max_size)
         new_offset = self.manager.save_node(node.offset, node_data)
         node.offset = new_offset
+
+        self.node_cache.put(new_offset, node.copy())
         return node.offset
 
+    def _release_node(self, offset: int):
+        """
+            Hand the slot of a node which is no longer part of the tree back to the node manager.
+        """
+        self.node_cache.delete(offset)
+        self.manager.release_node(offset)
+
+    @property
+    def cache_hit_rate(self) -> float:
+        return self.node_cache.hit_rate
+
     @property
     def root(self) -> BTreeNode:
         return self._load_node(self.manager.root_offset)
@@ -315,7 +469,20 @@ class BTree:
         child_offset = node.children[i]
         return self._search(child_offset, key)
 
+    @contextmanager
+    def deferred_headers(self):
+        """
+            Write the headers of the node and pointer list files once,
+            after a whole logical operation (or a batch of them) is done.
+        """
+        with self.manager.deferred_header(), self.pointer_manager.deferred_header():
+            yield self
+
     def insert(self, key, pointer: int):
+        with self.deferred_headers():
+            self._insert(key, pointer)
+
+    def _insert(self, key, pointer: int):
         root_node = self.root
 
         existing_key_info = self._search(self.manager.root_offset, key)
@@ -419,11 +586,8 @@ class BTree:
         key_index = key_info["key_index"]
 
         actual_key = key_node.keys[key_index]
-        main_pointer = actual_key.pointers[0]
-        yield main_pointer
-
-        other_pointers_pointer = actual_key.pointers[1]
-        yield from self.pointer_manager.traverse_pointer_list(other_pointers_pointer)
+        # The main pointer is merged into the sorted pointer list, so the pointers of a key come in ascending order
+        yield from self.pointer_manager.traverse_pointer_list(actual_key.pointers[1], actual_key.pointers[0])
 
     def _delete_from_node(self, node: BTreeNode, key):
         """
@@ -556,7 +720,7 @@ class BTree:
 
         self._save_node(parent_node)
         self._save_node(left_child)
-        # self._save_node(right_child)
+        self._release_node(right_child_offset)
 
     def _borrow_from_left_sibling(self, parent_node: BTreeNode, idx: int):
         child_offset = parent_node.children[idx]
@@ -615,6 +779,10 @@ class BTree:
         return current.keys[0]
 
     def delete(self, key):
+        with self.deferred_headers():
+            self._delete(key)
+
+    def _delete(self, key):
         if self.manager.root_offset == -1:
             return
 
@@ -628,8 +796,13 @@ class BTree:
             else:
                 self.manager.root_offset = -1
             self.manager.update_header()
+            self._release_node(root_node.offset)
 
     def delete_pointer(self, key, pointer: int):
+        with self.deferred_headers():
+            self._delete_pointer(key, pointer)
+
+    def _delete_pointer(self, key, pointer: int):
         searched_node_info = self._search(self.manager.root_offset, key)
 
         if searched_node_info is None:
@@ -643,7 +816,7 @@ class BTree:
         secondary_pointer_to_file = searched_key.pointers[1]
         if main_pointer == pointer:
             if secondary_pointer_to_file == -1:
-                self.delete(key)
+                self._delete(key)
                 return
             else:
                 new_main_pointer = self.pointer_manager.get_first_available_pointer(secondary_pointer_to_file)
@@ -661,27 +834,100 @@ class BTree:
 
         self._save_node(searched_node)
 
-    def _range_search_node(self, node_offset: int, lower, upper):
-        i = 0
-        node = self._load_node(node_offset)
+    def delete_pointers(self, key, pointers: list):
+        with self.deferred_headers():
+            self._delete_pointers(key, pointers)
 
-        while i < len(node.keys) and node.keys[i].key < lower:
-            if not node.is_leaf:
-                yield from self._range_search_node(node.children[i], lower, upper)
-            i += 1
+    def _delete_pointers(self, key, pointers: list):
+        """
+            Remove many pointers of one key with a single search and a single pass over its pointer list.
+        """
+        searched_node_info = self._search(self.manager.root_offset, key)
 
-        while i < len(node.keys) and node.keys[i].key <= upper:
-            if not node.is_leaf:
-                yield from self._range_search_node(node.children[i], lower, upper)
+        if searched_node_info is None:
+            return
 
-            yield from self.find_key_pointers(HashTable([("node", node), ("key_index", i)]))
-            i += 1
+        searched_node = searched_node_info["node"]
+        searched_key_index = searched_node_info["key_index"]
+        searched_key = searched_node.keys[searched_key_index]
+
+        pointers_to_delete = HashTable(size=max(len(pointers), 1))
+        for pointer in pointers:
+            pointers_to_delete[pointer] = True
+
+        main_pointer = searched_key.pointers[0]
+        secondary_pointer_to_file = searched_key.pointers[1]
+        if secondary_pointer_to_file != -1:
+            secondary_pointer_to_file = self.pointer_manager.delete_pointers_from_pointer_list(secondary_pointer_to_file,
+                                                                                               pointers_to_delete)
+
+        if pointers_to_delete[main_pointer] is not None:
+            if secondary_pointer_to_file == -1:
+                self._delete(key)
+                return
+
+            main_pointer = self.pointer_manager.get_first_available_pointer(secondary_pointer_to_file)
+            secondary_pointer_to_file = self.pointer_manager.delete_pointer_from_pointer_list(secondary_pointer_to_file,
+                                                                                              main_pointer)
+
+        searched_key.pointers[0] = main_pointer
+        searched_key.pointers[1] = secondary_pointer_to_file
+        searched_node.keys[searched_key_index] = searched_key
+        self._save_node(searched_node)
+
+    @staticmethod
+    def _lower_bound_index(node: BTreeNode, lower, lower_inclusive: bool) -> int:
+        """
+            Index of the first key of the node which is not below the lower bound (binary search).
+        """
+        low = 0
+        high = len(node.keys)
+        while low < high:
+            middle = (low + high) // 2
+            key = node.keys[middle].key
+            if key < lower or (not lower_inclusive and key == lower):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def range_search(self, lower=None, upper=None, lower_inclusive: bool = True, upper_inclusive: bool = True):
+        """
+            Pointers of the keys between `lower` and `upper` (None leaves that side open), in key order.
+
+            The cursor descends once to the first key in the range, keeping a stack of
+            [node, index of its next key] entries, and then walks forward through the stack,
+            so only the O(log n) nodes on the way down and the nodes holding the range are loaded.
+        """
+        stack = []
+        node = self._load_node(self.manager.root_offset)
+        while True:
+            key_index = 0 if lower is None else self._lower_bound_index(node, lower, lower_inclusive)
+            stack.append([node, key_index])
+            if node.is_leaf:
+                break
+            node = self._load_node(node.children[key_index])
+
+        while stack:
+            node, key_index = stack[-1]
+            if key_index >= len(node.keys):
+                stack.pop()
+                continue
 
-        if not node.is_leaf and i < len(node.children):
-            yield from self._range_search_node(node.children[i], lower, upper)
+            key = node.keys[key_index].key
+            if upper is not None and (key > upper or (not upper_inclusive and key == upper)):
+                return
+
+            stack[-1][1] = key_index + 1
+            yield from self.find_key_pointers(HashTable([("node", node), ("key_index", key_index)]))
 
-    def range_search(self, lower, upper):
-        yield from self._range_search_node(self.manager.root_offset, lower, upper)
+            if not node.is_leaf:
+                # The keys between this key and the next one are in the leftmost path of the next child
+                child = self._load_node(node.children[key_index + 1])
+                stack.append([child, 0])
+                while not child.is_leaf:
+                    child = self._load_node(child.children[0])
+                    stack.append([child, 0])
 
     def _in_order_traversal(self, offset: int):
         node = self._load_node(offset)
@@ -705,6 +951,64 @@ class BTree:
                 yield from self.find_key_pointers(HashTable([("node", node), ("key_index", i)]))
             yield from self._reverse_in_order_traversal(node.children[0])
 
+    def pointer_lists(self, offset: int | None = None):
+        """
+            Starts of the pointer lists of the keys with duplicates, in key order.
+        """
+        node = self._load_node(self.manager.root_offset if offset is None else offset)
+        for i in range(len(node.keys)):
+            if not node.is_leaf:
+                yield from self.pointer_lists(node.children[i])
+            if node.keys[i].pointers[1] != -1:
+                yield node.keys[i].pointers[1]
+
+        if not node.is_leaf:
+            yield from self.pointer_lists(node.children[-1])
+
+    def remap_pointer_lists(self, moved_lists: HashTable):
+        """
+            Point the keys to the new starts of their pointer lists (by their old starts).
+        """
+        with self.deferred_headers():
+            self._remap_pointer_lists(self.manager.root_offset, moved_lists)
+
+    def _remap_pointer_lists(self, offset: int, moved_lists: HashTable):
+        node = self._load_node(offset)
+
+        changed = False
+        for key in node.keys:
+            if key.pointers[1] != -1:
+                key.pointers[1] = moved_lists[key.pointers[1]]
+                changed = True
+        if changed:
+            self._save_node(node)
+
+        for child_offset in node.children:
+            self._remap_pointer_lists(child_offset, moved_lists)
+
+    def entries(self, offset: int | None = None):
+        """
+            (key, pointers) pairs of all keys in key order - what bulk_load() takes to build a tree.
+        """
+        node = self._load_node(self.manager.root_offset if offset is None else offset)
+        for i in range(len(node.keys)):
+            if not node.is_leaf:
+                yield from self.entries(node.children[i])
+            node_key = node.keys[i]
+            yield node_key.key, list(self.pointer_manager.traverse_pointer_list(node_key.pointers[1],
+                                                                                 node_key.pointers[0]))
+
+        if not node.is_leaf:
+            yield from self.entries(node.children[-1])
+
+    def keys_count(self, offset: int | None = None) -> int:
+        node = self._load_node(self.manager.root_offset if offset is None else offset)
+        count = len(node.keys)
+        for child_offset in node.children:
+            count += self.keys_count(child_offset)
+
+        return count
+
     def order_btree(self, order='ASC'):
         root_offset = self.manager.root_offset
 
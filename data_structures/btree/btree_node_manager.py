@@ -1,12 +1,29 @@
 import struct
+from contextlib import contextmanager
 
 from utils.errors import TableError
-from utils.extra import polynomial_rolling_hash
+from utils.checksum import compute_checksum, ROLLING_HASH
+
+NODE_FILE_HEADER_FORMAT = "iqq1siq"  # -> t, root offset, end of file, key type, key max size, first free node
+LEGACY_HEADER_FORMAT = "iqq1si"  # -> the same without the free list, the first node follows it right away
+FREE_NODE_FORMAT = "q"  # -> next free node
 
 
 class BTreeNodeManager:
-    def __init__(self, file_path: str):
+    """
+        Nodes of a tree are all serialized to the same size, so a node slot released by a merge
+        (or an unlinked leaf) can hold any other node. Released slots are chained in a free list
+        (each one keeps the offset of the next) starting from the file header, and save_node()
+        takes a slot from it before appending to the end of the file.
+        Files from before the free list keep their shorter header (legacy_format) and don't reuse slots,
+        until the index is rewritten with REINDEX.
+    """
+
+    def __init__(self, file_path: str, checksum: str = ROLLING_HASH):
         self.file_path = file_path
+        self.checksum = checksum
+        self.free_node = -1
+        self.legacy_format = False
 
         with open(self.file_path, "rb+") as file:
             file.seek(0)
@@ -15,24 +32,55 @@ class BTreeNodeManager:
                 raise TableError("Corrupted file: BTree header mismatch")
             stored_hash_val = struct.unpack("I", stored_hash_bytes)[0]
 
-            header_bytes = file.read(struct.calcsize("iqq1si"))
-            if len(header_bytes) != struct.calcsize("iqq1si"):
-                raise TableError("Corrupted file: BTree header mismatch")
-
-            computed_hash_val = polynomial_rolling_hash(header_bytes)
-            if computed_hash_val != stored_hash_val:
-                raise TableError("Corrupted file: BTree header mismatch")
-
-            self.t, self.root_offset, self.eof, key_type, self.key_max_size = struct.unpack("iqq1si",
-                                                                                                 header_bytes)
-
-            self.key_type = key_type.decode()
+            header_bytes = file.read(struct.calcsize(NODE_FILE_HEADER_FORMAT))
+
+        legacy_header_bytes = header_bytes[:struct.calcsize(LEGACY_HEADER_FORMAT)]
+        if (len(header_bytes) == struct.calcsize(NODE_FILE_HEADER_FORMAT)
+                and compute_checksum(header_bytes, self.checksum) == stored_hash_val):
+            self.t, self.root_offset, self.eof, key_type, self.key_max_size, self.free_node = struct.unpack(
+                NODE_FILE_HEADER_FORMAT, header_bytes)
+        elif (len(legacy_header_bytes) == struct.calcsize(LEGACY_HEADER_FORMAT)
+              and compute_checksum(legacy_header_bytes, self.checksum) == stored_hash_val):
+            self.t, self.root_offset, self.eof, key_type, self.key_max_size = struct.unpack(LEGACY_HEADER_FORMAT,
+                                                                                            legacy_header_bytes)
+            self.legacy_format = True
+        else:
+            raise TableError("Corrupted file: BTree header mismatch")
+
+        self.key_type = key_type.decode()
+
+        self.deferred_depth = 0
+        self.header_dirty = False
+
+    @contextmanager
+    def deferred_header(self):
+        """
+            While inside, update_header() only marks the header as dirty.
+            It is written once when the outermost block exits.
+        """
+        self.deferred_depth += 1
+        try:
+            yield self
+        finally:
+            self.deferred_depth -= 1
+            if self.deferred_depth == 0 and self.header_dirty:
+                self.update_header()
 
     def update_header(self):
-        header_data = struct.pack("iqq1si",
-                                  self.t, self.root_offset, self.eof,
-                                  self.key_type.encode(), self.key_max_size)
-        header_hash_val = polynomial_rolling_hash(header_data)
+        if self.deferred_depth > 0:
+            self.header_dirty = True
+            return
+
+        self.header_dirty = False
+        if self.legacy_format:
+            header_data = struct.pack(LEGACY_HEADER_FORMAT,
+                                      self.t, self.root_offset, self.eof,
+                                      self.key_type.encode(), self.key_max_size)
+        else:
+            header_data = struct.pack(NODE_FILE_HEADER_FORMAT,
+                                      self.t, self.root_offset, self.eof,
+                                      self.key_type.encode(), self.key_max_size, self.free_node)
+        header_hash_val = compute_checksum(header_data, self.checksum)
         header_hash_bytes = struct.pack("I", header_hash_val)
 
         with open(self.file_path, "rb+") as file:
@@ -42,13 +90,13 @@ class BTreeNodeManager:
             file.flush()
 
     @staticmethod
-    def create_node_manager(file_path, t, key_type, key_max_size):
-        header_bytes_size = struct.calcsize("iqq1si")
-        header_data = struct.pack("iqq1si", t,
+    def create_node_manager(file_path, t, key_type, key_max_size, checksum: str = ROLLING_HASH):
+        header_bytes_size = struct.calcsize(NODE_FILE_HEADER_FORMAT)
+        header_data = struct.pack(NODE_FILE_HEADER_FORMAT, t,
                                   header_bytes_size + 4, header_bytes_size + 4,
-                                  key_type.encode(), key_max_size)
+                                  key_type.encode(), key_max_size, -1)
 
-        header_hash_val = polynomial_rolling_hash(header_data)
+        header_hash_val = compute_checksum(header_data, checksum)
         header_hash_bytes = struct.pack("I", header_hash_val)
 
         with open(file_path, "wb+") as file:
@@ -57,27 +105,58 @@ class BTreeNodeManager:
             file.write(header_data)
             file.flush()
 
-        return BTreeNodeManager(file_path)
+        return BTreeNodeManager(file_path, checksum)
+
+    def frame_node(self, node_data: bytes) -> bytes:
+        """
+            Prefix the serialized node with its hash - the way nodes are stored in the file.
+        """
+        node_hash_val = compute_checksum(node_data, self.checksum)
+        return struct.pack("I", node_hash_val) + node_data
 
     def save_node(self, offset: int | None, node_data: bytes) -> int:
-        node_hash_val = polynomial_rolling_hash(node_data)
-        node_hash_bytes = struct.pack("I", node_hash_val)
+        if offset is None:
+            offset = self.allocate_node()
 
-        with open(self.file_path, "rb+") as file:
-            if offset is None:
-                offset = self.eof
+        self.write_frames(offset, self.frame_node(node_data))
+        self.update_header()
 
-            file.seek(offset)
-            file.write(node_hash_bytes)
-            file.write(node_data)
+        return offset
 
-            if self.eof < offset + len(node_data):
-                self.eof = offset + len(node_data) + 4  # -> struct.calcsize("I") == 4
-            file.flush()
+    def allocate_node(self) -> int:
+        """
+            The offset for a new node - the first released slot, or the end of the file.
+        """
+        if self.free_node == -1:
+            return self.eof
+
+        offset = self.free_node
+        self.free_node = struct.unpack(FREE_NODE_FORMAT, self.load_node(offset))[0]
+        return offset
+
+    def release_node(self, offset: int):
+        """
+            Put the slot of a node which is no longer part of the tree on the free list.
+        """
+        if self.legacy_format:
+            return
 
+        free_data = struct.pack(FREE_NODE_FORMAT, self.free_node)
+        self.write_frames(offset, self.frame_node(struct.pack("i", len(free_data)) + free_data))
+        self.free_node = offset
         self.update_header()
 
-        return offset
+    def write_frames(self, offset: int, frames_data: bytes):
+        """
+            Write already framed nodes starting at offset without updating the header.
+        """
+        with open(self.file_path, "rb+") as file:
+            file.seek(offset)
+            file.write(frames_data)
+            file.flush()
+
+        if self.eof < offset + len(frames_data):
+            self.eof = offset + len(frames_data)
 
     def load_node(self, offset: int) -> bytes:
         with open(self.file_path, 'rb') as file:
@@ -97,7 +176,7 @@ class BTreeNodeManager:
             if len(data) != length:
                 raise TableError(f"Corrupted file: BTree cannot load node with offset {offset}")
 
-        computed_hash_val = polynomial_rolling_hash(node_size + data)
+        computed_hash_val = compute_checksum(node_size + data, self.checksum)
 
         if computed_hash_val != stored_hash_val:
             raise TableError(f"Corrupted file: BTree cannot load node with offset {offset}")
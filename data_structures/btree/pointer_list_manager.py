@@ -1,12 +1,100 @@
 import struct
+from contextlib import contextmanager
 
+from data_structures.hash_table import HashTable
 from utils.errors import TableError
-from utils.extra import polynomial_rolling_hash
+from utils.checksum import compute_checksum, ROLLING_HASH
+
+POINTER_FILE_MAGIC = b"PBP2"
+POINTER_FILE_HEADER_FORMAT = "=4siiq"  # -> magic, largest block size, smallest block size, end of file
+POINTER_FILE_HEADER_SIZE = struct.calcsize(POINTER_FILE_HEADER_FORMAT)
+FREE_BLOCKS_FORMAT = "q"  # -> first free block of a size class, one after the file header per class
+FIXED_BLOCKS_MAGIC = b"PBPL"  # -> files where every block had the largest size
+FIXED_BLOCKS_HEADER_FORMAT = "4siqq"  # -> their magic, block size, first free block, end of file
+LEGACY_HEADER_FORMAT = "qq"  # -> free slot, end of file of the files with linked (prev, pointer, next) entries
+
+# size class, next block, tail block (kept only by the first block of a list), first pointer,
+# size of the delta encoded pointers which follow the header
+BLOCK_HEADER_FORMAT = "=BqqqH"
+BLOCK_HEADER_SIZE = struct.calcsize(BLOCK_HEADER_FORMAT)
+MIN_BLOCK_SIZE = 40
+MAX_BLOCK_SIZE = 65535  # -> the size of the deltas in a block is stored in two bytes
+DEFAULT_BLOCK_SIZE = 1024
+
+
+def _encode_deltas(pointers: list, previous: int) -> bytearray:
+    """
+        Every pointer is stored as its difference from the previous one in a variable length
+        integer - 7 bits per byte, the highest bit set on all bytes except the last one.
+    """
+    data = bytearray()
+    for pointer in pointers:
+        delta = pointer - previous
+        while delta >= 0x80:
+            data.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        data.append(delta)
+        previous = pointer
+    return data
+
+
+def _decode_deltas(deltas: bytes, first_pointer: int) -> list:
+    pointers = [first_pointer]
+    value = first_pointer
+    delta = 0
+    shift = 0
+    for byte in deltas:
+        delta |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            value += delta
+            pointers.append(value)
+            delta = 0
+            shift = 0
+    return pointers
+
+
+class PointerBlock:
+    def __init__(self, position: int, size_class: int, pointers: list, next_block: int = -1, tail_block: int = -1):
+        """
+        Args:
+            size_class - index of the block size in PointerListManager.block_sizes.
+            pointers - the sorted pointers of the block.
+            tail_block - the last block of the list, kept up to date only in the first block.
+        """
+        self.position = position
+        self.size_class = size_class
+        self.pointers = pointers
+        self.next_block = next_block
+        self.tail_block = tail_block
+        self.dirty = False
+
+    def __repr__(self):
+        return (f"Block {self.position} ({self.size_class}) -> {self.next_block} | Tail: {self.tail_block} "
+                f"| Pointers: {self.pointers}")
 
 
 class PointerListManager:
-    def __init__(self, file_path):
+    """
+        The pointers of the duplicate keys of an index. Each list is a chain of blocks:
+        - the pointers of a list are sorted across all of its blocks and delta encoded inside a block;
+        - blocks come in size classes, from MIN_BLOCK_SIZE doubling up to the block size of the file.
+          A new list starts in the smallest block it fits, and every block appended to a list is one class
+          larger than the previous tail, so short lists stay small and long ones get large blocks;
+        - a block is read and written with a single I/O together with its hash;
+        - the first block of a list keeps the position of the last one, so appending
+          a pointer larger than all others (the common case for new rows) touches at most three blocks;
+        - blocks emptied by deletes are chained in a free list of their size class (through their next block)
+          from the file header and are reused before the file grows. vacuum_into() rewrites the lists compactly.
+        Files from before the size classes, and the linked lists of single pointers before them,
+        are only detected (legacy_format), their index has to be rebuilt.
+    """
+
+    def __init__(self, file_path, checksum: str = ROLLING_HASH):
         self.file_path = file_path
+        self.checksum = checksum
+        self.legacy_format = False
 
         with open(self.file_path, "rb+") as file:
             file.seek(0)
@@ -14,22 +102,82 @@ class PointerListManager:
             if len(stored_hash_bytes) != 4:
                 raise TableError("Corrupted file: PointerList header mismatch")
             stored_hash_val = struct.unpack("I", stored_hash_bytes)[0]
+            header_bytes = file.read(POINTER_FILE_HEADER_SIZE)
+
+            if header_bytes[:len(POINTER_FILE_MAGIC)] != POINTER_FILE_MAGIC:
+                header_bytes += file.read(struct.calcsize(FIXED_BLOCKS_HEADER_FORMAT) - len(header_bytes))
+                PointerListManager._check_legacy_header(header_bytes, stored_hash_val, self.checksum)
+
+                self.legacy_format = True
+                self.block_size, self.min_block_size, self.eof = DEFAULT_BLOCK_SIZE, MIN_BLOCK_SIZE, -1
+                self.block_sizes = PointerListManager._size_classes(self.min_block_size, self.block_size)
+                self.free_blocks = [-1] * len(self.block_sizes)
+            else:
+                if len(header_bytes) != POINTER_FILE_HEADER_SIZE:
+                    raise TableError("Corrupted file: PointerList header mismatch")
+                _, self.block_size, self.min_block_size, self.eof = struct.unpack(POINTER_FILE_HEADER_FORMAT,
+                                                                                  header_bytes)
+                self.block_sizes = PointerListManager._size_classes(self.min_block_size, self.block_size)
+
+                free_blocks_size = len(self.block_sizes) * struct.calcsize(FREE_BLOCKS_FORMAT)
+                free_blocks_bytes = file.read(free_blocks_size)
+                if (len(free_blocks_bytes) != free_blocks_size
+                        or compute_checksum(header_bytes + free_blocks_bytes, self.checksum) != stored_hash_val):
+                    raise TableError("Corrupted file: PointerList header mismatch")
+                self.free_blocks = list(struct.unpack(f"{len(self.block_sizes)}{FREE_BLOCKS_FORMAT}",
+                                                      free_blocks_bytes))
+
+        self.deferred_depth = 0
+        self.header_dirty = False
 
-            header_bytes = file.read(struct.calcsize("qq"))
-            if len(header_bytes) != struct.calcsize("qq"):
-                raise TableError("Corrupted file: PointerList header mismatch")
+    @staticmethod
+    def _check_legacy_header(header_bytes: bytes, stored_hash_val: int, checksum: str):
+        if header_bytes[:len(FIXED_BLOCKS_MAGIC)] == FIXED_BLOCKS_MAGIC:
+            legacy_header = header_bytes[:struct.calcsize(FIXED_BLOCKS_HEADER_FORMAT)]
+        else:
+            legacy_header = header_bytes[:struct.calcsize(LEGACY_HEADER_FORMAT)]
 
-            computed_hash_val = polynomial_rolling_hash(header_bytes)
-            if computed_hash_val != stored_hash_val:
-                raise TableError("Corrupted file: PointerList header mismatch")
+        if compute_checksum(legacy_header, checksum) != stored_hash_val:
+            raise TableError("Corrupted file: PointerList header mismatch")
 
-            self.free_slot, self.eof = struct.unpack("qq", header_bytes)
+    @staticmethod
+    def _size_classes(min_block_size: int, block_size: int) -> list:
+        block_sizes = []
+        size = min_block_size
+        while size < block_size:
+            block_sizes.append(size)
+            size *= 2
+        block_sizes.append(block_size)
+        return block_sizes
+
+    @contextmanager
+    def deferred_header(self):
+        """
+            While inside, update_header() only marks the header as dirty.
+            It is written once when the outermost block exits.
+        """
+        self.deferred_depth += 1
+        try:
+            yield self
+        finally:
+            self.deferred_depth -= 1
+            if self.deferred_depth == 0 and self.header_dirty:
+                self.update_header()
+
+    @staticmethod
+    def _header_data(block_size: int, min_block_size: int, eof: int, free_blocks: list) -> bytes:
+        return (struct.pack(POINTER_FILE_HEADER_FORMAT, POINTER_FILE_MAGIC, block_size, min_block_size, eof)
+                + struct.pack(f"{len(free_blocks)}{FREE_BLOCKS_FORMAT}", *free_blocks))
 
     @staticmethod
-    def create_pointer_list_manager(file_path):
-        header_bytes = struct.calcsize("qq")
-        header_data = struct.pack("qq", header_bytes + 4, header_bytes + 4)   # -> struct.calcsize("I") == 4
-        header_hash_val = polynomial_rolling_hash(header_data)
+    def create_pointer_list_manager(file_path, checksum: str = ROLLING_HASH, block_size: int = DEFAULT_BLOCK_SIZE):
+        if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+            raise ValueError(f"Pointer list blocks have to be between {MIN_BLOCK_SIZE} and {MAX_BLOCK_SIZE} bytes!")
+
+        free_blocks = [-1] * len(PointerListManager._size_classes(MIN_BLOCK_SIZE, block_size))
+        first_block = 4 + POINTER_FILE_HEADER_SIZE + len(free_blocks) * struct.calcsize(FREE_BLOCKS_FORMAT)
+        header_data = PointerListManager._header_data(block_size, MIN_BLOCK_SIZE, first_block, free_blocks)
+        header_hash_val = compute_checksum(header_data, checksum)
         header_hash_bytes = struct.pack("I", header_hash_val)
 
         with open(file_path, "w+b") as file:
@@ -38,11 +186,17 @@ class PointerListManager:
             file.write(header_data)
             file.flush()
 
-        return PointerListManager(file_path)
+        return PointerListManager(file_path, checksum)
 
     def update_header(self):
-        header_data = struct.pack("qq", self.free_slot, self.eof)
-        header_hash_val = polynomial_rolling_hash(header_data)
+        if self.deferred_depth > 0:
+            self.header_dirty = True
+            return
+
+        self.header_dirty = False
+        header_data = PointerListManager._header_data(self.block_size, self.min_block_size, self.eof,
+                                                      self.free_blocks)
+        header_hash_val = compute_checksum(header_data, self.checksum)
         header_hash_bytes = struct.pack("I", header_hash_val)
 
         with open(self.file_path, "rb+") as file:
@@ -51,117 +205,340 @@ class PointerListManager:
             file.write(header_data)
             file.flush()
 
-    def write_pointer(self, position: int, pointer_data: bytes):
-        pointer_hash_val = polynomial_rolling_hash(pointer_data)
-        pointer_hash_bytes = struct.pack("I", pointer_hash_val)
-
+    def _check_format(self):
+        if self.legacy_format:
+            raise TableError(f"Pointer list file {self.file_path} uses the old format, the index has to be rebuilt")
+
+    def _capacity(self, size_class: int) -> int:
+        """
+            Bytes left for the delta encoded pointers in a block of the class - without its hash and header.
+        """
+        return self.block_sizes[size_class] - 4 - BLOCK_HEADER_SIZE
+
+    def _frame_block(self, block: PointerBlock) -> bytes:
+        """
+            A free block has no pointers, its next block is the next free one of its class.
+        """
+        first_pointer = block.pointers[0] if block.pointers else -1
+        deltas = _encode_deltas(block.pointers[1:], first_pointer)
+        capacity = self._capacity(block.size_class)
+        if len(deltas) > capacity:
+            raise TableError(f"Pointer list block at position {block.position} overflows")
+
+        block_data = struct.pack(BLOCK_HEADER_FORMAT, block.size_class, block.next_block, block.tail_block,
+                                 first_pointer, len(deltas))
+        block_data += deltas + b"\x00" * (capacity - len(deltas))
+
+        return struct.pack("I", compute_checksum(block_data, self.checksum)) + block_data
+
+    def _write_block(self, block: PointerBlock):
         with open(self.file_path, "rb+") as file:
-            file.seek(position)
-            file.write(pointer_hash_bytes)
-            file.write(pointer_data)
+            file.seek(block.position)
+            file.write(self._frame_block(block))
             file.flush()
+        block.dirty = False
 
-    def read_pointer(self, position: int) -> bytes:
+    def _read_block(self, position: int) -> PointerBlock:
+        # The size of the block is in its header, so as much as the largest block is read
         with open(self.file_path, "rb") as file:
             file.seek(position)
-            stored_hash_bytes = file.read(4)  # -> struct.calcsize("I") == 4
-            if len(stored_hash_bytes) != 4:
-                raise TableError(f"Corrupted file: PointerList cannot load pointer at position {position}")
-            stored_hash_val = struct.unpack("I", stored_hash_bytes)[0]
-
-            pointer_data_size = struct.calcsize("qqq")
-            pointer_data = file.read(pointer_data_size)
-            if len(pointer_data) != pointer_data_size:
-                raise TableError(f"Corrupted file: PointerList cannot load pointer at position {position}")
-
-            computed_hash_val = polynomial_rolling_hash(pointer_data)
-
-            if computed_hash_val != stored_hash_val:
-                raise TableError(f"Corrupted file: PointerList cannot load pointer at position {position}")
-
-            return pointer_data
-
-    def allocate_space(self, position: int):
-        if position == self.eof:
-            self.eof += struct.calcsize("qqq") + 4  # -> struct.calcsize("I") == 4
-            self.free_slot = self.eof
+            block_bytes = file.read(self.block_size)
+
+        if len(block_bytes) < 4 + BLOCK_HEADER_SIZE:
+            raise TableError(f"Corrupted file: PointerList cannot load block at position {position}")
+
+        size_class, next_block, tail_block, first_pointer, deltas_size = struct.unpack_from(BLOCK_HEADER_FORMAT,
+                                                                                           block_bytes, 4)
+        if size_class >= len(self.block_sizes) or len(block_bytes) < self.block_sizes[size_class]:
+            raise TableError(f"Corrupted file: PointerList cannot load block at position {position}")
+        block_bytes = block_bytes[:self.block_sizes[size_class]]
+
+        stored_hash_val = struct.unpack_from("I", block_bytes, 0)[0]
+        if compute_checksum(block_bytes[4:], self.checksum) != stored_hash_val:
+            raise TableError(f"Corrupted file: PointerList cannot load block at position {position}")
+
+        if first_pointer == -1:
+            return PointerBlock(position, size_class, [], next_block, tail_block)
+
+        deltas_start = 4 + BLOCK_HEADER_SIZE
+        pointers = _decode_deltas(block_bytes[deltas_start:deltas_start + deltas_size], first_pointer)
+
+        return PointerBlock(position, size_class, pointers, next_block, tail_block)
+
+    def _fits(self, pointers: list, size_class: int) -> bool:
+        return len(_encode_deltas(pointers[1:], pointers[0])) <= self._capacity(size_class)
+
+    def _smallest_class(self, deltas_size: int) -> int:
+        """
+            The smallest size class whose blocks hold deltas_size bytes of deltas (the largest one if none does).
+        """
+        size_class = 0
+        while size_class < len(self.block_sizes) - 1 and self._capacity(size_class) < deltas_size:
+            size_class += 1
+        return size_class
+
+    def allocate_space(self, size_class: int) -> int:
+        """
+            Position for a new block of the size class - the first free block of the class or the end of the file.
+        """
+        position = self.free_blocks[size_class]
+        if position != -1:
+            free_block = self._read_block(position)
+            if free_block.pointers or free_block.size_class != size_class:
+                raise TableError(f"Corrupted file: PointerList free block at position {position} is in use")
+            self.free_blocks[size_class] = free_block.next_block
         else:
-            self.free_slot = self.eof
+            position = self.eof
+            self.eof += self.block_sizes[size_class]
 
         self.update_header()
-
-    def create_pointer_list(self, pointer: int):
-        pointer_data = struct.pack("qqq", -1, pointer, -1)
-        position = self.free_slot
-
-        self.write_pointer(position, pointer_data)
-
-        self.allocate_space(position)
         return position
 
-    def add_pointer_to_pointer_list(self, start_pointer: int, new_pointer: int):
-        curr_position = start_pointer
-
-        while curr_position != -1:
-            pointer_data = self.read_pointer(curr_position)
-            prev, current, next_ptr = struct.unpack("qqq", pointer_data)
+    def release_block(self, block: PointerBlock):
+        self._write_block(PointerBlock(block.position, block.size_class, [],
+                                       next_block=self.free_blocks[block.size_class]))
+        self.free_blocks[block.size_class] = block.position
+        self.update_header()
 
-            if next_ptr == -1:
-                new_node = struct.pack("qqq", curr_position, new_pointer, -1)
-                next_position = self.free_slot
-                self.write_pointer(next_position, new_node)
+    def create_pointer_list(self, pointer: int) -> int:
+        self._check_format()
+
+        block = PointerBlock(self.allocate_space(0), 0, [pointer])
+        block.tail_block = block.position
+        self._write_block(block)
+
+        return block.position
+
+    def create_pointer_list_from(self, pointers: list) -> int:
+        """
+            Create a whole pointer list at the end of the file with a single write.
+            Full blocks of the largest class are followed by the smallest block which takes the rest.
+            The pointers come sorted (unsorted ones are added one by one). Returns the position of its first block.
+        """
+        self._check_format()
+
+        for i in range(1, len(pointers)):
+            if pointers[i] < pointers[i - 1]:
+                start_position = self.create_pointer_list(pointers[0])
+                for pointer in pointers[1:]:
+                    self.add_pointer_to_pointer_list(start_position, pointer)
+                return start_position
+
+        deltas_size = len(_encode_deltas(pointers[1:], pointers[0]))
+        if deltas_size <= self._capacity(len(self.block_sizes) - 1):
+            size_class = self._smallest_class(deltas_size)
+            block = PointerBlock(self.allocate_space(size_class), size_class, pointers[:])
+            block.tail_block = block.position
+            self._write_block(block)
+            return block.position
+
+        largest_class = len(self.block_sizes) - 1
+        blocks = [PointerBlock(-1, largest_class, [pointers[0]])]
+        blocks_deltas_size = [0]
+        for i in range(1, len(pointers)):
+            delta_size = len(_encode_deltas([pointers[i]], pointers[i - 1]))
+            if blocks_deltas_size[-1] + delta_size > self._capacity(largest_class):
+                blocks.append(PointerBlock(-1, largest_class, [pointers[i]]))
+                blocks_deltas_size.append(0)
+                continue
+
+            blocks[-1].pointers.append(pointers[i])
+            blocks_deltas_size[-1] += delta_size
+
+        blocks[-1].size_class = self._smallest_class(blocks_deltas_size[-1])
+
+        start_position = self.eof
+        for i in range(len(blocks)):
+            blocks[i].position = self.eof
+            self.eof += self.block_sizes[blocks[i].size_class]
+            if i > 0:
+                blocks[i - 1].next_block = blocks[i].position
+        blocks[0].tail_block = blocks[-1].position
 
-                prev_node = struct.pack("qqq", prev, current, next_position)
-                self.write_pointer(curr_position, prev_node)
+        with open(self.file_path, "rb+") as file:
+            file.seek(start_position)
+            file.write(b"".join(self._frame_block(block) for block in blocks))
+            file.flush()
 
-                self.allocate_space(next_position)
-                break
+        self.update_header()
+        return start_position
 
-            curr_position = next_ptr
+    def add_pointer_to_pointer_list(self, start_pointer: int, new_pointer: int):
+        """
+            A pointer larger than the others goes to the tail block, found through the first block.
+            When the tail is full, it starts a new tail block one size class larger.
+            Others are inserted in the first block whose last pointer is not below them.
+            A block which overflows is split in two.
+        """
+        self._check_format()
+
+        head = self._read_block(start_pointer)
+        tail = head if head.tail_block == head.position else self._read_block(head.tail_block)
+
+        block = tail
+        if new_pointer < tail.pointers[-1]:
+            block = head
+            while block.pointers[-1] < new_pointer:
+                block = self._read_block(block.next_block)
+
+        insert_index = len(block.pointers)
+        while insert_index > 0 and block.pointers[insert_index - 1] > new_pointer:
+            insert_index -= 1
+        block.pointers.insert(insert_index, new_pointer)
+
+        if self._fits(block.pointers, block.size_class):
+            self._write_block(block)
+            return
+
+        if block.position == head.tail_block and insert_index == len(block.pointers) - 1:
+            block.pointers.pop()
+            new_class = min(block.size_class + 1, len(self.block_sizes) - 1)
+            new_block = PointerBlock(self.allocate_space(new_class), new_class, [new_pointer])
+        else:
+            middle = len(block.pointers) // 2
+            new_block = PointerBlock(self.allocate_space(block.size_class), block.size_class, block.pointers[middle:],
+                                     next_block=block.next_block)
+            block.pointers = block.pointers[:middle]
+        block.next_block = new_block.position
+        self._write_block(new_block)
+
+        if block.position == head.tail_block:
+            head.tail_block = new_block.position
+            if head is not block:
+                self._write_block(head)
+        self._write_block(block)
 
     def get_first_available_pointer(self, start_pos: int):
-        pointer_data = self.read_pointer(start_pos)
-        prev, current, next_ptr = struct.unpack("qqq", pointer_data)
-        return current
+        self._check_format()
+        return self._read_block(start_pos).pointers[0]
 
     def delete_pointer_from_pointer_list(self, start_pointer: int, pointer_to_delete: int):
-        curr_position = start_pointer
-        new_start_pointer = -1
-
-        while curr_position != -1:
-            curr_pointer_data = self.read_pointer(curr_position)
-            curr_prev, curr_curr, curr_next = struct.unpack("qqq", curr_pointer_data)
+        """
+            Returns the new start of the list (-1 if it is empty).
+        """
+        self._check_format()
+
+        head = self._read_block(start_pointer)
+        previous = None
+        block = head
+        while block.pointers[-1] < pointer_to_delete:
+            if block.next_block == -1:
+                return start_pointer
+            previous = block
+            block = self._read_block(block.next_block)
+
+        remaining = [pointer for pointer in block.pointers if pointer != pointer_to_delete]
+        if len(remaining) == len(block.pointers):
+            return start_pointer
+
+        if remaining:
+            block.pointers = remaining
+            self._write_block(block)
+            return start_pointer
+
+        self.release_block(block)
+        if block is head:
+            if head.next_block == -1:
+                return -1
+
+            new_head = self._read_block(head.next_block)
+            new_head.tail_block = head.tail_block
+            self._write_block(new_head)
+            return new_head.position
+
+        previous.next_block = block.next_block
+        if head.tail_block == block.position:
+            head.tail_block = previous.position
+            if head is not previous:
+                self._write_block(head)
+        self._write_block(previous)
 
-            if curr_curr == pointer_to_delete:
-                if curr_prev != -1:
-                    previous_pointer_data = self.read_pointer(curr_prev)
-                    prev_prev, prev_curr, prev_next = struct.unpack("qqq", previous_pointer_data)
-                    previous_pointer_new_data = struct.pack("qqq", prev_prev, prev_curr, curr_next)
-                    self.write_pointer(curr_prev, previous_pointer_new_data)
-
-                if curr_next != -1:
-                    next_pointer_data = self.read_pointer(curr_next)
-                    next_prev, next_curr, next_next = struct.unpack("qqq", next_pointer_data)
-                    next_pointer_new_data = struct.pack("qqq", curr_prev, next_curr, next_next)
-                    self.write_pointer(curr_next, next_pointer_new_data)
-
-                    new_start_pointer = curr_next
-
-                self.free_slot = curr_position
-                break
-
-            curr_position = curr_next
-
-        if start_pointer == curr_position:
-            return new_start_pointer
         return start_pointer
 
-    def traverse_pointer_list(self, start_pointer: int):
-        position = start_pointer
+    def delete_pointers_from_pointer_list(self, start_pointer: int, pointers_to_delete) -> int:
+        """
+            Remove every pointer found in the `pointers_to_delete` HashTable with one pass over the list.
+            Only the changed blocks are rewritten and the emptied ones are unlinked.
+            Returns the new start of the list (-1 if it is empty).
+        """
+        self._check_format()
 
+        kept_blocks = []
+        position = start_pointer
         while position != -1:
-            curr_pointer_data = self.read_pointer(position)
-            prev_p, curr_p, next_p = struct.unpack("qqq", curr_pointer_data)
-            yield curr_p
+            block = self._read_block(position)
+            position = block.next_block
+
+            remaining = [pointer for pointer in block.pointers if pointers_to_delete[pointer] is None]
+            if not remaining:
+                self.release_block(block)
+                continue
+            if len(remaining) != len(block.pointers):
+                block.pointers = remaining
+                block.dirty = True
+
+            if kept_blocks and kept_blocks[-1].next_block != block.position:
+                kept_blocks[-1].next_block = block.position
+                kept_blocks[-1].dirty = True
+            kept_blocks.append(block)
+
+        if not kept_blocks:
+            return -1
+
+        if kept_blocks[-1].next_block != -1:
+            kept_blocks[-1].next_block = -1
+            kept_blocks[-1].dirty = True
+
+        for i in range(len(kept_blocks)):
+            tail_block = kept_blocks[-1].position if i == 0 else -1
+            if kept_blocks[i].tail_block != tail_block:
+                kept_blocks[i].tail_block = tail_block
+                kept_blocks[i].dirty = True
+
+            if kept_blocks[i].dirty:
+                self._write_block(kept_blocks[i])
+
+        return kept_blocks[0].position
+
+    def traverse_pointer_list(self, start_pointer: int, first_pointer: int | None = None):
+        """
+            Yield the pointers of the list in ascending order.
+            `first_pointer` (the main pointer of an index key, kept outside the list) is merged into them.
+        """
+        position = start_pointer
+        if position != -1:
+            self._check_format()
 
-            position = next_p
+        while position != -1:
+            block = self._read_block(position)
+            for pointer in block.pointers:
+                if first_pointer is not None and first_pointer < pointer:
+                    yield first_pointer
+                    first_pointer = None
+                yield pointer
+
+            position = block.next_block
+
+        if first_pointer is not None:
+            yield first_pointer
+
+
+    def vacuum_into(self, file_path: str, list_starts) -> HashTable:
+        """
+            Copy the lists starting at `list_starts` one after another into a new file, without free blocks.
+            Returns the new start of every list by its old start.
+        """
+        self._check_format()
+
+        new_manager = PointerListManager.create_pointer_list_manager(file_path, self.checksum, self.block_size)
+        old_starts = []
+        new_starts = []
+        with new_manager.deferred_header():
+            for list_start in list_starts:
+                old_starts.append(list_start)
+                new_starts.append(new_manager.create_pointer_list_from(list(self.traverse_pointer_list(list_start))))
+
+        moved_lists = HashTable(size=max(len(old_starts), 1))
+        for i in range(len(old_starts)):
+            moved_lists[old_starts[i]] = new_starts[i]
+        return moved_lists
@@ -18,10 +18,18 @@ class HashTable:
                 self.insert(key, value)
 
     def _hash(self, key):
+        if not isinstance(key, str):
+            # Offsets, page numbers, etc. - the str hashing below is kept so column order stays the same
+            return hash(key) % self.size
+
+        return self.string_hash(key) % self.size
+
+    @staticmethod
+    def string_hash(key: str) -> int:
         hash_value = 0
         for char in key:
             hash_value += ord(char)
-        return hash_value % self.size
+        return hash_value
 
     def __setitem__(self, key: str, value):
         index = self._hash(key)
@@ -56,6 +64,19 @@ class HashTable:
         return None
         # raise KeyError(f"Key '{key}' not found in HashTable.")
 
+    def get_with_hash(self, key: str, key_hash: int):
+        """
+            Same as __getitem__ for a str key whose string_hash() was computed beforehand.
+        """
+        current = self.table_items[key_hash % self.size]
+
+        while current:
+            if current.key == key:
+                return current.value
+            current = current.next
+
+        return None
+
     def __delitem__(self, key):
         index = self._hash(key)
         current = self.table_items[index]
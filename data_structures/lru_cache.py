@@ -0,0 +1,112 @@
+from data_structures.hash_table import HashTable
+
+
+class LRUNode:
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+        self.prev: LRUNode | None = None
+        self.next: LRUNode | None = None
+
+
+class LRUCache:
+    """
+        A fixed-size cache which evicts the least recently used entry.
+
+        Entries are kept in a doubly linked list (most recent first) and
+        indexed by a HashTable, so lookups, inserts and evictions are O(1).
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("Cache capacity must be at least 1!")
+
+        self.capacity = capacity
+        self.entries = HashTable(size=capacity * 2)
+        self.length = 0
+
+        self.head = LRUNode(None, None)
+        self.tail = LRUNode(None, None)
+        self.head.next = self.tail
+        self.tail.prev = self.head
+
+        self.hits = 0
+        self.misses = 0
+
+    def _unlink(self, node: LRUNode):
+        node.prev.next = node.next
+        node.next.prev = node.prev
+
+    def _push_front(self, node: LRUNode):
+        node.prev = self.head
+        node.next = self.head.next
+        self.head.next.prev = node
+        self.head.next = node
+
+    def get(self, key):
+        node = self.entries[key]
+
+        if node is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._unlink(node)
+        self._push_front(node)
+        return node.value
+
+    def peek(self, key):
+        """
+            Return the cached value without touching the statistics or the eviction order.
+        """
+        node = self.entries[key]
+        return node.value if node is not None else None
+
+    def put(self, key, value):
+        node = self.entries[key]
+
+        if node is not None:
+            node.value = value
+            self._unlink(node)
+            self._push_front(node)
+            return
+
+        node = LRUNode(key, value)
+        self.entries[key] = node
+        self._push_front(node)
+        self.length += 1
+
+        if self.length > self.capacity:
+            evicted = self.tail.prev
+            self._unlink(evicted)
+            self.entries.delete(evicted.key)
+            self.length -= 1
+
+    def delete(self, key):
+        node = self.entries[key]
+
+        if node is None:
+            return
+
+        self._unlink(node)
+        self.entries.delete(key)
+        self.length -= 1
+
+    def clear(self):
+        self.entries = HashTable(size=self.capacity * 2)
+        self.length = 0
+        self.head.next = self.tail
+        self.tail.prev = self.head
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return f"LRUCache(size={self.length}/{self.capacity}, hits={self.hits}, misses={self.misses})"
@@ -0,0 +1,80 @@
+class MinHeap:
+    """
+        Binary min-heap stored in a list.
+
+        `less(a, b)` decides the order of the items (defaults to a < b), so the same heap can
+        serve ascending and descending merges without wrapping every item.
+    """
+
+    def __init__(self, less=None):
+        self.items = []
+        self.less = less if less is not None else (lambda a, b: a < b)
+
+    def push(self, item):
+        self.items.append(item)
+        self._sift_up(len(self.items) - 1)
+
+    def peek(self):
+        if not self.items:
+            return None
+        return self.items[0]
+
+    def pop(self):
+        if not self.items:
+            raise IndexError("pop from an empty heap")
+
+        last_item = self.items.pop()
+        if not self.items:
+            return last_item
+
+        top_item = self.items[0]
+        self.items[0] = last_item
+        self._sift_down(0)
+        return top_item
+
+    def replace(self, item):
+        """
+            Pop the smallest item and push `item` with a single sift.
+        """
+        if not self.items:
+            raise IndexError("replace on an empty heap")
+
+        top_item = self.items[0]
+        self.items[0] = item
+        self._sift_down(0)
+        return top_item
+
+    def _sift_up(self, i: int):
+        item = self.items[i]
+
+        while i > 0:
+            parent = (i - 1) // 2
+            if not self.less(item, self.items[parent]):
+                break
+            self.items[i] = self.items[parent]
+            i = parent
+
+        self.items[i] = item
+
+    def _sift_down(self, i: int):
+        size = len(self.items)
+        item = self.items[i]
+
+        while True:
+            child = 2 * i + 1
+            if child >= size:
+                break
+
+            if child + 1 < size and self.less(self.items[child + 1], self.items[child]):
+                child += 1
+
+            if not self.less(self.items[child], item):
+                break
+
+            self.items[i] = self.items[child]
+            i = child
+
+        self.items[i] = item
+
+    def __len__(self):
+        return len(self.items)
@@ -0,0 +1,113 @@
+from db_components.freeslot import FreeSlot
+from utils.binary_insertion_sort import binary_search
+from utils.errors import TableError
+
+
+class FreeSpaceMap:
+    """
+        Free slots of a data file, kept in two sorted arrays:
+        - by position, to coalesce a released slot with its free neighbours;
+        - by (length, position), to find the best fitting slot with a binary search.
+
+        Allocations split the chosen slot and keep the remainder free, even if it is too
+        small for a row - it is merged back once one of its neighbours is released.
+    """
+
+    def __init__(self):
+        self.positions = []
+        self.lengths = []
+        self.sizes = []
+
+    def _position_index(self, position: int) -> int:
+        return binary_search(self.positions, position, 0, len(self.positions) - 1, "ASC")
+
+    def _size_index(self, length: int, position: int) -> int:
+        return binary_search(self.sizes, (length, position), 0, len(self.sizes) - 1, "ASC")
+
+    def _insert(self, position: int, length: int):
+        i = self._position_index(position)
+        self.positions.insert(i, position)
+        self.lengths.insert(i, length)
+        self.sizes.insert(self._size_index(length, position), (length, position))
+
+    def _remove_at(self, i: int):
+        position = self.positions.pop(i)
+        length = self.lengths.pop(i)
+        del self.sizes[self._size_index(length, position)]
+
+    def release(self, position: int, length: int):
+        """
+            Mark `length` bytes at `position` as free and merge them with adjacent free slots.
+        """
+        if length <= 0:
+            return
+
+        i = self._position_index(position)
+
+        if i > 0 and self.positions[i - 1] + self.lengths[i - 1] > position:
+            raise TableError(f"Corrupted free space map: slot at {position} is already free")
+        if i < len(self.positions) and position + length > self.positions[i]:
+            raise TableError(f"Corrupted free space map: slot at {position} is already free")
+
+        if i > 0 and self.positions[i - 1] + self.lengths[i - 1] == position:
+            position = self.positions[i - 1]
+            length += self.lengths[i - 1]
+            self._remove_at(i - 1)
+            i -= 1
+
+        if i < len(self.positions) and position + length == self.positions[i]:
+            length += self.lengths[i]
+            self._remove_at(i)
+
+        self._insert(position, length)
+
+    def allocate(self, size: int) -> int | None:
+        """
+            Take `size` bytes from the smallest slot that fits them.
+            Returns the position of the bytes or None if no slot is large enough.
+        """
+        i = self._size_index(size, -1)
+        if i == len(self.sizes):
+            return None
+
+        position = self.sizes[i][1]
+        self.take(position, size)
+        return position
+
+    def take(self, position: int, size: int):
+        """
+            Remove `size` bytes at `position` from the free slot that contains them.
+        """
+        i = self._position_index(position + 1) - 1
+
+        if i < 0 or self.positions[i] + self.lengths[i] < position + size:
+            raise TableError(f"Corrupted free space map: bytes at {position} are not free")
+
+        slot_position = self.positions[i]
+        slot_length = self.lengths[i]
+        self._remove_at(i)
+
+        if position > slot_position:
+            self._insert(slot_position, position - slot_position)
+        if position + size < slot_position + slot_length:
+            self._insert(position + size, slot_position + slot_length - position - size)
+
+    def tail_slot(self, table_end: int) -> FreeSlot | None:
+        """
+            Returns the free slot which ends at `table_end`, if any.
+        """
+        if self.positions and self.positions[-1] + self.lengths[-1] == table_end:
+            return FreeSlot(self.positions[-1], self.lengths[-1])
+        return None
+
+    def clear(self):
+        self.positions = []
+        self.lengths = []
+        self.sizes = []
+
+    def slots(self):
+        for i in range(len(self.positions)):
+            yield FreeSlot(self.positions[i], self.lengths[i])
+
+    def __len__(self):
+        return len(self.positions)
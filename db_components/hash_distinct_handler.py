@@ -0,0 +1,107 @@
+import os
+from itertools import groupby
+
+from data_structures.hash_table import HashTable
+from db_components.merge_sort_handler import MergeSortHandler
+from settings import HASH_DISTINCT_PARTITIONS, SORT_MEMORY_BUDGET
+
+MIN_SEEN_TABLE_SIZE = 64
+MAX_PARTITION_LEVELS = 8  # -> deeper partitions keep all their keys in memory, even over the budget
+
+
+class HashDistinctHandler:
+    """
+        Removes duplicate rows in one streaming pass - a row is returned as soon as its distinct key
+        is seen for the first time, so the first rows arrive before the input is read to the end.
+
+        Keys are kept in a hash table while they fit the memory budget. After that the table is frozen:
+        rows with a known key are still dropped and the others are split by the hash of their key into
+        partition files, which are deduplicated one by one (and partitioned again if still too large).
+
+        Rows which come sorted by a column can be deduplicated group by group - duplicates always share
+        the value of that column, so only the keys of the current group are kept and the order is preserved.
+    """
+
+    def __init__(self, directory: str, table_name: str, distinct_cols: HashTable, memory_budget: int | None = None,
+                 partitions: int = HASH_DISTINCT_PARTITIONS):
+        if partitions < 2:
+            raise ValueError("Hash DISTINCT needs at least 2 partitions!")
+
+        self.directory = directory
+        self.table_name = table_name
+        self.distinct_cols = distinct_cols
+        self.memory_budget = memory_budget if memory_budget is not None else SORT_MEMORY_BUDGET
+        self.partitions = partitions
+
+        # Partition files use the temp row format of the merge sort
+        self.temp_rows = MergeSortHandler(directory, table_name)
+        self.distinct_id = id(self)
+        self.partition_files_count = 0
+
+    def key_func(self, row: HashTable) -> tuple:
+        return tuple(row[dc_name] for dc_name, _ in self.distinct_cols.items())
+
+    def distinct(self, rows, sorted_by: str | None = None):
+        if sorted_by is None:
+            yield from self._distinct(rows, 0)
+            return
+
+        for _, group_rows in groupby(rows, key=lambda row: row[sorted_by]):
+            yield from self._distinct(group_rows, 0)
+
+    def _distinct(self, rows, level: int):
+        seen_keys = HashTable(size=MIN_SEEN_TABLE_SIZE)
+        seen_count = 0
+        seen_size = 0
+        partition_paths = []
+        partition_files = []
+
+        try:
+            for row in rows:
+                key = self.key_func(row)
+                if seen_keys[key] is not None:
+                    continue
+
+                if partition_files:
+                    partition = hash((level, key)) % self.partitions
+                    self.temp_rows.write_row(partition_files[partition], row)
+                    continue
+
+                seen_keys[key] = True
+                seen_count += 1
+                if seen_count > seen_keys.size:
+                    seen_keys = self._grow(seen_keys)
+                yield row
+
+                seen_size += MergeSortHandler.estimate_row_size(row)
+                if seen_size > self.memory_budget and level < MAX_PARTITION_LEVELS:
+                    for _ in range(self.partitions):
+                        partition_paths.append(self._partition_path())
+                        partition_files.append(open(partition_paths[-1], "wb"))
+
+            for partition_file in partition_files:
+                partition_file.close()
+
+            seen_keys = None
+            for partition_path in partition_paths:
+                yield from self._distinct(self.temp_rows.read_rows(partition_path), level + 1)
+                os.remove(partition_path)
+        finally:
+            for partition_file in partition_files:
+                partition_file.close()
+
+            for partition_path in partition_paths:
+                if os.path.exists(partition_path):
+                    os.remove(partition_path)
+
+    @staticmethod
+    def _grow(seen_keys: HashTable) -> HashTable:
+        grown_keys = HashTable(size=seen_keys.size * 4)
+        for key in seen_keys.keys():
+            grown_keys[key] = True
+        return grown_keys
+
+    def _partition_path(self) -> str:
+        self.partition_files_count += 1
+        return os.path.join(self.directory,
+                            f"{self.table_name}_distinct_{self.distinct_id}_{self.partition_files_count}.temp")
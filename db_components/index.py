@@ -1,41 +1,135 @@
 import os
+import shutil
+from data_structures.btree.bplus_tree import BPlusTree
 from data_structures.btree.btree import BTree
 from data_structures.hash_table import HashTable
 from db_components.column import Column
-from utils.date import Date
-from utils.errors import TableError
+from utils.checksum import ROLLING_HASH
+from utils.errors import TableError, ParseError
+from settings import BTREE_NODE_SIZE, BTREE_MAX_NODE_SIZE, BTREE_NODE_CACHE_SIZE, POINTER_BLOCK_SIZE
+
+BTREE_INDEX = "BTREE"
+BPLUS_INDEX = "BPLUS"
+
+# Index type (CREATE INDEX ... USING <type>) -> tree class
+INDEX_TREES = HashTable([(BTREE_INDEX, BTree), (BPLUS_INDEX, BPlusTree)])
 
 
 class TableIndex:
-    def __init__(self, index_name: str, column: Column, index_path: str, pointer_list_data_path: str):
+    def __init__(self, index_name: str, column: Column, index_path: str, pointer_list_data_path: str,
+                 checksum: str = ROLLING_HASH, index_type: str = BTREE_INDEX):
         self.index_name = index_name
         self.column = column
         self.index_path = index_path
         self.pointer_list_data_path = pointer_list_data_path
-        self.index_tree = BTree(index_path, pointer_list_data_path)
+        self.checksum = checksum
+        self.index_type = index_type
+        self.index_tree = TableIndex._tree_class(index_type)(index_path, pointer_list_data_path,
+                                                             node_cache_size=BTREE_NODE_CACHE_SIZE,
+                                                             checksum=checksum)
 
     @staticmethod
-    def create_index(index_name, column, index_path, pointer_list_path):
+    def _tree_class(index_type: str):
+        tree_class = INDEX_TREES.search(index_type)
+        if tree_class is None:
+            raise TableError(f"Unsupported index type: {index_type}")
+        return tree_class
+
+    @staticmethod
+    def validate_order(t: int, index_type: str, key_type: str = "S", key_max_size: int = 0):
+        """
+            Reject an ORDER whose nodes would be larger than BTREE_MAX_NODE_SIZE.
+            The default key is the smallest there is (an empty string), so the parser can check before
+            the column is known.
+        """
+        node_size = TableIndex._tree_class(index_type).node_size_for_order(t, key_type, key_max_size)
+        if node_size > BTREE_MAX_NODE_SIZE:
+            raise ParseError(f"Index ORDER {t} is too large - its nodes would take {node_size} bytes, "
+                             f"at most {BTREE_MAX_NODE_SIZE} are allowed!")
+
+    @staticmethod
+    def create_index(index_name, column, index_path, pointer_list_path, t: int | None = None,
+                     checksum: str = ROLLING_HASH, index_type: str = BTREE_INDEX):
+        """
+            Create the index files. If t (the minimum degree of the BTree, the leaf size of the BPlusTree)
+            is not given, it is derived from BTREE_NODE_SIZE and the size of the column's keys.
+        """
+        tree_class = TableIndex._tree_class(index_type)
         key_types = HashTable([("number", "N"), ("string", "S"), ("date", "D")])
 
         key_max_value = 0
         if column.column_type == "string":
             key_max_value = column.MAX_SIZE
 
-        btree = BTree.create_tree(t=3,
-                                  key_type=key_types[column.column_type],
-                                  key_max_size=key_max_value,
-                                  node_file_path=index_path,
-                                  pointer_file_path=pointer_list_path)
-
-        return TableIndex(index_name, column, index_path, pointer_list_path)
+        if t is None:
+            t = tree_class.order_for_node_size(BTREE_NODE_SIZE, key_types[column.column_type], key_max_value)
+        else:
+            TableIndex.validate_order(t, index_type, key_types[column.column_type], key_max_value)
+
+        tree_class.create_tree(t=t,
+                               key_type=key_types[column.column_type],
+                               key_max_size=key_max_value,
+                               node_file_path=index_path,
+                               pointer_file_path=pointer_list_path,
+                               checksum=checksum,
+                               pointer_block_size=POINTER_BLOCK_SIZE)
+
+        return TableIndex(index_name, column, index_path, pointer_list_path, checksum, index_type)
+
+    @property
+    def outdated(self) -> bool:
+        """
+            Indexes whose pointer lists use an older file format have to be rebuilt
+            (before the table is changed, or by REINDEX) - until then queries don't use them.
+        """
+        return self.index_tree.pointer_manager.legacy_format
+
+    def deferred_headers(self):
+        """
+            Context manager which writes the index file headers once for everything done inside it.
+        """
+        return self.index_tree.deferred_headers()
 
     def add_element_to_index(self, key, pointer: int):
         self.index_tree.insert(key, pointer)
 
+    def bulk_load(self, sorted_entries):
+        """
+            Fill the (empty) index from a sorted stream of entries.
+            `sorted_entries()` has to return a new iterator of (key, pointer) pairs sorted by key every time,
+            because the entries are read twice - once to count the unique keys and once to build the tree.
+        """
+        unique_keys_count = 0
+        last_key = None
+        for key, _ in sorted_entries():
+            if unique_keys_count == 0 or key != last_key:
+                unique_keys_count += 1
+                last_key = key
+
+        self.index_tree.bulk_load(self._group_entries(sorted_entries()), unique_keys_count)
+
+    @staticmethod
+    def _group_entries(sorted_entries):
+        current_key = None
+        current_pointers = []
+
+        for key, pointer in sorted_entries:
+            if current_pointers and key != current_key:
+                yield current_key, current_pointers
+                current_pointers = []
+
+            current_key = key
+            current_pointers.append(pointer)
+
+        if current_pointers:
+            yield current_key, current_pointers
+
     def remove_element_from_index(self, key, pointer: int):
         self.index_tree.delete_pointer(key, pointer)
 
+    def remove_elements_from_index(self, key, pointers: list):
+        self.index_tree.delete_pointers(key, pointers)
+
     def delete_index(self):
         if not os.path.exists(self.index_path) or not os.path.exists(self.pointer_list_data_path):
             raise TableError(f"Index files for index {self.index_name} missing")
@@ -43,29 +137,94 @@ class TableIndex:
         os.remove(self.index_path)
         os.remove(self.pointer_list_data_path)
 
+    def vacuum(self):
+        """
+            Rewrite the pointer lists file without free blocks, with the lists in key order.
+            The keys are pointed to their new lists in a copy of the tree file, and both new files
+            are swapped in together, so the tree never refers to lists of the other pointer file.
+        """
+        vacuum_path = self.pointer_list_data_path + ".vacuum"
+        vacuum_index_path = self.index_path + ".vacuum"
+        tree_class = TableIndex._tree_class(self.index_type)
+        try:
+            moved_lists = self.index_tree.pointer_manager.vacuum_into(vacuum_path, self.index_tree.pointer_lists())
+            shutil.copyfile(self.index_path, vacuum_index_path)
+            tree_class(vacuum_index_path, vacuum_path, checksum=self.checksum).remap_pointer_lists(moved_lists)
+            self._replace_index_files(vacuum_index_path, vacuum_path)
+        finally:
+            for path in (vacuum_index_path, vacuum_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        self.index_tree = tree_class(self.index_path, self.pointer_list_data_path,
+                                     node_cache_size=BTREE_NODE_CACHE_SIZE, checksum=self.checksum)
+
+    def _replace_index_files(self, new_index_path: str, new_pointer_list_path: str):
+        """
+            Swap in a new tree file and its pointer lists file as a pair. The current files are kept
+            as .old until both new ones are in place, and are put back if either replace fails.
+        """
+        replaced_files = [(new_index_path, self.index_path), (new_pointer_list_path, self.pointer_list_data_path)]
+        backed_up = []
+        try:
+            for _, path in replaced_files:
+                os.replace(path, path + ".old")
+                backed_up.append(path)
+            for new_path, path in replaced_files:
+                os.replace(new_path, path)
+        except OSError as e:
+            for path in backed_up:
+                os.replace(path + ".old", path)
+            raise TableError(f"Failed to replace the files of index {self.index_name}: {e}")
+
+        for path in backed_up:
+            os.remove(path + ".old")
+
+    def reindex(self):
+        """
+            Rebuild the tree and its pointer lists in key order into new files and swap them in:
+            the nodes of every level end up next to each other and no released slots are left.
+        """
+        reindex_path = self.index_path + ".reindex"
+        reindex_pointers_path = self.pointer_list_data_path + ".reindex"
+        tree = self.index_tree
+        tree_class = TableIndex._tree_class(self.index_type)
+        try:
+            new_tree = tree_class.create_tree(t=tree.t,
+                                              key_type=tree.manager.key_type,
+                                              key_max_size=tree.manager.key_max_size,
+                                              node_file_path=reindex_path,
+                                              pointer_file_path=reindex_pointers_path,
+                                              checksum=self.checksum,
+                                              pointer_block_size=tree.pointer_manager.block_size)
+            new_tree.bulk_load(tree.entries(), tree.keys_count())
+            self._replace_index_files(reindex_path, reindex_pointers_path)
+        finally:
+            for path in (reindex_path, reindex_pointers_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        self.index_tree = tree_class(self.index_path, self.pointer_list_data_path,
+                                     node_cache_size=BTREE_NODE_CACHE_SIZE, checksum=self.checksum)
+
     def search(self, key):
         return self.index_tree.search(key)
 
-    def range_search(self, column, start=None, end=None):
-        default_ranges = []
-
-        column_type = column.column_type
-        if column_type == "string":
-            default_ranges = [" ", "~" * column.MAX_SIZE]
-        elif column_type == "number":
-            default_ranges = [-float("inf"), float("inf")]
-        elif column_type == "date":
-            default_ranges = [Date.from_string("01.01.0001"), Date.from_string("31.12.9999")]
-
-        if start is None:
-            start = default_ranges[0]
-        if end is None:
-            end = default_ranges[1]
+    def range_search(self, start=None, end=None, start_inclusive: bool = True, end_inclusive: bool = True):
+        """
+            Pointers of the rows with keys between `start` and `end` - None leaves that side of the range open.
+        """
+        yield from self.index_tree.range_search(start, end, start_inclusive, end_inclusive)
 
-        yield from self.index_tree.range_search(start, end)
+    def ordered_search(self, order: str = "ASC"):
+        """
+            Pointers of all rows in key order (ASC or DESC).
+        """
+        yield from self.index_tree.order_btree(order)
 
     def print_index(self):
         self.index_tree.print_tree()
 
     def __str__(self):
-        return f"{self.column.column_name}|{self.index_name}|{self.index_path}|{self.pointer_list_data_path}"
+        return (f"{self.column.column_name}|{self.index_name}|{self.index_path}|{self.pointer_list_data_path}"
+                f"|{self.index_type}")
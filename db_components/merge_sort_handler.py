@@ -1,51 +1,218 @@
 import os
 import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
 from typing import List
 
+from data_structures.dynamic_queue import DynamicQueue
 from data_structures.hash_table import HashTable
+from data_structures.min_heap import MinHeap
 from utils.date import Date
 from utils.errors import TableError
-from utils.extra import reverse_array, polynomial_rolling_hash
+from settings import CHECKSUM_ALGORITHM, MERGE_SORT_MAX_FAN_IN, SORT_MEMORY_BUDGET, SORT_PARALLEL_WORKERS
+from utils.checksum import compute_checksum
+
+ROW_VALUE_OVERHEAD = 120  # -> HashNode of a value with its attributes dict
+
+
+def _write_sorted_chunk(handler, columns: list, rows_values: list, chunk_file_num: int) -> str:
+    """
+        Entry point of the worker processes of MergeSortHandler.sort().
+        Rows come as lists of values, which are much cheaper to pickle than HashTables.
+    """
+    rows = [HashTable(list(zip(columns, values)), size=len(columns)) for values in rows_values]
+    return handler.write_sorted_chunk(rows, chunk_file_num)
+
+
+class SortedRows:
+    """
+        Result of MergeSortHandler.sort() - either a list of rows sorted in memory or a sorted temp file.
+        It can be iterated more than once; close() removes the temp file.
+    """
+
+    def __init__(self, handler, rows: List[HashTable] | None = None, file_path: str | None = None):
+        self.handler = handler
+        self.rows = rows
+        self.file_path = file_path
+
+    def __iter__(self):
+        if self.file_path is not None:
+            yield from self.handler.read_rows(self.file_path)
+        else:
+            yield from self.rows
+
+    @property
+    def in_memory(self) -> bool:
+        return self.file_path is None
+
+    def close(self):
+        if self.file_path is not None and os.path.exists(self.file_path):
+            os.remove(self.file_path)
 
 
 class MergeSortHandler:
+    """
+        Sorts rows (optionally removing duplicates) within a memory budget in bytes.
+
+        Inputs which fit the budget are sorted in memory and never touch the disk.
+        Larger inputs are split into budget-sized sorted runs, spilled to temp files and merged.
+    """
+
     def __init__(self, directory: str, table_name: str, order_by_col: str | None = None,
-                 distinct_cols: HashTable | None = None, order: str = "ASC", chunk_size: int = 1000):
+                 distinct_cols: HashTable | None = None, order: str = "ASC", memory_budget: int | None = None,
+                 max_fan_in: int = MERGE_SORT_MAX_FAN_IN, parallel_workers: int = SORT_PARALLEL_WORKERS):
+        if max_fan_in < 2:
+            raise ValueError("MergeSort fan-in must be at least 2!")
+
         self.directory = directory
         self.table_name = table_name
         self.order_by_col = order_by_col
         self.distinct_cols = distinct_cols
         self.order = order
-        self.chunk_size = chunk_size
+        self.memory_budget = memory_budget if memory_budget is not None else SORT_MEMORY_BUDGET
+        self.max_fan_in = max_fan_in
+        self.parallel_workers = parallel_workers
 
-    def select_merge_sort(self, table_rows) -> str:
+        # Temp file names are taken in the creating process - worker processes get a copy of the handler
+        self.sort_id = id(self)
+
+    def sort(self, table_rows) -> SortedRows:
+        """
+            With parallel_workers > 0, spilled runs are sorted and written by a process pool while
+            the rows keep being produced. After the first run the runs get smaller, so the runs
+            in flight stay within about twice the memory budget.
+        """
         chunk_files = []
         in_memory_chunk = []
-        count = 0
-
-        for row in table_rows:
-            in_memory_chunk.append(row)
-            count += 1
-            if count >= self.chunk_size:
-                tmp_path = self.write_sorted_chunk(in_memory_chunk, len(chunk_files) + 1)
-                chunk_files.append(tmp_path)
+        chunk_size = 0
+        run_budget = self.memory_budget
+
+        executor = None
+        pending_chunks = DynamicQueue()
+
+        try:
+            for row in table_rows:
+                in_memory_chunk.append(row)
+                chunk_size += self.estimate_row_size(row)
+                if chunk_size <= run_budget:
+                    continue
+
+                if self.parallel_workers > 0 and executor is None:
+                    executor = ProcessPoolExecutor(max_workers=self.parallel_workers)
+                    run_budget = max(1, self.memory_budget // (self.parallel_workers + 1))
+
+                chunk_files.append(self.chunk_path(len(chunk_files) + 1))
+                if executor is None:
+                    self.write_sorted_chunk(in_memory_chunk, len(chunk_files))
+                else:
+                    if pending_chunks.length >= self.parallel_workers:
+                        pending_chunks.dequeue().value.result()
+                    columns = [column_name for column_name, _ in in_memory_chunk[0].items()]
+                    rows_values = [[row[column_name] for column_name in columns] for row in in_memory_chunk]
+                    pending_chunks.enqueue(executor.submit(_write_sorted_chunk, self, columns, rows_values,
+                                                           len(chunk_files)))
+
                 in_memory_chunk = []
-                count = 0
+                chunk_size = 0
 
-        if in_memory_chunk:
-            tmp_path = self.write_sorted_chunk(in_memory_chunk, len(chunk_files) + 1)
-            chunk_files.append(tmp_path)
+            if not chunk_files:
+                return SortedRows(self, rows=self.sort_in_memory(in_memory_chunk))
 
-        if self.distinct_cols:
-            final_file = self.multiway_merge_distinct(chunk_files)
-        else:
-            final_file = self.multiway_merge_no_distinct(chunk_files)
+            if in_memory_chunk:
+                chunk_files.append(self.write_sorted_chunk(in_memory_chunk, len(chunk_files) + 1))
+
+            while pending_chunks.length > 0:
+                pending_chunks.dequeue().value.result()
+
+            if self.distinct_cols:
+                final_file = self.multiway_merge_distinct(chunk_files)
+            else:
+                final_file = self.multiway_merge_no_distinct(chunk_files)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+            for temp_path in chunk_files:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+        return SortedRows(self, file_path=final_file)
+
+    def top_n(self, table_rows, count: int) -> SortedRows:
+        """
+            The first `count` rows in sort order, kept in a heap whose top is the last of them,
+            so every other row is either dropped or replaces the top. Ties keep the input order.
+            If the kept rows outgrow the memory budget it falls back to sort().
+        """
+        if count <= 0:
+            return SortedRows(self, rows=[])
+
+        heap = MinHeap(self._top_entry_less)
+        rows_iterator = iter(table_rows)
+        heap_size = 0
+
+        for row_number, row in enumerate(rows_iterator):
+            entry = (self.key_func(row), row_number, row)
+
+            if len(heap) < count:
+                heap.push(entry)
+                heap_size += self.estimate_row_size(row)
+
+                if heap_size > self.memory_budget:
+                    # Only pushes happened so far - row numbers give back the input order
+                    read_rows = [None] * len(heap)
+                    for _, read_row_number, read_row in heap.items:
+                        read_rows[read_row_number] = read_row
+                    return self.sort(chain(read_rows, rows_iterator))
+
+            elif self._top_entry_less(heap.peek(), entry):
+                heap.replace(entry)
+
+        sorted_rows = [None] * len(heap)
+        for i in range(len(sorted_rows) - 1, -1, -1):
+            sorted_rows[i] = heap.pop()[2]
+
+        return SortedRows(self, rows=sorted_rows)
+
+    def select_merge_sort(self, table_rows) -> str:
+        """
+            Sort the rows into a temp file and return its path, even if they fit in memory.
+        """
+        sorted_rows = self.sort(table_rows)
+        if not sorted_rows.in_memory:
+            return sorted_rows.file_path
+
+        final_path = os.path.join(self.directory, f"{self.table_name}_merge_sort.temp")
+        with open(final_path, "wb") as f:
+            for row in sorted_rows:
+                self.write_row(f, row)
+
+        return final_path
+
+    def read_rows(self, file_path: str):
+        """
+            Yield the rows of a file written by this handler (e.g. the result of select_merge_sort).
+        """
+        if not os.path.exists(file_path):
+            raise TableError(f"MergeSort path '{file_path}' does not exist!")
 
-        for temp_path in chunk_files:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+        with open(file_path, "rb") as f:
+            while True:
+                row = self.read_next_row(f)
+                if row is None:
+                    break
+                yield row
 
-        return final_file
+    @staticmethod
+    def estimate_row_size(row: HashTable) -> int:
+        """
+            Rough size of a row held in memory: the HashTable, its nodes and the values.
+        """
+        size = sys.getsizeof(row) + sys.getsizeof(row.table_items)
+        for _, value in row.items():
+            size += ROW_VALUE_OVERHEAD + sys.getsizeof(value)
+        return size
 
     def key_func(self, row: HashTable) -> tuple:
         """
@@ -67,15 +234,16 @@ class MergeSortHandler:
 
         return tuple(key_parts)
 
+    def chunk_path(self, chunk_file_num: int) -> str:
+        return os.path.join(self.directory, f"{self.table_name}_chunk_{self.sort_id}_{chunk_file_num}.temp")
+
     def write_sorted_chunk(self, rows: List[HashTable], chunk_file_num: int) -> str:
         """
             Sort the rows in memory and write them to a temp file.
         """
-        sorted_rows = self.mergesort_in_memory(rows)
-        if self.order == "DESC":
-            sorted_rows = reverse_array(sorted_rows)
+        sorted_rows = self.sort_in_memory(rows)
 
-        tmp_path = os.path.join(self.directory, f"{self.table_name}_chunk_{id(self)}_{chunk_file_num}.temp")
+        tmp_path = self.chunk_path(chunk_file_num)
 
         with open(tmp_path, "wb") as f:
             for row in sorted_rows:
@@ -87,166 +255,161 @@ class MergeSortHandler:
         """
             Merge chunk_files into one final sorted file, skipping duplicates.
         """
-        file_handles = []
-        for temp_path in chunk_files:
-            if not os.path.exists(temp_path):
-                raise TableError(f"Temporary MergeSort file '{temp_path}' does not exist")
-            file_handles.append(open(temp_path, "rb"))
-
-        buffers = [self.read_next_row(fh) for fh in file_handles]
-
-        final_path = os.path.join(self.directory, f"{self.table_name}_merge_sort.temp")
-
-        last_distinct_key = None
-
-        with open(final_path, "wb") as out_f:
-            while True:
-                chosen_index = -1
-                chosen_row = None
-
-                for i in range(len(buffers)):
-                    row = buffers[i]
-
-                    if row is None:
-                        continue
-
-                    if chosen_row is None:
-                        chosen_index = i
-                        chosen_row = row
-                    else:
-                        if self.compare_rows(row, chosen_row) < 0:
-                            chosen_index = i
-                            chosen_row = row
-
-                if chosen_index == -1:
-                    break
-
-                # Skip duplicates
-                current_dkey = tuple(chosen_row[dc_name] for dc_name, _ in self.distinct_cols.items())
-                if current_dkey != last_distinct_key:
-                    self.write_row(out_f, chosen_row)
-                    last_distinct_key = current_dkey
-
-                buffers[chosen_index] = self.read_next_row(file_handles[chosen_index])
-
-        for fh in file_handles:
-            fh.close()
-
-        return final_path
+        return self._multi_pass_merge(chunk_files, distinct=True)
 
     def multiway_merge_no_distinct(self, chunk_files: List[str]) -> str:
         """
             Merge chunk_files into one final sorted file, NOT skipping duplicates.
         """
-        file_handles = []
-        for temp_path in chunk_files:
-            if not os.path.exists(temp_path):
-                raise TableError(f"Temporary MergeSort file '{temp_path}' does not exist")
-            file_handles.append(open(temp_path, "rb"))
+        return self._multi_pass_merge(chunk_files, distinct=False)
 
-        buffers = [self.read_next_row(fh) for fh in file_handles]
+    def _multi_pass_merge(self, chunk_files: List[str], distinct: bool) -> str:
+        """
+            Merge at most max_fan_in runs at once. While there are more, groups of runs are merged
+            into longer intermediate runs, so the number of open files stays bounded.
+        """
+        runs = chunk_files
+        pass_number = 0
 
-        final_path = os.path.join(self.directory, f"{self.table_name}_merge_sort.temp")
+        while len(runs) > self.max_fan_in:
+            next_runs = []
+            for group_start in range(0, len(runs), self.max_fan_in):
+                run_path = os.path.join(self.directory,
+                                        f"{self.table_name}_run_{self.sort_id}_{pass_number}_{len(next_runs)}.temp")
+                self._merge_runs(runs[group_start:group_start + self.max_fan_in], run_path, distinct)
+                next_runs.append(run_path)
 
-        with open(final_path, "wb") as out_f:
-            while True:
-                chosen_index = -1
-                chosen_row = None
-
-                for i in range(len(buffers)):
-                    row = buffers[i]
-                    if row is None:
-                        continue
-                    if chosen_row is None:
-                        chosen_index = i
-                        chosen_row = row
-                    else:
-                        if self.compare_rows(row, chosen_row) < 0:
-                            chosen_index = i
-                            chosen_row = row
+            for merged_path in runs:
+                if os.path.exists(merged_path):
+                    os.remove(merged_path)
 
-                if chosen_index == -1:
-                    break
+            runs = next_runs
+            pass_number += 1
 
-                self.write_row(out_f, chosen_row)
-                buffers[chosen_index] = self.read_next_row(file_handles[chosen_index])
+        final_path = os.path.join(self.directory, f"{self.table_name}_merge_sort.temp")
+        self._merge_runs(runs, final_path, distinct)
 
-        for fh in file_handles:
-            fh.close()
+        if pass_number > 0:
+            for run_path in runs:
+                if os.path.exists(run_path):
+                    os.remove(run_path)
 
         return final_path
 
-    def compare_rows(self, row1: HashTable, row2: HashTable) -> int:
+    def _merge_runs(self, run_paths: List[str], output_path: str, distinct: bool):
         """
-            Compare two rows by the same composite key used in write_sorted_chunk.
-            1) r1 < r2 -> negative
-            2) r1 == r2 -> 0
-            3) r1 > r2 -> positive
+            K-way merge of sorted runs through a heap of (sort key, run number, row) entries.
+            The sort key of every row is computed once, when the row is read.
         """
-        if self.order_by_col is not None:
-            primary1 = row1[self.order_by_col]
-            primary2 = row2[self.order_by_col]
-            if primary1 != primary2:
-                compare_value = (primary1 > primary2) - (primary1 < primary2)
-
-                if self.order == "ASC":
-                    return compare_value
-                else:
-                    return -compare_value
-
-        if self.distinct_cols:
-            for col_name, _ in self.distinct_cols.items():
-                if col_name == self.order_by_col:
-                    continue
-
-                val1 = row1[col_name]
-                val2 = row2[col_name]
-
-                if val1 != val2:
-                    compare_value = (val1 > val2) - (val1 < val2)
-                    return compare_value
+        file_handles = []
+        try:
+            for run_path in run_paths:
+                if not os.path.exists(run_path):
+                    raise TableError(f"Temporary MergeSort file '{run_path}' does not exist")
+                file_handles.append(open(run_path, "rb"))
+
+            heap = MinHeap(self._entry_less)
+            for i in range(len(file_handles)):
+                row = self.read_next_row(file_handles[i])
+                if row is not None:
+                    heap.push((self.key_func(row), i, row))
+
+            last_distinct_key = None
+
+            with open(output_path, "wb") as out_f:
+                while len(heap) > 0:
+                    _, run_number, row = heap.peek()
+
+                    if not distinct:
+                        self.write_row(out_f, row)
+                    else:
+                        # Skip duplicates
+                        current_dkey = tuple(row[dc_name] for dc_name, _ in self.distinct_cols.items())
+                        if current_dkey != last_distinct_key:
+                            self.write_row(out_f, row)
+                            last_distinct_key = current_dkey
+
+                    next_row = self.read_next_row(file_handles[run_number])
+                    if next_row is None:
+                        heap.pop()
+                    else:
+                        heap.replace((self.key_func(next_row), run_number, next_row))
+        finally:
+            for fh in file_handles:
+                fh.close()
 
-        return 0
+    def _entry_less(self, entry1: tuple, entry2: tuple) -> bool:
+        """
+            Runs are written in key order (reversed for DESC), ties are taken from the earlier run.
+        """
+        if entry1[0] == entry2[0]:
+            return entry1[1] < entry2[1]
 
-    def mergesort_in_memory(self, rows: List[HashTable]):
-        n = len(rows)
+        if self.order == "DESC":
+            return entry2[0] < entry1[0]
+        return entry1[0] < entry2[0]
 
-        if n <= 1:
-            return rows
+    def _top_entry_less(self, entry1: tuple, entry2: tuple) -> bool:
+        """
+            Reversed _entry_less - the top of a top_n() heap is the entry which comes last.
+        """
+        return self._entry_less(entry2, entry1)
 
-        mid = n // 2
-        left = self.mergesort_in_memory(rows[:mid])
-        right = self.mergesort_in_memory(rows[mid:])
-        return self.merge_two_lists(left, right)
+    def sort_in_memory(self, rows: List[HashTable]) -> List[HashTable]:
+        """
+            Stable bottom-up merge sort of the rows by their keys, which are computed once.
+            Duplicates are dropped when distinct columns are given.
+        """
+        keys = [self.key_func(row) for row in rows]
+        descending = self.order == "DESC"
+
+        rows_order = list(range(len(rows)))
+        width = 1
+        while width < len(rows_order):
+            merged_order = []
+
+            for low in range(0, len(rows_order), 2 * width):
+                i = low
+                middle = min(low + width, len(rows_order))
+                j = middle
+                high = min(low + 2 * width, len(rows_order))
+
+                while i < middle and j < high:
+                    left_key = keys[rows_order[i]]
+                    right_key = keys[rows_order[j]]
+
+                    # The right row goes first only if strictly before the left one - keeps the sort stable
+                    if (right_key > left_key) if descending else (right_key < left_key):
+                        merged_order.append(rows_order[j])
+                        j += 1
+                    else:
+                        merged_order.append(rows_order[i])
+                        i += 1
 
-    def merge_two_lists(self, left: List[HashTable], right: List[HashTable]):
-        result = []
-        i = 0
-        j = 0
+                merged_order.extend(rows_order[i:middle])
+                merged_order.extend(rows_order[j:high])
 
-        while i < len(left) and j < len(right):
-            if self.key_func(left[i]) <= self.key_func(right[j]):
-                result.append(left[i])
-                i += 1
-            else:
-                result.append(right[j])
-                j += 1
+            rows_order = merged_order
+            width *= 2
 
-        while i < len(left):
-            result.append(left[i])
-            i += 1
+        if not self.distinct_cols:
+            return [rows[i] for i in rows_order]
 
-        while j < len(right):
-            result.append(right[j])
-            j += 1
+        sorted_rows = []
+        last_distinct_key = None
+        for i in rows_order:
+            current_dkey = tuple(rows[i][dc_name] for dc_name, _ in self.distinct_cols.items())
+            if current_dkey != last_distinct_key:
+                sorted_rows.append(rows[i])
+                last_distinct_key = current_dkey
 
-        return result
+        return sorted_rows
 
     def write_row(self, file_handle, row: HashTable):
         row_data = self.serialize_row(row)
         length = len(row_data)
         length_bytes = struct.pack("i", length)
-        row_hash_val = polynomial_rolling_hash(length_bytes + row_data)
+        row_hash_val = compute_checksum(length_bytes + row_data, CHECKSUM_ALGORITHM)
         row_hash_bytes = struct.pack("I", row_hash_val)
 
         file_handle.write(row_hash_bytes)
@@ -268,7 +431,7 @@ class MergeSortHandler:
         if len(row_data) < length:
             return None   # Possible behavior - not due to corruption
 
-        computed_hash_val = polynomial_rolling_hash(length_data + row_data)
+        computed_hash_val = compute_checksum(length_data + row_data, CHECKSUM_ALGORITHM)
         if computed_hash_val != stored_hash_val:
             raise TableError("Corrupted file: MergeSort invalid row hash")
 
@@ -1,59 +1,328 @@
 import os
+import struct
 
 from data_structures.hash_table import HashTable
 from db_components.column import Column
+from db_components.free_space_map import FreeSpaceMap
 from db_components.freeslot import FreeSlot
-from db_components.index import TableIndex
+from db_components.index import TableIndex, BTREE_INDEX
+from utils.checksum import compute_checksum, validate_checksum_algorithm, ROLLING_HASH
 from utils.errors import TableError
-from utils.extra import format_size, polynomial_rolling_hash
+from utils.extra import format_size
 from utils.string_utils import custom_split
 
 
+METADATA_MAGIC = b"PBMD"
+METADATA_VERSION = 2  # -> 2 added the index type, version 1 files are still loaded (their indexes are BTREE)
+
+# magic, version, checksum algorithm name
+METADATA_HEADER_FORMAT = "<4sB8s"
+METADATA_HEADER_SIZE = struct.calcsize(METADATA_HEADER_FORMAT)
+
+# rows count, table end, first offset, last offset - updated in place after every insert and delete
+COUNTERS_FORMAT = "<qqqq"
+COUNTERS_SIZE = struct.calcsize(COUNTERS_FORMAT)
+COUNTERS_OFFSET = METADATA_HEADER_SIZE
+
+# schema length, schema checksum - the schema changes only with the table indexes
+SCHEMA_HEADER_FORMAT = "<II"
+SCHEMA_OFFSET = COUNTERS_OFFSET + COUNTERS_SIZE + 4  # -> the counters are followed by their checksum
+
+# Every change of the free slots is appended to a separate file as (operation, position, length, checksum)
+FREE_SLOT_RECORD_FORMAT = "<BqqI"
+FREE_SLOT_RECORD_SIZE = struct.calcsize(FREE_SLOT_RECORD_FORMAT)
+FREE_SLOT_ADDED = 1
+FREE_SLOT_REMOVED = 0
+FREE_SLOTS_LOG_MIN_COMPACT = 1024
+
+
+def _pack_string(value: str) -> bytes:
+    value_bytes = value.encode()
+    return struct.pack("<H", len(value_bytes)) + value_bytes
+
+
+def _unpack_string(data: bytes, offset: int) -> tuple:
+    """
+        Returns the decoded string and the offset right after it.
+    """
+    length = struct.unpack_from("<H", data, offset)[0]
+    offset += 2
+    return data[offset:offset + length].decode(), offset + length
+
+
 class Metadata:
-    def __init__(self, table_name="", metadata_file_path="", columns: HashTable | None = None):
+    """
+        Table description stored in a binary file:
+        - a header with the format version and the checksum algorithm of the table;
+        - a fixed-offset block of counters (rows count, table end, first and last offsets),
+          overwritten in place by save_counters();
+        - the schema (name, columns and indexes), rewritten only by save_metadata().
+
+        The free slots live in a separate append-only log of added and removed slots.
+        Old text metadata files are still loaded and are converted on their first save.
+    """
+
+    def __init__(self, table_name="", metadata_file_path="", columns: HashTable | None = None,
+                 checksum: str = ROLLING_HASH):
+        """
+            checksum - the algorithm used for every file of the table (metadata, data and indexes).
+        """
         self.table_name = table_name
         self.metadata_file_path = metadata_file_path
+        self.free_slots_file_path = os.path.splitext(metadata_file_path)[0] + ".free"
         self.columns = columns
+        self.checksum = checksum
 
         self.rows_count = 0
-        self.free_slots = []
+        self.free_space = FreeSpaceMap()
         self.table_end = 0
         self.first_offset = -1
         self.last_offset = -1
 
         self.indexes = HashTable()
 
+        self.pending_free_slot_records = []
+        self.free_slot_records_count = 0
+        self.legacy_format = False
+
+    def allocate_slot(self, size: int) -> int | None:
+        """
+            Returns the position of `size` free bytes inside the table or None if there are none.
+        """
+        position = self.free_space.allocate(size)
+        if position is not None:
+            self._log_free_slot(FREE_SLOT_REMOVED, FreeSlot(position, size))
+        return position
+
+    def release_slot(self, position: int, length: int):
+        """
+            Free the bytes of a deleted row. Free space at the end of the table shrinks the table instead.
+        """
+        self.free_space.release(position, length)
+        self._log_free_slot(FREE_SLOT_ADDED, FreeSlot(position, length))
+
+        tail_slot = self.free_space.tail_slot(self.table_end)
+        if tail_slot is not None:
+            self.free_space.take(tail_slot.slot_position, tail_slot.slot_length)
+            self._log_free_slot(FREE_SLOT_REMOVED, tail_slot)
+            self.table_end = tail_slot.slot_position
+
+    def clear_free_slots(self):
+        """
+            The free slots log is rewritten by the next save_metadata().
+        """
+        self.free_space.clear()
+        self.pending_free_slot_records = []
+
+    def _log_free_slot(self, operation: int, slot: FreeSlot):
+        record = struct.pack("<Bqq", operation, slot.slot_position, slot.slot_length)
+        self.pending_free_slot_records.append(record + struct.pack("<I", compute_checksum(record, self.checksum)))
+
+    def _serialize_counters(self) -> bytes:
+        counters = struct.pack(COUNTERS_FORMAT, self.rows_count, self.table_end, self.first_offset, self.last_offset)
+        return counters + struct.pack("<I", compute_checksum(counters, self.checksum))
+
+    def _serialize_schema(self) -> bytes:
+        schema = [_pack_string(self.table_name), struct.pack("<H", len(self.columns))]
+
+        for column_name, column in self.columns.items():
+            schema.append(_pack_string(column_name))
+            schema.append(_pack_string(column.column_type))
+
+            constraints = [(name, value) for name, value in column.constraints.items() if value is not None]
+            schema.append(struct.pack("<H", len(constraints)))
+            for constraint_name, value in constraints:
+                schema.append(_pack_string(constraint_name))
+                schema.append(_pack_string(str(value)))
+
+        indexes = [index for _, index in self.indexes.items()]
+        schema.append(struct.pack("<H", len(indexes)))
+        for index in indexes:
+            schema.append(_pack_string(index.column.column_name))
+            schema.append(_pack_string(index.index_name))
+            schema.append(_pack_string(index.index_path))
+            schema.append(_pack_string(index.pointer_list_data_path))
+            schema.append(_pack_string(index.index_type))
+
+        return b"".join(schema)
+
     def save_metadata(self):
-        metadata_content = [
-            f"Title:{self.table_name}\n",
-            f"Total Columns:{len(self.columns)}\n",
-            "Columns:\n"
-        ]
-        for _, column in self.columns.items():
-            metadata_content.append(f"{column}\n")
-
-        metadata_content.append(f"Rows:{self.rows_count}\n")
-        metadata_content.append(f"Free Slots:{','.join(str(s) for s in self.free_slots)}\n")
-        metadata_content.append(f"Table End:{self.table_end}\n")
-        metadata_content.append(f"Offsets:{self.first_offset}|{self.last_offset}\n")
-
-        metadata_content.append(f"Indexes:{len(self.indexes)}")
-        for _, ind in self.indexes.items():
-            metadata_content.append(f"\n{ind}")
-
-        metadata_str = f"Total Lines:{len(metadata_content) + 2}\n" + "".join(metadata_content)
-        metadata_hash = polynomial_rolling_hash(metadata_str.encode())
+        """
+            Rewrite the whole metadata file and compact the free slots log.
+        """
+        header = struct.pack(METADATA_HEADER_FORMAT, METADATA_MAGIC, METADATA_VERSION, self.checksum.encode())
+        schema = self._serialize_schema()
+        schema_header = struct.pack(SCHEMA_HEADER_FORMAT, len(schema), compute_checksum(schema, self.checksum))
+
+        self.pending_free_slot_records = []
+        for slot in self.free_space.slots():
+            self._log_free_slot(FREE_SLOT_ADDED, slot)
+
+        try:
+            with open(self.free_slots_file_path, "wb") as f:
+                f.write(b"".join(self.pending_free_slot_records))
+
+            with open(self.metadata_file_path, "wb") as f:
+                f.write(header + self._serialize_counters() + schema_header + schema)
+        except OSError as e:
+            raise TableError(f"Error saving the metadata: {e}")
+
+        self.free_slot_records_count = len(self.pending_free_slot_records)
+        self.pending_free_slot_records = []
+        self.legacy_format = False
+
+    def save_counters(self):
+        """
+            Persist the changes of inserts and deletes: append the free slot changes to their log
+            and overwrite the counters block in place.
+            The log is compacted once most of its records are stale.
+        """
+        if self.legacy_format:
+            self.save_metadata()
+            return
+
+        self.free_slot_records_count += len(self.pending_free_slot_records)
+        if self.free_slot_records_count > max(FREE_SLOTS_LOG_MIN_COMPACT, 2 * len(self.free_space)):
+            self.save_metadata()
+            return
 
         try:
-            with open(self.metadata_file_path, "w") as f:
-                f.write(f"Hash:{metadata_hash}\n")
-                f.write(metadata_str)
-        except Exception as e:
-            raise TableError("Error saving the metadata")
+            if self.pending_free_slot_records:
+                with open(self.free_slots_file_path, "ab") as f:
+                    f.write(b"".join(self.pending_free_slot_records))
+
+            with open(self.metadata_file_path, "rb+") as f:
+                f.seek(COUNTERS_OFFSET)
+                f.write(self._serialize_counters())
+        except OSError as e:
+            raise TableError(f"Error saving the metadata: {e}")
+
+        self.pending_free_slot_records = []
+
+    def delete_files(self):
+        os.remove(self.metadata_file_path)
+        if os.path.exists(self.free_slots_file_path):
+            os.remove(self.free_slots_file_path)
 
     @staticmethod
     def load_metadata(metadata_file: str):
+        with open(metadata_file, "rb") as f:
+            data = f.read()
+
+        if data[:len(METADATA_MAGIC)] != METADATA_MAGIC:
+            return Metadata._load_legacy_metadata(metadata_file)
+
+        if len(data) < SCHEMA_OFFSET + struct.calcsize(SCHEMA_HEADER_FORMAT):
+            raise TableError("Table metadata file is truncated")
+
+        _, version, checksum_name = struct.unpack_from(METADATA_HEADER_FORMAT, data, 0)
+        if version < 1 or version > METADATA_VERSION:
+            raise TableError(f"Unsupported table metadata version: {version}")
+
+        try:
+            checksum = validate_checksum_algorithm(checksum_name.rstrip(b"\x00").decode())
+        except ValueError as e:
+            raise TableError(f"Table metadata error: {e}")
+
+        table_metadata = Metadata(metadata_file_path=metadata_file, checksum=checksum)
+
+        counters = data[COUNTERS_OFFSET:COUNTERS_OFFSET + COUNTERS_SIZE]
+        counters_hash = struct.unpack_from("<I", data, COUNTERS_OFFSET + COUNTERS_SIZE)[0]
+        if compute_checksum(counters, checksum) != counters_hash:
+            raise TableError("Table metadata hash does not match")
+
+        schema_length, schema_hash = struct.unpack_from(SCHEMA_HEADER_FORMAT, data, SCHEMA_OFFSET)
+        schema_start = SCHEMA_OFFSET + struct.calcsize(SCHEMA_HEADER_FORMAT)
+        schema = data[schema_start:schema_start + schema_length]
+        if len(schema) != schema_length or compute_checksum(schema, checksum) != schema_hash:
+            raise TableError("Table metadata hash does not match")
+
+        try:
+            table_metadata._deserialize_schema(schema, version)
+        except (struct.error, UnicodeDecodeError, ValueError) as e:
+            raise TableError(f"Corrupted table metadata: {e}")
+
+        (table_metadata.rows_count, table_metadata.table_end,
+         table_metadata.first_offset, table_metadata.last_offset) = struct.unpack(COUNTERS_FORMAT, counters)
+
+        table_metadata._load_free_slots()
+
+        return table_metadata
+
+    def _deserialize_schema(self, schema: bytes, version: int = METADATA_VERSION):
+        self.table_name, offset = _unpack_string(schema, 0)
+
+        columns_count = struct.unpack_from("<H", schema, offset)[0]
+        offset += 2
+
+        columns = HashTable(size=columns_count)
+        for _ in range(columns_count):
+            column_name, offset = _unpack_string(schema, offset)
+            column_type, offset = _unpack_string(schema, offset)
+
+            constraints_count = struct.unpack_from("<H", schema, offset)[0]
+            offset += 2
+            constraints = HashTable()
+            for _ in range(constraints_count):
+                constraint_name, offset = _unpack_string(schema, offset)
+                constraints[constraint_name], offset = _unpack_string(schema, offset)
+
+            columns[column_name] = Column(column_name=column_name, column_type=column_type,
+                                          given_constraints=constraints)
+
+        indexes_count = struct.unpack_from("<H", schema, offset)[0]
+        offset += 2
+
+        indexes = HashTable()
+        for _ in range(indexes_count):
+            column_name, offset = _unpack_string(schema, offset)
+            index_name, offset = _unpack_string(schema, offset)
+            index_path, offset = _unpack_string(schema, offset)
+            pointer_list_data_path, offset = _unpack_string(schema, offset)
+            index_type = BTREE_INDEX
+            if version >= 2:
+                index_type, offset = _unpack_string(schema, offset)
+
+            indexes[column_name] = TableIndex(column=columns[column_name],
+                                              index_name=index_name,
+                                              index_path=index_path,
+                                              pointer_list_data_path=pointer_list_data_path,
+                                              checksum=self.checksum,
+                                              index_type=index_type)
+
+        self.columns = columns
+        self.indexes = indexes
+
+    def _load_free_slots(self):
+        """
+            Replay the free slots log through the free space map.
+            A removed record takes its bytes out of whichever free slot contains them.
+        """
+        if not os.path.exists(self.free_slots_file_path):
+            return
+
+        with open(self.free_slots_file_path, "rb") as f:
+            data = f.read()
+
+        if len(data) % FREE_SLOT_RECORD_SIZE != 0:
+            raise TableError("Corrupted free slots file: truncated record")
+
+        for record_start in range(0, len(data), FREE_SLOT_RECORD_SIZE):
+            operation, position, length, record_hash = struct.unpack_from(FREE_SLOT_RECORD_FORMAT, data, record_start)
+            if compute_checksum(data[record_start:record_start + FREE_SLOT_RECORD_SIZE - 4], self.checksum) != record_hash:
+                raise TableError(f"Corrupted free slots file: record at {record_start}")
+
+            if operation == FREE_SLOT_ADDED:
+                self.free_space.release(position, length)
+            else:
+                self.free_space.take(position, length)
+
+        self.free_slot_records_count = len(data) // FREE_SLOT_RECORD_SIZE
+
+    @staticmethod
+    def _load_legacy_metadata(metadata_file: str):
         table_metadata = Metadata(metadata_file_path=metadata_file)
+        table_metadata.legacy_format = True
 
         with open(metadata_file) as f:
             lines = f.readlines()
@@ -62,10 +331,17 @@ class Metadata:
             raise TableError("Table metadata file does not have the correct number of lines")
 
         curr_index = 0
-        table_hash_number = int(custom_split(lines[curr_index], ":")[1][:-1])
+        hash_parts = custom_split(lines[curr_index][:-1], ":")
+        checksum = ROLLING_HASH
+        if len(hash_parts) == 3:
+            try:
+                checksum = validate_checksum_algorithm(hash_parts[1])
+            except ValueError as e:
+                raise TableError(f"Table metadata error: {e}")
+        table_hash_number = int(hash_parts[-1])
         curr_index += 1
         metadata_str = "".join(lines[curr_index:])
-        metadata_hash = polynomial_rolling_hash(metadata_str.encode())
+        metadata_hash = compute_checksum(metadata_str.encode(), checksum)
         if table_hash_number != metadata_hash:
             raise TableError("Table metadata hash does not match")
 
@@ -104,12 +380,11 @@ class Metadata:
         initial_free_slots = custom_split(custom_split(lines[curr_index][:-1], ":")[1], ",")
         curr_index += 1
 
-        free_slots = []
+        free_space = FreeSpaceMap()
         for free_slot in initial_free_slots:
             if free_slot:
                 slot_pos, slot_len = custom_split(free_slot, "|")
-                slot = FreeSlot(slot_position=int(slot_pos), slot_length=int(slot_len))
-                free_slots.append(slot)
+                free_space.release(int(slot_pos), int(slot_len))
 
         table_end = int(custom_split(lines[curr_index], ":")[1])
         curr_index += 1
@@ -124,23 +399,27 @@ class Metadata:
         curr_index += 1
 
         for _ in range(total_indexes_count):
-            index_info = custom_split(lines[curr_index], "|")
+            index_info = custom_split(lines[curr_index].rstrip("\n"), "|")
             column_name = index_info[0]
             index_name = index_info[1]
             index_path = index_info[2]
             pointer_list_data_path = index_info[3]
+            index_type = index_info[4] if len(index_info) > 4 else BTREE_INDEX
             column = columns[column_name]
             index = TableIndex(column=column,
                                index_name=index_name,
                                index_path=index_path,
-                               pointer_list_data_path=pointer_list_data_path)
+                               pointer_list_data_path=pointer_list_data_path,
+                               checksum=checksum,
+                               index_type=index_type)
             indexes[column_name] = index
             curr_index += 1
 
         table_metadata.table_name = table_name
+        table_metadata.checksum = checksum
         table_metadata.columns = columns
         table_metadata.rows_count = rows_count
-        table_metadata.free_slots = free_slots
+        table_metadata.free_space = free_space
         table_metadata.table_end = table_end
         table_metadata.first_offset = first_offset
         table_metadata.last_offset = last_offset
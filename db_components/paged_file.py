@@ -0,0 +1,156 @@
+from data_structures.lru_cache import LRUCache
+from settings import DATA_PAGE_SIZE, DATA_PAGE_CACHE_SIZE, DATA_READ_AHEAD_SIZE
+from utils.errors import TableError
+
+
+class PagedFile:
+    """
+        Keeps a data file open for the lifetime of its owner and serves reads
+        through a fixed-size LRU cache of file pages.
+
+        Sequential scans can bypass the page cache with read_ahead(), which serves reads from
+        one large buffered window of the file.
+
+        Writes go straight to the file (write-through) and patch any cached page and the
+        read-ahead window they touch, so neither has to be invalidated by the owner.
+
+        last_read_cold tells whether the last read had to go to the file, so callers can
+        skip re-verifying bytes which were served from memory.
+    """
+
+    def __init__(self, file_path: str, page_size: int = DATA_PAGE_SIZE, cache_size: int = DATA_PAGE_CACHE_SIZE,
+                 read_ahead_size: int = DATA_READ_AHEAD_SIZE):
+        self.file_path = file_path
+        self.page_size = page_size
+        self.cache = LRUCache(cache_size)
+
+        self.read_ahead_size = read_ahead_size
+        self.window_start = 0
+        self.window = bytearray()
+        self.last_read_cold = False
+
+        try:
+            self.file = open(self.file_path, "rb+")
+        except OSError as e:
+            raise TableError(f"Cannot open data file '{self.file_path}': {e}")
+
+    def _load_page(self, page_number: int) -> bytes:
+        page = self.cache.get(page_number)
+
+        if page is None:
+            self.last_read_cold = True
+            self.file.seek(page_number * self.page_size)
+            page = self.file.read(self.page_size)
+            self.cache.put(page_number, page)
+
+        return page
+
+    def read(self, position: int, size: int) -> bytes:
+        """
+            Read `size` bytes starting at `position`.
+            Less bytes are returned if the end of the file is reached.
+        """
+        self.last_read_cold = False
+        if size <= 0:
+            return b""
+
+        first_page = position // self.page_size
+        last_page = (position + size - 1) // self.page_size
+        page_offset = position - first_page * self.page_size
+
+        if first_page == last_page:
+            return self._load_page(first_page)[page_offset:page_offset + size]
+
+        parts = []
+        for page_number in range(first_page, last_page + 1):
+            page = self._load_page(page_number)
+            parts.append(page)
+
+            if len(page) < self.page_size:
+                break  # -> end of file
+
+        return b"".join(parts)[page_offset:page_offset + size]
+
+    def in_read_ahead_window(self, position: int, size: int = 1) -> bool:
+        relative_position = position - self.window_start
+        return 0 <= relative_position and relative_position + size <= len(self.window)
+
+    def read_ahead(self, position: int, size: int) -> bytes:
+        """
+            Read through the read-ahead window.
+            If the requested bytes are outside of it, the window is refilled starting at `position`.
+            The window is read once per scan, so these reads always count as cold.
+        """
+        self.last_read_cold = True
+        if not self.in_read_ahead_window(position, size):
+            self.file.seek(position)
+            self.window = bytearray(self.file.read(max(self.read_ahead_size, size)))
+            self.window_start = position
+
+        relative_position = position - self.window_start
+        return bytes(self.window[relative_position:relative_position + size])
+
+    def write(self, position: int, data: bytes):
+        self.file.seek(position)
+        self.file.write(data)
+        self.file.flush()
+
+        self._patch_cached_pages(position, data)
+        self._patch_read_ahead_window(position, data)
+
+    def _patch_read_ahead_window(self, position: int, data: bytes):
+        patch_start = max(position, self.window_start)
+        patch_end = min(position + len(data), self.window_start + len(self.window))
+
+        if patch_start >= patch_end:
+            return
+
+        self.window[patch_start - self.window_start:patch_end - self.window_start] = \
+            data[patch_start - position:patch_end - position]
+
+    def _patch_cached_pages(self, position: int, data: bytes):
+        end = position + len(data)
+        first_page = position // self.page_size
+        last_page = (end - 1) // self.page_size
+
+        for page_number in range(first_page, last_page + 1):
+            page = self.cache.peek(page_number)
+            if page is None:
+                continue
+
+            page_start = page_number * self.page_size
+            patch_start = max(position, page_start)
+            patch_end = min(end, page_start + self.page_size)
+            relative_start = patch_start - page_start
+
+            if relative_start > len(page):
+                # The write leaves a gap after the cached (shorter) end of file page
+                self.cache.delete(page_number)
+                continue
+
+            new_page = (page[:relative_start]
+                        + data[patch_start - position:patch_end - position]
+                        + page[relative_start + patch_end - patch_start:])
+            self.cache.put(page_number, new_page)
+
+    def clear_cache(self):
+        self.cache.clear()
+        self.window_start = 0
+        self.window = bytearray()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+        self.clear_cache()
+
+    @property
+    def hits(self):
+        return self.cache.hits
+
+    @property
+    def misses(self):
+        return self.cache.misses
+
+    @property
+    def hit_rate(self):
+        return self.cache.hit_rate
@@ -0,0 +1,107 @@
+import struct
+
+from data_structures.hash_table import HashTable
+from utils.date import Date
+from utils.errors import TableError
+
+NUMBER_TYPE = 0
+STRING_TYPE = 1
+DATE_TYPE = 2
+
+COLUMN_TYPES = HashTable([("number", NUMBER_TYPE), ("string", STRING_TYPE), ("date", DATE_TYPE)])
+
+INT_TAG = ord("I")
+FLOAT_TAG = ord("F")
+
+
+class RowDecoder:
+    """
+        Decodes only the columns a query needs from serialized table rows.
+
+        The columns of a row are stored one after another in schema order, so the start of every
+        needed column is found by skipping the ones before it - a number by its type tag, a string
+        by its length prefix and a date by its fixed 10 bytes - without decoding them.
+        The WHERE columns are decoded and checked first, the projected ones only for matching rows.
+    """
+
+    def __init__(self, schema_columns: HashTable, projected_columns: HashTable, where_expr=None):
+        self.column_names = []
+        self.column_types = []
+        schema_indexes = HashTable(size=len(schema_columns))
+        for column_name, column in schema_columns.items():
+            schema_indexes[column_name] = len(self.column_names)
+            self.column_names.append(column_name)
+            self.column_types.append(COLUMN_TYPES[column.column_type])
+
+        self.matches = None
+        self.where_indexes = []
+        self.schema_size = len(self.column_names)
+        if where_expr is not None:
+            self.matches = where_expr.compile_expression(schema_columns)
+            for column_name in where_expr.column_names():
+                if schema_indexes[column_name] not in self.where_indexes:
+                    self.where_indexes.append(schema_indexes[column_name])
+
+        self.projected_indexes = [schema_indexes[column_name] for column_name, _ in projected_columns.items()]
+
+        # Columns after the last needed one are never walked
+        self.columns_to_walk = max(self.where_indexes + self.projected_indexes, default=-1) + 1
+
+    def decode(self, row_data: bytes) -> HashTable | None:
+        """
+            Returns the projected row, or None if the row does not match the WHERE condition.
+        """
+        try:
+            starts = self._column_starts(row_data)
+
+            values = [None] * self.schema_size
+            if self.matches is not None:
+                where_row = HashTable(size=self.schema_size)
+                for i in self.where_indexes:
+                    values[i] = self._decode_value(row_data, starts[i], self.column_types[i])
+                    where_row[self.column_names[i]] = values[i]
+
+                if not self.matches(where_row):
+                    return None
+
+            row = HashTable()
+            for i in self.projected_indexes:
+                if values[i] is None:
+                    values[i] = self._decode_value(row_data, starts[i], self.column_types[i])
+                row[self.column_names[i]] = values[i]
+        except (ValueError, IndexError, struct.error) as e:
+            raise TableError(f"Corrupted file: cannot decode row data: {e}")
+
+        return row
+
+    def _column_starts(self, row_data: bytes) -> list:
+        starts = []
+        offset = 0
+
+        for i in range(self.columns_to_walk):
+            starts.append(offset)
+
+            column_type = self.column_types[i]
+            if column_type == NUMBER_TYPE:
+                offset += 5 if row_data[offset] == INT_TAG else 9  # -> type tag + "i" or "d"
+            elif column_type == STRING_TYPE:
+                offset += 4 + struct.unpack_from("i", row_data, offset)[0]
+            else:
+                offset += 10  # -> Date object always has a length of 10
+
+        return starts
+
+    @staticmethod
+    def _decode_value(row_data: bytes, offset: int, column_type: int):
+        if column_type == NUMBER_TYPE:
+            if row_data[offset] == INT_TAG:
+                return struct.unpack_from("i", row_data, offset + 1)[0]
+            if row_data[offset] == FLOAT_TAG:
+                return struct.unpack_from("d", row_data, offset + 1)[0]
+            raise ValueError(f"unknown number type {row_data[offset]}")
+
+        if column_type == STRING_TYPE:
+            length = struct.unpack_from("i", row_data, offset)[0]
+            return row_data[offset + 4:offset + 4 + length].decode()
+
+        return Date.from_bytes(row_data[offset:offset + 10])
@@ -0,0 +1,316 @@
+import os
+import struct
+
+from data_structures.hash_table import HashTable
+from settings import ROW_DIRECTORY_BLOCK_SIZE
+from utils.binary_insertion_sort import binary_search
+from utils.checksum import compute_checksum, ROLLING_HASH
+from utils.errors import TableError
+
+ROW_DIRECTORY_MAGIC = b"PBRD"
+
+# magic, blocks count, checksum of the block list
+DIRECTORY_HEADER_FORMAT = "<4sII"
+DIRECTORY_HEADER_SIZE = struct.calcsize(DIRECTORY_HEADER_FORMAT)
+# slot of the block in the rows file, rows in the block
+DIRECTORY_ENTRY_FORMAT = "<II"
+
+# rows in the block, checksum of the offsets
+BLOCK_HEADER_FORMAT = "<II"
+BLOCK_HEADER_SIZE = struct.calcsize(BLOCK_HEADER_FORMAT)
+
+LOADED_BLOCKS_TABLE_SIZE = 1024
+
+
+class RowDirectory:
+    """
+        Maps row numbers to the offsets of their nodes in the data file.
+
+        The offsets are stored in chain order, split into blocks of at most `block_capacity` entries.
+        Every block has a fixed-size slot in the rows file and the directory file keeps the order
+        of the blocks together with their row counts, so finding row N is a binary search over
+        the running counts followed by loading a single block.
+
+        Blocks are loaded on demand and only changed blocks are written back by save().
+    """
+
+    def __init__(self, rows_file_path: str, directory_file_path: str,
+                 block_capacity: int = ROW_DIRECTORY_BLOCK_SIZE, checksum: str = ROLLING_HASH):
+        self.rows_file_path = rows_file_path
+        self.directory_file_path = directory_file_path
+        self.block_capacity = block_capacity
+        self.block_size = BLOCK_HEADER_SIZE + block_capacity * 8
+        self.checksum = checksum
+
+        self.loaded = False
+        self.block_slots = []
+        self.block_counts = []
+        self.rows_count = 0
+
+        self.blocks = HashTable(size=LOADED_BLOCKS_TABLE_SIZE)
+        self.dirty_slots = []
+        self.free_slots = []
+        self.slots_count = 0
+
+        self.prefix_counts = []
+        self.prefix_outdated = True
+        self.directory_outdated = False
+
+    def exists(self) -> bool:
+        return self.loaded or os.path.exists(self.directory_file_path)
+
+    def load(self):
+        if self.loaded:
+            return
+
+        with open(self.directory_file_path, "rb") as f:
+            data = f.read()
+
+        if len(data) < DIRECTORY_HEADER_SIZE:
+            raise TableError("Corrupted row directory: cannot read the header")
+
+        magic, blocks_count, directory_hash = struct.unpack_from(DIRECTORY_HEADER_FORMAT, data, 0)
+        entries = data[DIRECTORY_HEADER_SIZE:]
+        if (magic != ROW_DIRECTORY_MAGIC
+                or len(entries) != blocks_count * struct.calcsize(DIRECTORY_ENTRY_FORMAT)
+                or compute_checksum(entries, self.checksum) != directory_hash):
+            raise TableError("Corrupted row directory: block list does not match its hash")
+
+        used_slots = HashTable(size=max(blocks_count, 1))
+        for slot, count in struct.iter_unpack(DIRECTORY_ENTRY_FORMAT, entries):
+            self.block_slots.append(slot)
+            self.block_counts.append(count)
+            self.rows_count += count
+            used_slots[slot] = True
+
+        self.slots_count = os.path.getsize(self.rows_file_path) // self.block_size \
+            if os.path.exists(self.rows_file_path) else 0
+        self.slots_count = max(self.slots_count, max(self.block_slots) + 1 if self.block_slots else 0)
+        self.free_slots = [slot for slot in range(self.slots_count) if used_slots[slot] is None]
+
+        self.loaded = True
+
+    def _load_block(self, block_index: int) -> list:
+        slot = self.block_slots[block_index]
+        block = self.blocks[slot]
+        if block is not None:
+            return block
+
+        with open(self.rows_file_path, "rb") as f:
+            f.seek(slot * self.block_size)
+            block_header = f.read(BLOCK_HEADER_SIZE)
+            if len(block_header) != BLOCK_HEADER_SIZE:
+                raise TableError(f"Corrupted row directory: cannot read block {slot}")
+
+            count, block_hash = struct.unpack(BLOCK_HEADER_FORMAT, block_header)
+            offsets_bytes = f.read(count * 8)
+
+        if (count != self.block_counts[block_index] or len(offsets_bytes) != count * 8
+                or compute_checksum(offsets_bytes, self.checksum) != block_hash):
+            raise TableError(f"Corrupted row directory: block {slot} does not match its hash")
+
+        block = list(struct.unpack(f"<{count}q", offsets_bytes))
+        self.blocks[slot] = block
+        return block
+
+    def _mark_dirty(self, block_index: int):
+        slot = self.block_slots[block_index]
+        if slot not in self.dirty_slots:
+            self.dirty_slots.append(slot)
+        self.prefix_outdated = True
+        self.directory_outdated = True
+
+    def _new_block(self, block_index: int, block: list):
+        slot = self.free_slots.pop() if self.free_slots else self.slots_count
+        if slot == self.slots_count:
+            self.slots_count += 1
+
+        self.block_slots.insert(block_index, slot)
+        self.block_counts.insert(block_index, len(block))
+        self.blocks[slot] = block
+        self._mark_dirty(block_index)
+
+    def _drop_block(self, block_index: int):
+        slot = self.block_slots.pop(block_index)
+        self.block_counts.pop(block_index)
+        self.blocks.delete(slot)
+        if slot in self.dirty_slots:
+            self.dirty_slots.remove(slot)
+
+        self.free_slots.append(slot)
+        self.prefix_outdated = True
+        self.directory_outdated = True
+
+    def _find(self, row_number: int) -> tuple:
+        """
+            Returns the index of the block holding the 1-based `row_number` and the index inside that block.
+        """
+        if row_number < 1 or row_number > self.rows_count:
+            raise TableError(f"Row {row_number} does not exist!")
+
+        if self.prefix_outdated:
+            self.prefix_counts = []
+            rows_before = 0
+            for count in self.block_counts:
+                self.prefix_counts.append(rows_before)
+                rows_before += count
+            self.prefix_outdated = False
+
+        # The first block starting at or after row_number, the row is in the block before it
+        block_index = binary_search(self.prefix_counts, row_number, 0, len(self.prefix_counts) - 1, "ASC") - 1
+        return block_index, row_number - 1 - self.prefix_counts[block_index]
+
+    def locate(self, row_number: int) -> int:
+        self.load()
+        block_index, position_in_block = self._find(row_number)
+        return self._load_block(block_index)[position_in_block]
+
+    def append(self, offsets: list):
+        """
+            Add the offsets of rows linked at the end of the chain.
+        """
+        self.load()
+        if not offsets:
+            return
+
+        start = 0
+
+        if self.block_slots and self.block_counts[-1] < self.block_capacity:
+            last_block = self._load_block(len(self.block_slots) - 1)
+            start = self.block_capacity - len(last_block)
+            last_block.extend(offsets[:start])
+            self.block_counts[-1] = len(last_block)
+            self._mark_dirty(len(self.block_slots) - 1)
+
+        for block_start in range(start, len(offsets), self.block_capacity):
+            self._new_block(len(self.block_slots), offsets[block_start:block_start + self.block_capacity])
+
+        self.rows_count += len(offsets)
+        self.prefix_outdated = True
+
+    def remove(self, row_number: int):
+        self.remove_rows([row_number])
+
+    def remove_rows(self, row_numbers: list):
+        """
+            Remove the given ascending 1-based row numbers with one pass over the block counts.
+        """
+        self.load()
+
+        changed_blocks = []
+        block_index = 0
+        rows_before = 0
+        for row_number in row_numbers:
+            if row_number < 1 or row_number > self.rows_count:
+                raise TableError(f"Row {row_number} does not exist!")
+
+            while row_number > rows_before + self.block_counts[block_index]:
+                rows_before += self.block_counts[block_index]
+                block_index += 1
+
+            if not changed_blocks or changed_blocks[-1][0] != block_index:
+                changed_blocks.append((block_index, []))
+            changed_blocks[-1][1].append(row_number - 1 - rows_before)
+
+        for block_index, removed_indexes in changed_blocks:
+            block = self._load_block(block_index)
+            kept_offsets = []
+            previous_removed = -1
+            for removed_index in removed_indexes:
+                kept_offsets.extend(block[previous_removed + 1:removed_index])
+                previous_removed = removed_index
+            kept_offsets.extend(block[previous_removed + 1:])
+
+            self._replace_block(block_index, kept_offsets)
+
+        self._merge_small_blocks()
+
+    def remove_offsets(self, offsets: HashTable):
+        """
+            Remove every offset which is a key of `offsets`, for rows whose numbers are not known.
+            All blocks have to be checked.
+        """
+        self.load()
+
+        for block_index in range(len(self.block_slots)):
+            block = self._load_block(block_index)
+            kept_offsets = [offset for offset in block if offsets[offset] is None]
+            if len(kept_offsets) != len(block):
+                self._replace_block(block_index, kept_offsets)
+
+        self._merge_small_blocks()
+
+    def _replace_block(self, block_index: int, offsets: list):
+        self.blocks[self.block_slots[block_index]] = offsets
+        self.rows_count -= self.block_counts[block_index] - len(offsets)
+        self.block_counts[block_index] = len(offsets)
+        self._mark_dirty(block_index)
+
+    def _merge_small_blocks(self):
+        """
+            Drop empty blocks and merge neighbours which together fill at most half a block.
+        """
+        for block_index in range(len(self.block_slots) - 1, -1, -1):
+            if self.block_counts[block_index] == 0:
+                self._drop_block(block_index)
+            elif (block_index + 1 < len(self.block_slots)
+                  and self.block_counts[block_index] + self.block_counts[block_index + 1] <= self.block_capacity // 2):
+                block = self._load_block(block_index)
+                block.extend(self._load_block(block_index + 1))
+                self.block_counts[block_index] = len(block)
+                self._mark_dirty(block_index)
+                self._drop_block(block_index + 1)
+
+    def rebuild(self, offsets):
+        """
+            Replace the whole directory with the given offsets (in chain order).
+        """
+        self.loaded = True
+        self.block_slots = []
+        self.block_counts = []
+        self.rows_count = 0
+        self.blocks = HashTable(size=LOADED_BLOCKS_TABLE_SIZE)
+        self.dirty_slots = []
+        self.free_slots = []
+        self.slots_count = 0
+        self.directory_outdated = True
+
+        open(self.rows_file_path, "wb").close()
+
+        block = []
+        for offset in offsets:
+            block.append(offset)
+            if len(block) == self.block_capacity:
+                self.append(block)
+                block = []
+
+        self.append(block)
+
+    def save(self):
+        if not self.loaded or not self.directory_outdated:
+            return
+
+        mode = "rb+" if os.path.exists(self.rows_file_path) else "wb"
+        try:
+            with open(self.rows_file_path, mode) as f:
+                for slot in self.dirty_slots:
+                    offsets_bytes = struct.pack(f"<{len(self.blocks[slot])}q", *self.blocks[slot])
+                    f.seek(slot * self.block_size)
+                    f.write(struct.pack(BLOCK_HEADER_FORMAT, len(self.blocks[slot]),
+                                        compute_checksum(offsets_bytes, self.checksum)) + offsets_bytes)
+
+            entries = b"".join(struct.pack(DIRECTORY_ENTRY_FORMAT, self.block_slots[i], self.block_counts[i])
+                               for i in range(len(self.block_slots)))
+            with open(self.directory_file_path, "wb") as f:
+                f.write(struct.pack(DIRECTORY_HEADER_FORMAT, ROW_DIRECTORY_MAGIC, len(self.block_slots),
+                                    compute_checksum(entries, self.checksum)) + entries)
+        except OSError as e:
+            raise TableError(f"Error saving the row directory: {e}")
+
+        self.dirty_slots = []
+        self.directory_outdated = False
+
+    def delete_files(self):
+        for file_path in (self.rows_file_path, self.directory_file_path):
+            if os.path.exists(file_path):
+                os.remove(file_path)
@@ -1,28 +1,37 @@
 import os
 import struct
 import sys
+from contextlib import contextmanager, ExitStack
+from itertools import chain
 from typing import List
 
 from data_structures.dynamic_queue import DynamicQueue
 from data_structures.hash_table import HashTable
-from db_components.freeslot import FreeSlot
-from db_components.index import TableIndex
+from db_components.hash_distinct_handler import HashDistinctHandler
+from db_components.index import TableIndex, BTREE_INDEX
 from db_components.merge_sort_handler import MergeSortHandler
 from db_components.metadata import Metadata
+from db_components.paged_file import PagedFile
+from db_components.row_decoder import RowDecoder
+from db_components.row_directory import RowDirectory
 from query_parser_package.expressions import BinaryOpNode, NotNode, ValueNode
 from utils.date import Date
 from utils.errors import TableError, ParseError
-from settings import PBDB_FILES_PATH
-from utils.extra import polynomial_rolling_hash, intersect_unsorted, union_unsorted, difference_unsorted
+from settings import PBDB_FILES_PATH, INSERT_BATCH_SIZE, CHECKSUM_ALGORITHM, CHECKSUM_VERIFY
+from utils.checksum import compute_checksum, validate_checksum_algorithm
+from utils.extra import incremental_generator_sort, intersect_offsets, union_offsets
 from utils.table_random_values_generator import generate_random_rows
 
 
 class TableNode:
-    def __init__(self, row_data: HashTable | None = None, position=-1, previous_position=-1, next_position=-1):
+    def __init__(self, row_data: HashTable | None = None, position=-1, previous_position=-1, next_position=-1,
+                 row_bytes: bytes | None = None):
         self.row_data = row_data if row_data is not None else HashTable()
         self.position = position
         self.previous_position = previous_position
         self.next_position = next_position
+        # Serialized row of a node loaded without decoding it (see RowDecoder)
+        self.row_bytes = row_bytes
 
     def __str__(self):
         return f"Prev: {self.previous_position}, Pos: {self.position}, Next: {self.next_position}"
@@ -51,6 +60,38 @@ class Table:
             raise TableError(f"Metadata file of '{self.table_name}' not found!")
 
         self.metadata = Metadata.load_metadata(self.metadata_file_path)
+        self.data_file = PagedFile(self.data_file_path)
+        self.row_directory = Table._open_row_directory(self.directory, self.table_name, self.metadata.checksum)
+
+    def close(self):
+        self.data_file.close()
+
+    @staticmethod
+    def _open_row_directory(directory: str, table_name: str, checksum: str) -> RowDirectory:
+        return RowDirectory(rows_file_path=os.path.join(directory, f"{table_name}.rows"),
+                            directory_file_path=os.path.join(directory, f"{table_name}.rowdir"),
+                            checksum=checksum)
+
+    def _load_row_directory(self) -> RowDirectory:
+        """
+            Tables created before the row directory existed (or with a directory out of sync
+            with the metadata) get it rebuilt with one scan of the row chain.
+        """
+        if not self.row_directory.exists():
+            self.row_directory.rebuild(node.position for node in self._scan_nodes())
+            self.row_directory.save()
+            return self.row_directory
+
+        self.row_directory.load()
+        if self.row_directory.rows_count != self.metadata.rows_count:
+            self.row_directory.rebuild(node.position for node in self._scan_nodes())
+            self.row_directory.save()
+
+        return self.row_directory
+
+    def _save_changes(self):
+        self.metadata.save_counters()
+        self.row_directory.save()
 
     @staticmethod
     def check_given_name(name: str) -> bool:
@@ -83,9 +124,14 @@ class Table:
 
         metadata = Metadata(table_name=table_name,
                             columns=columns,
-                            metadata_file_path=metadata_file_path)
+                            metadata_file_path=metadata_file_path,
+                            checksum=validate_checksum_algorithm(CHECKSUM_ALGORITHM))
         metadata.save_metadata()
 
+        row_directory = Table._open_row_directory(directory, table_name, metadata.checksum)
+        row_directory.rebuild([])
+        row_directory.save()
+
         open(data_file_path, "w").close()
 
     def serialize_table_row(self, node: TableNode) -> bytes:
@@ -131,64 +177,104 @@ class Table:
                 elif col.column_type == "date":
                     value_bytes = row_data[offset:offset + 10]
                     offset += 10  # -> Date object always has a length of 10
-                    row[column_name] = Date.from_string(value_bytes.decode())
+                    row[column_name] = Date.from_bytes(value_bytes)
         except ValueError as ve:
             raise TableError(f"Corrupted file: cannot decode row data: {ve}")
 
         return row
 
-    def serialize_table_node(self, node: TableNode):
-        row_bytes = self.serialize_table_row(node)
+    def serialize_table_node(self, node: TableNode, row_bytes: bytes | None = None):
+        if row_bytes is None:
+            row_bytes = self.serialize_table_row(node)
         header = struct.pack("iii", node.previous_position, node.next_position, len(row_bytes))
 
-        node_hash_val = polynomial_rolling_hash(header + row_bytes)
+        node_hash_val = compute_checksum(header + row_bytes, self.metadata.checksum)
         row_hash_bytes = struct.pack("I", node_hash_val)
 
         return row_hash_bytes + header + row_bytes
 
-    def save_table_node(self, node: TableNode, data_path=None):
-        if data_path is None:
-            data_path = self.data_file_path
+    def save_table_node(self, node: TableNode, data_file: PagedFile | None = None):
+        if data_file is None:
+            data_file = self.data_file
 
         node_bytes_data = self.serialize_table_node(node)
+        data_file.write(node.position, node_bytes_data)
+
+    def load_table_node(self, position: int, data_file: PagedFile | None = None, decode_row: bool = True) -> TableNode:
+        if data_file is None:
+            data_file = self.data_file
+
+        node, _ = self._read_table_node(position, data_file, decode_row=decode_row)
+        return node
+
+    def _read_table_node(self, position: int, data_file: PagedFile, read_ahead: bool = False,
+                         decode_row: bool = True) -> tuple:
+        """
+            Decode the node at `position`, reading through the page cache or the read-ahead window.
+            With decode_row=False only the row bytes are kept in node.row_bytes.
+            Returns the node and its size in the data file.
+        """
+        read = data_file.read_ahead if read_ahead else data_file.read
+        header_size = struct.calcsize("iii")
+        node_header = read(position, 4 + header_size)  # -> struct.calcsize("I") == 4
+        cold_read = data_file.last_read_cold
+
+        if len(node_header) < 4:
+            raise TableError(f"Corrupted file: cannot read the node hash")
+        stored_hash_val = struct.unpack("I", node_header[:4])[0]
+        header = node_header[4:]
+
+        if len(header) != header_size:
+            raise TableError(f"Corrupted file: cannot read the node header")
+
+        previous_position, next_position, row_size = struct.unpack("iii", header)
+        if row_size < 0:
+            raise TableError(f"Corrupted file: row size corrupted")
+
+        row_data_bytes = read(position + 4 + header_size, row_size)
+        cold_read = cold_read or data_file.last_read_cold
+
+        # With CHECKSUM_VERIFY = "cold", nodes served only from cached pages are not verified again
+        if CHECKSUM_VERIFY == "always" or cold_read:
+            computed_hash_val = compute_checksum(header + row_data_bytes, self.metadata.checksum)
+            if computed_hash_val != stored_hash_val:
+                raise TableError(f"Corrupted file: data corruption detected for node at position {position}")
+
+        if not decode_row:
+            node = TableNode(row_bytes=row_data_bytes,
+                             position=position, previous_position=previous_position, next_position=next_position)
+            return node, 4 + header_size + row_size
 
-        with open(data_path, "rb+") as file:
-            file.seek(node.position)
-            file.write(node_bytes_data)
-            file.flush()
-
-    def load_table_node(self, position: int, data_path=None) -> TableNode:
-        if data_path is None:
-            data_path = self.data_file_path
-
-        with open(data_path, "rb") as file:
-            file.seek(position)
-            stored_hash_bytes = file.read(4)  # -> struct.calcsize("I") == 4
-
-            if len(stored_hash_bytes) != 4:
-                raise TableError(f"Corrupted file: cannot read the node hash")
-            stored_hash_val = struct.unpack("I", stored_hash_bytes)[0]
-            header_size = struct.calcsize("iii")
-            header = file.read(header_size)
-
-            if len(header) != header_size:
-                raise TableError(f"Corrupted file: cannot read the node header")
+        row_data = self.deserialize_table_row(row_data_bytes)
 
-            previous_position, next_position, row_size = struct.unpack("iii", header)
-            if row_size < 0:
-                raise TableError(f"Corrupted file: row size corrupted")
+        node = TableNode(row_data=row_data,
+                         position=position, previous_position=previous_position, next_position=next_position)
+        return node, 4 + header_size + row_size
 
-            row_data_bytes = file.read(row_size)
+    def _scan_nodes(self, decode_rows: bool = True):
+        """
+            Walk the row chain from the first to the last node.
 
-        computed_hash_val = polynomial_rolling_hash(header + row_data_bytes)
+            While the chain is laid out in file order (e.g. after DEFRAGMENT), nodes are decoded
+            from large read-ahead blocks of the data file. Only when the next node jumps outside
+            the buffered window of a non-sequential chain is it loaded on its own.
+            The next position is taken before yielding, so the caller may modify or delete the node.
+        """
+        current_offset = self.metadata.first_offset
+        sequential = True
 
-        if computed_hash_val != stored_hash_val:
-            raise TableError(f"Corrupted file: data corruption detected for node at position {position}")
+        while current_offset != -1:
+            if sequential or self.data_file.in_read_ahead_window(current_offset):
+                node, node_size = self._read_table_node(current_offset, self.data_file, read_ahead=True,
+                                                        decode_row=decode_rows)
+            else:
+                node, node_size = self._read_table_node(current_offset, self.data_file, decode_row=decode_rows)
 
-        row_data = self.deserialize_table_row(row_data_bytes)
+            next_offset = node.next_position
+            sequential = next_offset == current_offset + node_size
 
-        return TableNode(row_data=row_data,
-                         position=position, previous_position=previous_position, next_position=next_position)
+            yield node
+            current_offset = next_offset
 
     def validate_row(self, row: HashTable) -> HashTable:
         metadata_columns = [col for col in self.metadata.columns.items()]
@@ -211,163 +297,242 @@ class Table:
         return row
 
     def insert(self, row: HashTable):
-        validated_row = self.validate_row(row)
-        new_node = TableNode(row_data=validated_row)
+        self.insert_values([row])
+
+    def _insert_batch(self, rows: List[HashTable]):
+        """
+            Insert a batch of rows as one chain segment:
+            - every row is validated and serialized before anything is written;
+            - nodes are linked to each other in memory and the ones appended at the end
+              of the table are written with a single write;
+            - the previous tail node is patched once.
+            The metadata is NOT saved - that is left to the caller.
+        """
+        if not rows:
+            return
 
-        node_bytes = self.serialize_table_node(new_node)
-        node_size = len(node_bytes)
+        header_size = 4 + struct.calcsize("iii")  # -> struct.calcsize("I") == 4
 
-        position = None
-        for slot in self.metadata.free_slots:
-            if node_size <= slot.slot_length:
-                position = slot.slot_position
-                self.metadata.free_slots.remove(slot)
-                break
-
-        if position is None:
-            position = self.metadata.table_end
-            self.metadata.table_end += node_size
+        new_nodes = []
+        nodes_row_bytes = []
+        for row in rows:
+            validated_row = self.validate_row(row)
+            new_node = TableNode(row_data=validated_row)
+            new_nodes.append(new_node)
+            nodes_row_bytes.append(self.serialize_table_row(new_node))
+
+        append_start = self.metadata.table_end
+        appended_count = 0
+        for i in range(len(new_nodes)):
+            node_size = header_size + len(nodes_row_bytes[i])
+
+            position = self.metadata.allocate_slot(node_size)
+            if position is None:
+                position = self.metadata.table_end
+                self.metadata.table_end += node_size
+                appended_count += 1
+
+            new_nodes[i].position = position
+
+        old_last_offset = self.metadata.last_offset
+        for i in range(len(new_nodes)):
+            new_nodes[i].previous_position = new_nodes[i - 1].position if i > 0 else old_last_offset
+            new_nodes[i].next_position = new_nodes[i + 1].position if i < len(new_nodes) - 1 else -1
+
+        appended_bytes = []
+        for i in range(len(new_nodes)):
+            node_bytes = self.serialize_table_node(new_nodes[i], nodes_row_bytes[i])
+
+            if new_nodes[i].position >= append_start:
+                appended_bytes.append(node_bytes)
+            else:
+                self.data_file.write(new_nodes[i].position, node_bytes)
 
-        new_node.position = position
+        if appended_count > 0:
+            self.data_file.write(append_start, b"".join(appended_bytes))
 
-        if self.metadata.last_offset == -1:
-            self.metadata.first_offset = position
-            self.metadata.last_offset = position
-            new_node.previous_position = -1
+        if old_last_offset == -1:
+            self.metadata.first_offset = new_nodes[0].position
         else:
-            last_node = self.load_table_node(self.metadata.last_offset)
-            last_node.next_position = position
-
+            last_node = self.load_table_node(old_last_offset)
+            last_node.next_position = new_nodes[0].position
             self.save_table_node(last_node)
-            new_node.previous_position = self.metadata.last_offset
 
-            self.metadata.last_offset = position
+        self.metadata.last_offset = new_nodes[-1].position
 
-        new_node.next_position = -1
-        self.save_table_node(new_node)
-        self._add_row_to_indexes(new_node)
-        self.metadata.rows_count += 1
-        self.metadata.save_metadata()
+        # A missing directory is built from the chain once it is needed
+        if self.row_directory.exists():
+            self.row_directory.append([new_node.position for new_node in new_nodes])
 
-    def get_rows(self, row_numbers: List[int]):
+        with self._deferred_index_headers():
+            for new_node in new_nodes:
+                self._add_row_to_indexes(new_node)
+
+        self.metadata.rows_count += len(new_nodes)
+
+    def _requested_row_numbers(self, row_numbers: List[int]) -> List[int]:
+        """
+            Returns the distinct existing row numbers in ascending order.
+        """
         rows_queue = DynamicQueue.from_list_sorted(row_numbers)
 
         start_rows = self.metadata.rows_count
         if rows_queue.length > start_rows:
             raise TableError(f"Too many rows! Table '{self.table_name}' has only {start_rows} rows!")
 
-        current_offset = self.metadata.first_offset
-        current_row = 1
-
-        while current_offset != -1 and rows_queue.length > 0:
-            target_row = rows_queue.peek()
-            if target_row is not None and target_row > start_rows:
+        requested_rows = []
+        while rows_queue.length > 0:
+            row_number = rows_queue.dequeue().value
+            if row_number > start_rows:
                 break
-            node = self.load_table_node(current_offset)
 
-            if current_row == target_row:
-                yield node.row_data
-                rows_queue.dequeue()
+            if row_number >= 1 and (not requested_rows or requested_rows[-1] != row_number):
+                requested_rows.append(row_number)
+
+        return requested_rows
+
+    def get_rows(self, row_numbers: List[int]):
+        requested_rows = self._requested_row_numbers(row_numbers)
+        row_directory = self._load_row_directory()
 
-            current_offset = node.next_position
-            current_row += 1
+        for row_number in requested_rows:
+            yield self.load_table_node(row_directory.locate(row_number)).row_data
 
-    def _delete(self, node: TableNode):
-        if node.previous_position != -1:
-            prev_node = self.load_table_node(node.previous_position)
-            prev_node.next_position = node.next_position
+    def _link_nodes(self, previous_position: int, next_position: int):
+        if previous_position != -1:
+            prev_node = self.load_table_node(previous_position)
+            prev_node.next_position = next_position
             self.save_table_node(prev_node)
         else:
-            self.metadata.first_offset = node.next_position
+            self.metadata.first_offset = next_position
 
-        if node.next_position != -1:
-            next_node = self.load_table_node(node.next_position)
-            next_node.previous_position = node.previous_position
+        if next_position != -1:
+            next_node = self.load_table_node(next_position)
+            next_node.previous_position = previous_position
             self.save_table_node(next_node)
         else:
-            self.metadata.last_offset = node.previous_position
-
-        self._delete_row_from_indexes(node)
+            self.metadata.last_offset = previous_position
+
+    def _delete_nodes(self, nodes: List[TableNode], row_numbers: List[int] | None = None):
+        """
+            Delete a set of collected nodes:
+            - every run of adjacent nodes in the chain is unlinked with one fix-up of its two neighbours;
+            - the pointers are removed from each index once per key;
+            - the metadata and the row directory are saved once.
+            row_numbers - the ascending 1-based row numbers of the nodes, if known.
+        """
+        if not nodes:
+            return
 
-        node_size = len(self.serialize_table_node(node))
-        free_slot = FreeSlot(node.position, node_size)
-        self.metadata.free_slots.append(free_slot)
+        self._rebuild_outdated_indexes()
+        if self.row_directory.exists():
+            self._load_row_directory()
+
+        # Offsets coming from an index plan may repeat
+        nodes_by_position = HashTable(size=len(nodes))
+        unique_nodes = []
+        for node in nodes:
+            if nodes_by_position[node.position] is None:
+                nodes_by_position[node.position] = node
+                unique_nodes.append(node)
+        nodes = unique_nodes
+
+        for node in nodes:
+            if nodes_by_position[node.previous_position] is not None:
+                continue  # -> not the first node of its run
+
+            last_node = node
+            while nodes_by_position[last_node.next_position] is not None:
+                last_node = nodes_by_position[last_node.next_position]
+
+            self._link_nodes(node.previous_position, last_node.next_position)
+
+        with self._deferred_index_headers():
+            for col_name, index in self.metadata.indexes.items():
+                pointers_by_key = HashTable(size=len(nodes))
+                keys = []
+                for node in nodes:
+                    key = node.row_data[col_name]
+                    key_pointers = pointers_by_key[key]
+                    if key_pointers is None:
+                        key_pointers = []
+                        pointers_by_key[key] = key_pointers
+                        keys.append(key)
+                    key_pointers.append(node.position)
+
+                for key in keys:
+                    index.remove_elements_from_index(key, pointers_by_key[key])
+
+        for node in nodes:
+            self.metadata.release_slot(node.position, len(self.serialize_table_node(node)))
+
+        if self.row_directory.exists():
+            if row_numbers is not None:
+                self.row_directory.remove_rows(row_numbers)
+            else:
+                self.row_directory.remove_offsets(nodes_by_position)
 
-        self.metadata.rows_count -= 1
+        self.metadata.rows_count -= len(nodes)
+        self._save_changes()
 
     def delete_rows(self, row_numbers: List[int]):
-        rows_queue = DynamicQueue.from_list_sorted(row_numbers)
-
-        start_rows = self.metadata.rows_count
-        if rows_queue.length > start_rows:
-            raise TableError(f"Too many rows! Table '{self.table_name}' has only {start_rows} rows!")
-
-        current_offset = self.metadata.first_offset
-        current_row = 1
-
-        while current_offset != -1 and rows_queue.length > 0:
-            target_row = rows_queue.peek()
-            if target_row is not None and target_row > start_rows:
-                break
-            node = self.load_table_node(current_offset)
+        requested_rows = self._requested_row_numbers(row_numbers)
+        row_directory = self._load_row_directory()
 
-            if current_row == target_row:
-                try:
-                    self._delete(node)
-                    self.metadata.save_metadata()
-                except Exception as e:
-                    raise TableError(f"Error occurred with deleting row at {node.position} with values: {node.row_data}")
-                rows_queue.dequeue()
+        nodes = [self.load_table_node(row_directory.locate(row_number)) for row_number in requested_rows]
 
-            current_offset = node.next_position
-            current_row += 1
+        try:
+            self._delete_nodes(nodes, requested_rows)
+        except TableError as e:
+            raise TableError(f"Error occurred with deleting rows {requested_rows}: {e}")
 
     def defragment(self):
         temp_file_path = self.data_file_path + ".temp"
-        open(temp_file_path, "wb+").close()
 
         current_offset = 0
-        new_first_offset = -1
         new_last_offset = -1
         row_count = 0
+        new_positions = []
 
-        old_offset = self.metadata.first_offset
-        if old_offset != -1:
-            new_first_offset = 0
+        # The new chain is written in file order, so the next position of every node is known upfront
+        with open(temp_file_path, "wb") as temp_file:
+            for node in self._scan_nodes():
+                has_next = node.next_position != -1
 
-        while old_offset != -1:
-            node = self.load_table_node(old_offset)
+                node_size = 4 + struct.calcsize("iii") + len(self.serialize_table_row(node))
 
-            old_offset = node.next_position
+                node.previous_position = new_last_offset
+                node.position = current_offset
+                node.next_position = current_offset + node_size if has_next else -1
 
-            node.previous_position = new_last_offset
-            node.position = current_offset
+                node_bytes = self.serialize_table_node(node)
+                temp_file.write(node_bytes)
 
-            if new_last_offset != -1:
-                last_node = self.load_table_node(new_last_offset, temp_file_path)
-                last_node.next_position = node.position
-                self.save_table_node(last_node, temp_file_path)
+                new_last_offset = node.position
+                new_positions.append(node.position)
+                current_offset += len(node_bytes)
+                row_count += 1
 
-            node.next_position = -1
-            self.save_table_node(node, temp_file_path)
+        new_first_offset = 0 if row_count > 0 else -1
 
-            new_last_offset = node.position
-            current_offset += len(self.serialize_table_node(node))
-            row_count += 1
+        self.data_file.close()
 
         old_path = self.data_file_path
         os.remove(self.data_file_path)
         os.rename(temp_file_path, old_path)
+        self.data_file = PagedFile(self.data_file_path)
 
         self.metadata.first_offset = new_first_offset
         self.metadata.last_offset = new_last_offset
         self.metadata.rows_count = row_count
         self.metadata.table_end = current_offset
-        self.metadata.free_slots = []
+        self.metadata.clear_free_slots()
 
         self._recreate_index_tree()
+        self.row_directory.rebuild(new_positions)
 
         self.metadata.save_metadata()
+        self.row_directory.save()
 
     def drop_table(self):
         if (not os.path.join(PBDB_FILES_PATH, self.table_name)
@@ -378,44 +543,92 @@ class Table:
         for _, index in self.metadata.indexes.items():
             index.delete_index()
 
+        self.close()
         os.remove(self.data_file_path)
-        os.remove(self.metadata_file_path)
+        self.metadata.delete_files()
+        self.row_directory.delete_files()
 
         try:
             os.rmdir(self.directory)
         except Exception as e:
             raise TableError(f"Failed to remove directory {self.directory}: {e}")
 
+    @contextmanager
+    def _deferred_index_headers(self):
+        """
+            Write the file headers of every index once, after the whole block is done.
+        """
+        with ExitStack() as stack:
+            for _, index in self.metadata.indexes.items():
+                stack.enter_context(index.deferred_headers())
+            yield
+
     def _add_row_to_indexes(self, node: TableNode):
         for col_name, index in self.metadata.indexes.items():
             index.add_element_to_index(node.row_data[col_name], node.position)
 
-    def _delete_row_from_indexes(self, node: TableNode):
-        for col_name, index in self.metadata.indexes.items():
-            index.remove_element_from_index(node.row_data[col_name], node.position)
-
     def _recreate_index_tree(self):
-        for _, index in self.metadata.indexes.items():
-            index.delete_index()
-            new_index = TableIndex.create_index(index_name=index.index_name,
-                                                column=index.column,
-                                                index_path=index.index_path,
-                                                pointer_list_path=index.pointer_list_data_path)
-            self._create_index_tree(new_index)
-
-    def _create_index_tree(self, index: TableIndex):
-        index_column = index.column
-        current_offset = self.metadata.first_offset
+        for column_name, index in self.metadata.indexes.items():
+            self._rebuild_index(column_name, index)
+
+    def _rebuild_index(self, column_name: str, index: TableIndex):
+        index.delete_index()
+        new_index = TableIndex.create_index(index_name=index.index_name,
+                                            column=index.column,
+                                            index_path=index.index_path,
+                                            pointer_list_path=index.pointer_list_data_path,
+                                            t=index.index_tree.t,
+                                            checksum=index.checksum,
+                                            index_type=index.index_type)
+        self._create_index_tree(new_index)
+        self.metadata.indexes[column_name] = new_index
 
-        while current_offset != -1:
-            node = self.load_table_node(current_offset)
+    def _rebuild_outdated_indexes(self):
+        """
+            Indexes whose pointer lists use an older file format get rebuilt with one scan of the table.
+            Called before the first change of the rows - queries skip the outdated indexes instead.
+        """
+        for column_name, index in self.metadata.indexes.items():
+            if index.outdated:
+                self._rebuild_index(column_name, index)
+
+    def _usable_index(self, column_name: str) -> TableIndex | None:
+        """
+            The index of the column, unless there is none or it is outdated (and waits for a rebuild).
+        """
+        index = self.metadata.indexes.search(column_name)
+        if index is None or index.outdated:
+            return None
+        return index
 
-            column_key = node.row_data[index_column.column_name]
-            index.add_element_to_index(column_key, node.position)
+    def _create_index_tree(self, index: TableIndex):
+        """
+            Sort all (key, row offset) pairs of the column with an external merge sort
+            and load them into the new index bottom-up.
+        """
+        index_column_name = index.column.column_name
+
+        def index_entries():
+            for node in self._scan_nodes():
+                yield HashTable([("key", node.row_data[index_column_name]), ("offset", node.position)], size=2)
+
+        # The offset is added as a tie-break, so pointers of the same key stay in file order
+        merge_sort_handler = MergeSortHandler(self.directory, f"{self.table_name}_{index.index_name}",
+                                              order_by_col="key",
+                                              distinct_cols=HashTable([("key", None), ("offset", None)], size=2))
+        sorted_index_entries = merge_sort_handler.sort(index_entries())
+
+        def sorted_entries():
+            for entry in sorted_index_entries:
+                yield entry["key"], entry["offset"]
 
-            current_offset = node.next_position
+        try:
+            index.bulk_load(sorted_entries)
+        finally:
+            sorted_index_entries.close()
 
-    def create_new_index(self, index_name: str, column_name: str):
+    def create_new_index(self, index_name: str, column_name: str, order: int | None = None,
+                         index_type: str = BTREE_INDEX):
         column = self.metadata.columns[column_name]
 
         if column is None:
@@ -435,7 +648,10 @@ class Table:
         new_index = TableIndex.create_index(index_name=index_name,
                                             column=column,
                                             index_path=index_path,
-                                            pointer_list_path=index_extra_data)
+                                            pointer_list_path=index_extra_data,
+                                            t=order,
+                                            checksum=self.metadata.checksum,
+                                            index_type=index_type)
         self._create_index_tree(new_index)
 
         self.metadata.indexes[column_name] = new_index
@@ -460,12 +676,47 @@ class Table:
 
         raise TableError(f"Index '{index_name}' does not exist!")
 
+    def vacuum_index(self, index_name: str) -> HashTable:
+        """
+            Compact the pointer lists file of the index. Returns its size before and after.
+        """
+        for column_name, index in self.metadata.indexes.items():
+            if index.index_name == index_name:
+                size_before = os.path.getsize(index.pointer_list_data_path)
+                if index.outdated:
+                    self._rebuild_index(column_name, index)
+                else:
+                    index.vacuum()
+                return HashTable([("size_before", size_before),
+                                  ("size_after", os.path.getsize(index.pointer_list_data_path))])
+
+        raise TableError(f"Index '{index_name}' does not exist!")
+
+    def reindex(self, index_name: str) -> HashTable:
+        """
+            Rewrite the index compactly in key order. Returns the size of its files before and after.
+        """
+        for column_name, index in self.metadata.indexes.items():
+            if index.index_name == index_name:
+                size_before = os.path.getsize(index.index_path) + os.path.getsize(index.pointer_list_data_path)
+                if index.outdated:
+                    self._rebuild_index(column_name, index)
+                else:
+                    index.reindex()
+                size_after = os.path.getsize(index.index_path) + os.path.getsize(index.pointer_list_data_path)
+                return HashTable([("size_before", size_before), ("size_after", size_after)])
+
+        raise TableError(f"Index '{index_name}' does not exist!")
+
     def tableinfo(self):
         return self.metadata.display_table_metadata(self.data_file_path)
 
     def insert_values(self, rows: List[HashTable]):
-        for row in rows:
-            self.insert(row)
+        self._rebuild_outdated_indexes()
+        # Every written batch is saved, so a row failing validation in a later batch leaves a consistent table
+        for batch_start in range(0, len(rows), INSERT_BATCH_SIZE):
+            self._insert_batch(rows[batch_start:batch_start + INSERT_BATCH_SIZE])
+            self._save_changes()
 
     def insert_random(self, columns_names: List[str], count: int):
         table_columns_names = [column_name for column_name, _ in self.metadata.columns.items()]
@@ -476,25 +727,24 @@ class Table:
             extracted_columns.append(self.metadata.columns[col_name])
 
         new_rows = generate_random_rows(extracted_columns, count)
+        self._rebuild_outdated_indexes()
 
+        batch = []
         for row in new_rows:
-            self.insert(row)
-
-    def _full_scan(self, columns: HashTable):
-        current_offset = self.metadata.first_offset
-        while current_offset != -1:
-            node = self.load_table_node(current_offset)
-            yield node.filter_row(columns)
-            current_offset = node.next_position
-
-    def _full_scan_and_filter(self, columns: HashTable, where_expr):
-        current_offset = self.metadata.first_offset
-        while current_offset != -1:
-            node = self.load_table_node(current_offset)
-            row = node.row_data
-            if where_expr.evaluate_expression(row):
-                yield node.filter_row(columns)
-            current_offset = node.next_position
+            batch.append(row)
+            if len(batch) >= INSERT_BATCH_SIZE:
+                self._insert_batch(batch)
+                self._save_changes()
+                batch = []
+
+        self._insert_batch(batch)
+        self._save_changes()
+
+    def _full_scan(self, row_decoder: RowDecoder):
+        for node in self._scan_nodes(decode_rows=False):
+            row = row_decoder.decode(node.row_bytes)
+            if row is not None:
+                yield row
 
     def _parse_index_plan(self, bin_expr):
         def flip_operator(op):
@@ -527,7 +777,7 @@ class Table:
         else:
             return None
 
-        if self.metadata.indexes.search(col_name) is None:
+        if self._usable_index(col_name) is None:
             return None
 
         column = self.metadata.columns[col_name]
@@ -543,122 +793,208 @@ class Table:
         op = plan["op"]
         val = plan["value"]
         index = self.metadata.indexes[col]
-        column = self.metadata.columns[col]
 
         if op == "=":
             return index.search(val)
         elif op == "<":
-            return index.range_search(column, end=val)
+            return index.range_search(end=val, end_inclusive=False)
         elif op == "<=":
-            return index.range_search(column, end=val)
+            return index.range_search(end=val)
         elif op == ">":
-            return index.range_search(column, start=val)
+            return index.range_search(start=val, start_inclusive=False)
         elif op == ">=":
-            return index.range_search(column, start=val)
+            return index.range_search(start=val)
         elif op == "!=":
-            matched = index.search(val)
-            all_val = index.range_search(column)
-
-            return difference_unsorted(all_val, matched)
+            return chain(index.range_search(end=val, end_inclusive=False),
+                         index.range_search(start=val, start_inclusive=False))
 
         return None
 
-    def _evaluate_expression_for_index(self, where_expr):
+    def _evaluate_expression_for_index(self, where_expr, sorted_offsets: bool = False):
+        """
+            Offsets of the rows matching the condition through the indexes, or None if it needs a full scan.
+            AND / OR merge the sorted offsets of their sides - the pointers of a single key already come sorted,
+            only the results of range conditions are sorted first.
+        """
         if isinstance(where_expr, BinaryOpNode):
             op_up = where_expr.operator
             if op_up == "AND":
-                left_offsets = self._evaluate_expression_for_index(where_expr.left)
-                right_offsets = self._evaluate_expression_for_index(where_expr.right)
+                left_offsets = self._evaluate_expression_for_index(where_expr.left, sorted_offsets=True)
+                right_offsets = self._evaluate_expression_for_index(where_expr.right, sorted_offsets=True)
 
                 if left_offsets is None or right_offsets is None:
                     return None
 
-                return intersect_unsorted(left_offsets, right_offsets)
+                return intersect_offsets(left_offsets, right_offsets)
             elif op_up == "OR":
-                left_offsets = self._evaluate_expression_for_index(where_expr.left)
-                right_offsets = self._evaluate_expression_for_index(where_expr.right)
+                left_offsets = self._evaluate_expression_for_index(where_expr.left, sorted_offsets=True)
+                right_offsets = self._evaluate_expression_for_index(where_expr.right, sorted_offsets=True)
 
                 if left_offsets is None or right_offsets is None:
                     return None
 
-                return union_unsorted(left_offsets, right_offsets)
+                return union_offsets(left_offsets, right_offsets)
             else:
                 plan = self._parse_index_plan(where_expr)
 
                 if plan is None:
                     return None
 
-                return self._execute_index_plan(plan)
+                offsets = self._execute_index_plan(plan)
+                if offsets is not None and sorted_offsets and plan["op"] != "=":
+                    return incremental_generator_sort(offsets)
+                return offsets
         return None
 
+    def _index_ordered_scan(self, columns: HashTable, where_expr, order_by):
+        """
+            Rows in the order of the ORDER BY column's index, filtered while they are read.
+        """
+        row_decoder = RowDecoder(self.metadata.columns, columns, where_expr)
+
+        index = self.metadata.indexes[order_by.column_name]
+        for offset in index.ordered_search(order_by.direction):
+            row = row_decoder.decode(self.load_table_node(offset, decode_row=False).row_bytes)
+            if row is not None:
+                yield row
+
     def filter(self, columns: HashTable, where_expr):
+        """
+            Only the columns used by the WHERE condition and the selected columns are decoded.
+        """
+        row_decoder = RowDecoder(self.metadata.columns, columns, where_expr)
+
         if where_expr is not None:
             offsets_gen = self._evaluate_expression_for_index(where_expr)
             if offsets_gen is not None:
                 for offset in offsets_gen:
-                    node = self.load_table_node(offset)
-                    row = node.row_data
-
-                    if where_expr.evaluate_expression(row):
-                        yield node.filter_row(columns)
+                    row = row_decoder.decode(self.load_table_node(offset, decode_row=False).row_bytes)
+                    if row is not None:
+                        yield row
                 return
 
-        if where_expr is None:
-            yield from self._full_scan(columns)
-        else:
-            yield from self._full_scan_and_filter(columns, where_expr)
+        yield from self._full_scan(row_decoder)
 
-    def _full_scan_delete(self, where_expr):
-        current_offset = self.metadata.first_offset
-        while current_offset != -1:
-            node = self.load_table_node(current_offset)
-            row = node.row_data
+    def _matching_node(self, node: TableNode, row_decoder: RowDecoder) -> TableNode | None:
+        """
+            Decode the whole row of a node loaded with decode_row=False, if it matches the condition.
+        """
+        node.row_data = row_decoder.decode(node.row_bytes)
+        if node.row_data is None:
+            return None
+
+        node.row_bytes = None
+        return node
+
+    def _full_scan_delete(self, row_decoder: RowDecoder):
+        """
+            Collect the matching nodes (and their row numbers) with one scan, then delete them together.
+        """
+        nodes = []
+        row_numbers = []
+        row_number = 0
 
-            if where_expr.evaluate_expression(row):
-                try:
-                    self._delete(node)
-                    self.metadata.save_metadata()
-                except Exception as e:
-                    raise TableError(f"Error occurred with deleting row at {node.position} with values: {row}")
-            current_offset = node.next_position
+        for node in self._scan_nodes(decode_rows=False):
+            row_number += 1
+            if self._matching_node(node, row_decoder) is not None:
+                nodes.append(node)
+                row_numbers.append(row_number)
+
+        try:
+            self._delete_nodes(nodes, row_numbers)
+        except TableError as e:
+            raise TableError(f"Error occurred with deleting rows of '{self.table_name}': {e}")
 
     def delete_filtered(self, where_expr):
+        """
+            The matching nodes are all collected before anything is deleted - through the index plan
+            when one applies, so the index is not restructured while it is being read.
+        """
         if where_expr is None:
             raise ParseError("Delete WHERE clause empty")
 
-        #  Waaayy too overhead to delete using an index:
-        #  BTree is used to delete, while also elements are being deleted from it which causes restructuring...
-        #  There is even a patent for that...
+        # Index maintenance needs the whole row of every deleted node
+        row_decoder = RowDecoder(self.metadata.columns, self.metadata.columns, where_expr)
+
+        offsets = self._evaluate_expression_for_index(where_expr)
+        if offsets is None:
+            self._full_scan_delete(row_decoder)
+            return
 
-        self._full_scan_delete(where_expr)
+        nodes = []
+        for offset in offsets:
+            node = self._matching_node(self.load_table_node(offset, decode_row=False), row_decoder)
+            if node is not None:
+                nodes.append(node)
 
-    def select_rows(self, columns: HashTable, where_expr, distinct: bool, order_by):
-        filtered_rows = self.filter(columns, where_expr)
+        try:
+            self._delete_nodes(nodes)
+        except TableError as e:
+            raise TableError(f"Error occurred with deleting rows of '{self.table_name}': {e}")
+
+    def select_rows(self, columns: HashTable, where_expr, distinct: bool, order_by, limit: int | None = None,
+                    offset: int = 0, sort_memory: int | None = None):
+        """
+            limit / offset - return at most `limit` rows after skipping the first `offset` ones.
+            Without ORDER BY the scan stops at the last returned row, with ORDER BY only
+            the first offset + limit rows are kept (in a heap) instead of sorting all of them.
+            sort_memory - bytes of rows ORDER BY / DISTINCT may keep in memory (SORT_MEMORY_BUDGET by default).
+
+            ORDER BY an indexed column walks the index instead and needs no sorting at all.
+            DISTINCT is done by hashing while the rows are streamed, unless the rows are sorted anyway.
+        """
+        if limit == 0:
+            return
 
-        if not distinct and not order_by:
-            for row in filtered_rows:
-                yield row
+        index_ordered = order_by is not None and self._usable_index(order_by.column_name) is not None
+        hash_distinct = distinct and (index_ordered or order_by is None or limit is not None)
+
+        if index_ordered:
+            scanned_rows = self._index_ordered_scan(columns, where_expr, order_by)
+        else:
+            scanned_rows = self.filter(columns, where_expr)
+
+        filtered_rows = scanned_rows
+        if hash_distinct:
+            hash_distinct_handler = HashDistinctHandler(self.directory, self.table_name, distinct_cols=columns,
+                                                        memory_budget=sort_memory)
+            filtered_rows = hash_distinct_handler.distinct(scanned_rows,
+                                                           order_by.column_name if index_ordered else None)
+
+        if index_ordered or order_by is None:
+            try:
+                yield from self._limit_rows(filtered_rows, limit, offset)
+            finally:
+                filtered_rows.close()
+                scanned_rows.close()
             return
 
-        distinct_cols = columns if distinct else None
-        order_by_col = order_by.column_name if order_by else None
-        order = order_by.direction if order_by else "ASC"
+        distinct_cols = columns if distinct and not hash_distinct else None
 
         merge_sort_handler = MergeSortHandler(self.directory, self.table_name,
                                               distinct_cols=distinct_cols,
-                                              order_by_col=order_by_col, order=order)
+                                              order_by_col=order_by.column_name, order=order_by.direction,
+                                              memory_budget=sort_memory)
 
-        merged_rows_path = merge_sort_handler.select_merge_sort(filtered_rows)
+        if limit is not None:
+            sorted_rows = merge_sort_handler.top_n(filtered_rows, offset + limit)
+        else:
+            sorted_rows = merge_sort_handler.sort(filtered_rows)
 
-        if not os.path.exists(merged_rows_path):
-            raise TableError(f"MergeSort path '{merged_rows_path}' does not exist!")
+        try:
+            yield from self._limit_rows(sorted_rows, limit, offset)
+        finally:
+            sorted_rows.close()
 
-        with open(merged_rows_path, "rb") as f:
-            while True:
-                row = merge_sort_handler.read_next_row(f)
-                if row is None:
-                    break
-                yield row
+    @staticmethod
+    def _limit_rows(rows, limit: int | None, offset: int):
+        rows_count = 0
+        for row in rows:
+            rows_count += 1
+            if rows_count <= offset:
+                continue
+
+            yield row
 
-        if os.path.exists(merged_rows_path):
-            os.remove(merged_rows_path)
+            if limit is not None and rows_count - offset >= limit:
+                return
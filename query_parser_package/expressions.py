@@ -1,6 +1,13 @@
+import operator
 from abc import ABC, abstractmethod
+
+from data_structures.hash_table import HashTable
 from utils.errors import ParseError
 
+COMPARISON_OPERATORS = HashTable([("=", operator.eq), ("!=", operator.ne),
+                                  ("<", operator.lt), ("<=", operator.le),
+                                  (">", operator.gt), (">=", operator.ge)])
+
 
 class ExpressionNode(ABC):
     """
@@ -11,6 +18,21 @@ class ExpressionNode(ABC):
     def evaluate_expression(self, row):
         pass
 
+    @abstractmethod
+    def compile_expression(self, columns: HashTable):
+        """
+            Returns a function of a row which evaluates the expression.
+            Column names and literal types are checked against the table's `columns` once, here.
+        """
+        pass
+
+    @abstractmethod
+    def column_names(self) -> list:
+        """
+            Names of the columns the expression reads (may repeat).
+        """
+        pass
+
 
 class BinaryOpNode(ExpressionNode):
     def __init__(self, left: ExpressionNode, operator: str, right: ExpressionNode):
@@ -46,6 +68,67 @@ class BinaryOpNode(ExpressionNode):
         except TypeError:
             raise ParseError(f"Comparsion of {left} and {right} not valid!")
 
+    def compile_expression(self, columns: HashTable):
+        left = self.left.compile_expression(columns)
+        right = self.right.compile_expression(columns)
+
+        if self.operator == "AND":
+            return lambda row: left(row) and right(row)
+        if self.operator == "OR":
+            return lambda row: left(row) or right(row)
+
+        compare = COMPARISON_OPERATORS[self.operator]
+        if compare is None:
+            raise ParseError(f"Unknown operator {self.operator}!")
+
+        if not (isinstance(self.left, ValueNode) and isinstance(self.right, ValueNode)):
+            def compare_checked(row):
+                left_value = left(row)
+                right_value = right(row)
+                try:
+                    return compare(left_value, right_value)
+                except TypeError:
+                    raise ParseError(f"Comparsion of {left_value} and {right_value} not valid!")
+
+            return compare_checked
+
+        if not self.left.is_column and not self.right.is_column:
+            try:
+                result = compare(self.left.value, self.right.value)
+            except TypeError:
+                raise ParseError(f"Comparsion of {self.left.value} and {self.right.value} not valid!")
+            return lambda row: result
+
+        self._validate_operand_types(columns)
+
+        if not self.right.is_column:
+            right_value = self.right.value
+            return lambda row: compare(left(row), right_value)
+        if not self.left.is_column:
+            left_value = self.left.value
+            return lambda row: compare(left_value, right(row))
+        return lambda row: compare(left(row), right(row))
+
+    def column_names(self) -> list:
+        return self.left.column_names() + self.right.column_names()
+
+    def _validate_operand_types(self, columns: HashTable):
+        """
+            At least one operand is a column - make sure the operands can be compared in every row.
+        """
+        if self.left.is_column and self.right.is_column:
+            left_column = columns[self.left.value]
+            right_column = columns[self.right.value]
+            if left_column.column_type != right_column.column_type:
+                raise ParseError(f"Comparsion of {left_column.column_type} column {self.left.value} and "
+                                 f"{right_column.column_type} column {self.right.value} not valid!")
+        else:
+            column_node, value_node = (self.left, self.right) if self.left.is_column else (self.right, self.left)
+            try:
+                columns[column_node.value].validate_value_type(value_node.value)
+            except ValueError as e:
+                raise ParseError(f"Query error: {e}")
+
 
 class NotNode(ExpressionNode):
     def __init__(self, expr: ExpressionNode):
@@ -58,6 +141,13 @@ class NotNode(ExpressionNode):
         result = not self.expr.evaluate_expression(row)
         return result
 
+    def compile_expression(self, columns: HashTable):
+        expr = self.expr.compile_expression(columns)
+        return lambda row: not expr(row)
+
+    def column_names(self) -> list:
+        return self.expr.column_names()
+
 
 class ValueNode(ExpressionNode):
     """
@@ -80,3 +170,18 @@ class ValueNode(ExpressionNode):
             return value
         else:
             return self.value
+
+    def compile_expression(self, columns: HashTable):
+        if not self.is_column:
+            value = self.value
+            return lambda row: value
+
+        if columns.search(self.value) is None:
+            raise ParseError(f"Invalid column name in condition: {self.value}")
+
+        column_name = self.value
+        column_hash = HashTable.string_hash(column_name)
+        return lambda row: row.get_with_hash(column_name, column_hash)
+
+    def column_names(self) -> list:
+        return [self.value] if self.is_column else []
@@ -1,6 +1,7 @@
 from typing import List
 
 from data_structures.hash_table import HashTable
+from db_components.index import INDEX_TREES, BTREE_INDEX, TableIndex
 from query_parser_package.expressions import BinaryOpNode, NotNode, ValueNode
 from query_parser_package.substructures import ColumnDef, OrderByItem
 from query_parser_package.tokens import Token, TokenType
@@ -61,6 +62,10 @@ class QueryParser:
             return self.parse_select()
         elif self.current_token.token_type == TokenType.DEFRAGMENT:
             return self.parse_defragment()
+        elif self.current_token.token_type == TokenType.VACUUM:
+            return self.parse_vacuum()
+        elif self.current_token.token_type == TokenType.REINDEX:
+            return self.parse_reindex()
         else:
             self.error(f"Unknown statement starting with token {self.current_token.token_type}")
 
@@ -170,10 +175,38 @@ class QueryParser:
         self.match(TokenType.IDENTIFIER)
         self.match(TokenType.RPAREN)
 
+        index_type = BTREE_INDEX
+        if self.current_token.token_type == TokenType.USING:
+            self.advance()
+            index_type = self.current_token.value
+            if self.current_token.token_type != TokenType.IDENTIFIER or INDEX_TREES.search(index_type) is None:
+                self.error(f"Expected an index type (BTREE or BPLUS) after USING, got {index_type}")
+            self.advance()
+
+        order = None
+        if self.current_token.token_type == TokenType.WITH:
+            self.advance()
+            self.match(TokenType.LPAREN)
+            self.match(TokenType.ORDER)
+            self.match(TokenType.EQ)
+
+            if self.current_token.token_type != TokenType.NUMBER:
+                self.error("Expected a whole number for the index ORDER!")
+
+            order = int(self.current_token.value)
+            if order < 2:
+                self.error("Index ORDER has to be at least 2!")
+            TableIndex.validate_order(order, index_type)
+
+            self.advance()
+            self.match(TokenType.RPAREN)
+
         return st.CreateIndexStatement(
             index_name=index_name_token.value,
             table_name=table_name_token.value,
-            column_name=column_name_token.value
+            column_name=column_name_token.value,
+            order=order,
+            index_type=index_type
         )
 
     @check_end_decorator
@@ -414,14 +447,58 @@ class QueryParser:
                     self.error("Direction can be either ASC or DESC")
             order_by = OrderByItem(col_name, direction)
 
+        limit = None
+        offset = 0
+        if self.current_token.token_type == TokenType.LIMIT:
+            self.advance()
+            limit = self.parse_row_count("LIMIT")
+
+            if self.current_token.token_type == TokenType.OFFSET:
+                self.advance()
+                offset = self.parse_row_count("OFFSET")
+
+        sort_memory = None
+        if self.current_token.token_type == TokenType.WITH:
+            self.advance()
+            self.match(TokenType.LPAREN)
+
+            if self.current_token.token_type != TokenType.IDENTIFIER or self.current_token.value != "SORT_MEMORY":
+                self.error("Expected SORT_MEMORY option in WITH")
+            self.advance()
+            self.match(TokenType.EQ)
+
+            if self.current_token.token_type != TokenType.NUMBER:
+                self.error("Expected a whole number of bytes for SORT_MEMORY!")
+
+            sort_memory = int(self.current_token.value)
+            if sort_memory < 1:
+                self.error("SORT_MEMORY has to be at least 1 byte!")
+
+            self.advance()
+            self.match(TokenType.RPAREN)
+
         return st.SelectStatement(
             columns=columns,
             table_name=table_name,
             distinct=distinct,
             where_expr=where_expr,
-            order_by=order_by
+            order_by=order_by,
+            limit=limit,
+            offset=offset,
+            sort_memory=sort_memory
         )
 
+    def parse_row_count(self, clause: str) -> int:
+        if self.current_token.token_type != TokenType.NUMBER:
+            self.error(f"Expected a whole number of rows after {clause}!")
+
+        count = int(self.current_token.value)
+        if count < 0:
+            self.error(f"{clause} cannot be negative!")
+
+        self.advance()
+        return count
+
     def parse_condition_ast(self):
         """
             Build an ExpressionNode for the WHERE condition recursively.
@@ -515,6 +592,9 @@ class QueryParser:
             TokenType.EOF,
             TokenType.ORDER,
             TokenType.BY,
+            TokenType.WITH,
+            TokenType.LIMIT,
+            TokenType.OFFSET,
             TokenType.SECOL,
             TokenType.DATE,
         ]:
@@ -528,3 +608,30 @@ class QueryParser:
         table_name = table_name_token.value
 
         return st.DefragmentTableStatement(table_name=table_name)
+
+    @check_end_decorator
+    def parse_vacuum(self):
+        self.match(TokenType.VACUUM)
+        self.match(TokenType.INDEX)
+
+        index_name_token = self.current_token
+        self.match(TokenType.IDENTIFIER)
+
+        self.match(TokenType.ON)
+        table_name_token = self.current_token
+        self.match(TokenType.IDENTIFIER)
+
+        return st.VacuumIndexStatement(index_name=index_name_token.value, table_name=table_name_token.value)
+
+    @check_end_decorator
+    def parse_reindex(self):
+        self.match(TokenType.REINDEX)
+
+        index_name_token = self.current_token
+        self.match(TokenType.IDENTIFIER)
+
+        self.match(TokenType.ON)
+        table_name_token = self.current_token
+        self.match(TokenType.IDENTIFIER)
+
+        return st.ReindexStatement(index_name=index_name_token.value, table_name=table_name_token.value)
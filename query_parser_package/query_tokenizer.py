@@ -33,6 +33,12 @@ class QueryTokenizer:
                              ('MAX_SIZE', TokenType.MAX_SIZE),
                              ('RANDOM', TokenType.RANDOM),
                              ('DEFRAGMENT', TokenType.DEFRAGMENT),
+                             ('VACUUM', TokenType.VACUUM),
+                             ('REINDEX', TokenType.REINDEX),
+                             ('WITH', TokenType.WITH),
+                             ('LIMIT', TokenType.LIMIT),
+                             ('OFFSET', TokenType.OFFSET),
+                             ('USING', TokenType.USING),
                              ])
 
     def __init__(self, text: str):
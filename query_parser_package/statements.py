@@ -2,10 +2,12 @@ from abc import ABC, abstractmethod
 from typing import List
 
 from data_structures.hash_table import HashTable
+from db_components.index import BTREE_INDEX
 from db_components.table import Table
 from query_parser_package.expressions import ExpressionNode
 from query_parser_package.substructures import ColumnDef, OrderByItem
 from utils.errors import ParseError
+from utils.extra import format_size
 
 
 class Statement(ABC):
@@ -138,16 +140,23 @@ class DeleteWhereStatement(Statement):
 
 class SelectStatement(Statement):
     def __init__(self, columns: List[str], table_name: str, distinct: bool = False,
-                 where_expr: ExpressionNode | None = None, order_by: OrderByItem | None = None):
+                 where_expr: ExpressionNode | None = None, order_by: OrderByItem | None = None,
+                 limit: int | None = None, offset: int = 0, sort_memory: int | None = None):
         self.columns = columns
         self.table_name = table_name
         self.distinct = distinct
         self.where_expr = where_expr
         self.order_by = order_by
+        self.limit = limit
+        self.offset = offset
+        self.sort_memory = sort_memory
 
     def __repr__(self):
         return (f"SELECT {'DISTINCT' if self.distinct else ''} {self.columns} "
-                f"FROM {self.table_name} WHERE {self.where_expr} ORDER BY {self.order_by};")
+                f"FROM {self.table_name} WHERE {self.where_expr} ORDER BY {self.order_by}"
+                f"{f' LIMIT {self.limit}' if self.limit is not None else ''}"
+                f"{f' OFFSET {self.offset}' if self.offset else ''}"
+                f"{f' WITH (SORT_MEMORY = {self.sort_memory})' if self.sort_memory else ''};")
 
     def execute_statement(self):
         table = Table(self.table_name)
@@ -174,24 +183,32 @@ class SelectStatement(Statement):
         table_selected_rows_generator = table.select_rows(columns=columns_to_show,
                                                           where_expr=self.where_expr,
                                                           distinct=self.distinct,
-                                                          order_by=self.order_by)
+                                                          order_by=self.order_by,
+                                                          limit=self.limit,
+                                                          offset=self.offset,
+                                                          sort_memory=self.sort_memory)
 
         return HashTable([("message", f"Successfully selected rows from {self.table_name}"),
                           ("rows", table_selected_rows_generator), ("columns", columns_to_show), ("table", table)])
 
 
 class CreateIndexStatement(Statement):
-    def __init__(self, index_name: str, table_name: str, column_name: str):
+    def __init__(self, index_name: str, table_name: str, column_name: str, order: int | None = None,
+                 index_type: str = BTREE_INDEX):
         self.index_name = index_name
         self.table_name = table_name
         self.column_name = column_name
+        self.order = order
+        self.index_type = index_type
 
     def __repr__(self):
-        return f"CREATE INDEX {self.index_name} ON {self.table_name} (self.column_name);"
+        return (f"CREATE INDEX {self.index_name} ON {self.table_name} ({self.column_name}) USING {self.index_type}"
+                f"{f' WITH (ORDER = {self.order})' if self.order else ''};")
 
     def execute_statement(self):
         table = Table(self.table_name)
-        table.create_new_index(index_name=self.index_name, column_name=self.column_name)
+        table.create_new_index(index_name=self.index_name, column_name=self.column_name, order=self.order,
+                               index_type=self.index_type)
         return HashTable([("message", f"Successfully created index {self.index_name} for {self.table_name}"), ("table", table)])
 
 
@@ -209,6 +226,38 @@ class DropIndexStatement(Statement):
         return HashTable([("message", f"Successfully dropped index {self.index_name} for {self.table_name}"), ("table", table)])
 
 
+class VacuumIndexStatement(Statement):
+    def __init__(self, index_name: str, table_name: str):
+        self.index_name = index_name
+        self.table_name = table_name
+
+    def __repr__(self):
+        return f"VACUUM INDEX {self.index_name} ON {self.table_name};"
+
+    def execute_statement(self):
+        table = Table(self.table_name)
+        sizes = table.vacuum_index(self.index_name)
+        return HashTable([("message", f"Successfully vacuumed index {self.index_name} of {self.table_name}: "
+                                      f"{format_size(sizes['size_before'])} -> {format_size(sizes['size_after'])}"),
+                          ("table", table)])
+
+
+class ReindexStatement(Statement):
+    def __init__(self, index_name: str, table_name: str):
+        self.index_name = index_name
+        self.table_name = table_name
+
+    def __repr__(self):
+        return f"REINDEX {self.index_name} ON {self.table_name};"
+
+    def execute_statement(self):
+        table = Table(self.table_name)
+        sizes = table.reindex(self.index_name)
+        return HashTable([("message", f"Successfully rebuilt index {self.index_name} of {self.table_name}: "
+                                      f"{format_size(sizes['size_before'])} -> {format_size(sizes['size_after'])}"),
+                          ("table", table)])
+
+
 class DefragmentTableStatement(Statement):
     def __init__(self, table_name: str):
         self.table_name = table_name
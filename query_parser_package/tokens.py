@@ -44,6 +44,12 @@ class TokenType:
     ON = 'ON'
     RANDOM = 'RANDOM'
     DEFRAGMENT = 'DEFRAGMENT'
+    VACUUM = 'VACUUM'
+    REINDEX = 'REINDEX'
+    WITH = 'WITH'
+    LIMIT = 'LIMIT'
+    OFFSET = 'OFFSET'
+    USING = 'USING'
 
     # Constraints
     DEFAULT = 'DEFAULT'
@@ -11,8 +11,27 @@ AVAILABLE_QUERIES = [
     "GET ROW row_number_1, row_number_2, ... FROM <table_name>;",
     "DELETE FROM <table_name> ROW row_number_1, row_number_2, ...;",
     "DELETE FROM <table_name> WHERE <expression>;",
-    "SELECT [DISTINCT] [col1, col2, ...] FROM <table_name> [WHERE <expr>] [ORDER BY <col_name> ASC/DESC];",
-    "CREATE INDEX <index_name> ON <table_name> (column_name);",
+    "SELECT [DISTINCT] [col1, col2, ...] FROM <table_name> [WHERE <expr>] [ORDER BY <col_name> ASC/DESC] "
+    "[LIMIT <count> [OFFSET <count>]] [WITH (SORT_MEMORY = <bytes>)];",
+    "CREATE INDEX <index_name> ON <table_name> (column_name) [USING BTREE/BPLUS] [WITH (ORDER = <min_degree>)];",
     "DROP INDEX <index_name> ON <table_name>;",
+    "VACUUM INDEX <index_name> ON <table_name>;",
+    "REINDEX <index_name> ON <table_name>;",
     "DEFRAGMENT <table_name>;"
 ]
+
+DATA_PAGE_SIZE = 4096
+DATA_PAGE_CACHE_SIZE = 256  # -> pages kept in memory per open table data file
+DATA_READ_AHEAD_SIZE = 256 * 1024  # -> bytes read at once while walking a sequentially laid out row chain
+INSERT_BATCH_SIZE = 10_000  # -> rows validated, chained and written together by a single INSERT batch
+BTREE_NODE_SIZE = 4096  # -> target size of a BTree / BPlusTree node, used to derive the default index ORDER
+BTREE_MAX_NODE_SIZE = 1024 * 1024  # -> largest node an explicit index ORDER may produce
+BTREE_NODE_CACHE_SIZE = 1024  # -> deserialized BTree nodes kept in memory per open index
+POINTER_BLOCK_SIZE = 1024  # -> largest block of delta encoded row offsets of duplicate index keys (new indexes)
+CHECKSUM_ALGORITHM = "crc32"  # -> checksum of new tables and temp files: "crc32", "adler32" or "rolling"
+CHECKSUM_VERIFY = "always"  # -> "always" or "cold" - skip verifying table rows served from the page cache
+ROW_DIRECTORY_BLOCK_SIZE = 1024  # -> row offsets per block of the row number directory (GET ROW / DELETE ROW)
+MERGE_SORT_MAX_FAN_IN = 64  # -> sorted runs (open temp files) merged at once, more runs are merged in several passes
+SORT_MEMORY_BUDGET = 64 * 1024 * 1024  # -> bytes of rows ORDER BY / DISTINCT keep in memory before they spill to disk
+SORT_PARALLEL_WORKERS = 0  # -> processes sorting and writing spilled ORDER BY / DISTINCT runs, 0 keeps it in one process
+HASH_DISTINCT_PARTITIONS = 16  # -> temp files DISTINCT splits the rows into once its seen keys outgrow the memory budget
@@ -0,0 +1,31 @@
+import zlib
+
+from utils.extra import polynomial_rolling_hash
+
+# Names of the checksum algorithms as they are stored on disk
+ROLLING_HASH = "rolling"  # -> the original pure Python hash, still used to verify legacy files
+CRC32 = "crc32"
+ADLER32 = "adler32"
+
+CHECKSUM_ALGORITHMS = [ROLLING_HASH, CRC32, ADLER32]
+
+
+def compute_checksum(data: bytes, algorithm: str = ROLLING_HASH) -> int:
+    """
+        Compute an unsigned 32-bit checksum of data.
+        CRC32 and Adler-32 are computed by zlib in C, the rolling hash byte by byte in Python.
+    """
+    if algorithm == CRC32:
+        return zlib.crc32(data)
+    elif algorithm == ADLER32:
+        return zlib.adler32(data)
+    elif algorithm == ROLLING_HASH:
+        return polynomial_rolling_hash(data)
+
+    raise ValueError(f"Unsupported checksum algorithm: {algorithm}")
+
+
+def validate_checksum_algorithm(algorithm: str) -> str:
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise ValueError(f"Unsupported checksum algorithm: {algorithm}")
+    return algorithm
@@ -45,6 +45,16 @@ class Date:
         year = int(parts[2])
         return cls(day, month, year)
 
+    @classmethod
+    def from_bytes(cls, value_bytes: bytes):
+        """
+            Faster from_string() for the fixed 'DD.MM.YYYY' bytes stored in the data files.
+        """
+        if len(value_bytes) != 10 or value_bytes[2:3] != b"." or value_bytes[5:6] != b".":
+            raise ValueError("Date must be in the format 'DD.MM.YYYY'")
+
+        return cls(int(value_bytes[0:2]), int(value_bytes[3:5]), int(value_bytes[6:10]))
+
     @staticmethod
     def is_valid_date_string(date_str):
         parts = custom_split(date_str, '.')
@@ -83,6 +93,9 @@ class Date:
             raise TypeError(f"'==' not supported between instances of '{type(self).__name__}' and '{type(other).__name__}'")
         return self.day == other.day and self.month == other.month and self.year == other.year
 
+    def __hash__(self):
+        return hash((self.year, self.month, self.day))
+
     def __lt__(self, other):
         if not isinstance(other, Date):
             raise TypeError(f"'<' not supported between instances of '{type(self).__name__}' and '{type(other).__name__}'")
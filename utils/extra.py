@@ -1,4 +1,4 @@
-from utils.binary_insertion_sort import binary_insertion_sort
+from data_structures.min_heap import MinHeap
 
 
 def format_size(size_in_bytes):
@@ -22,20 +22,17 @@ def polynomial_rolling_hash(data: bytes, base=257, mod=2 ** 32):
     return hash_val
 
 
-def incremental_generator_sort(gen, buffer_size=1000):
-    buffer = []
+def incremental_generator_sort(gen):
+    """
+        Yield the items of `gen` in ascending order - they are all pushed to a heap
+        and popped one at a time, so the first ones come out before the rest is ordered.
+    """
+    heap = MinHeap()
     for item in gen:
-        buffer.append(item)
-        if len(buffer) >= buffer_size:
-            buffer = binary_insertion_sort(buffer)
-            for sorted_item in buffer:
-                yield sorted_item
-            buffer.clear()
-
-    if buffer:
-        buffer = binary_insertion_sort(buffer)
-        for sorted_item in buffer:
-            yield sorted_item
+        heap.push(item)
+
+    while len(heap) > 0:
+        yield heap.pop()
 
 
 def intersect_offsets(genA, genB):